@@ -0,0 +1,196 @@
+"""Versioned JSON API, served under /api/v1.
+
+The API calls the same service functions as the HTML views (`social` for
+actions, `timeline` and `search` for listings), handing them column-only
+queries so results come back as plain rows rather than ORM objects, and
+answers with compact JSON instead of a redirect and a re-rendered page.
+
+Clients authenticate with the same session cookie as the site. Actions
+use PUT (to do) and DELETE (to undo), which are idempotent, and which a
+cross-site form can't send.
+
+    GET    /api/v1/feed?cursor=             the logged-in user's timeline
+    GET    /api/v1/users/<id>?cursor=       profile and messages
+    GET    /api/v1/messages/<id>            one message
+    GET    /api/v1/search?q=&type=&page=    users or messages
+    GET    /api/v1/trending                 trending messages
+    GET    /api/v1/suggestions              who the logged-in user might follow
+    PUT    /api/v1/users/<id>/follow        follow (DELETE: unfollow)
+    PUT    /api/v1/messages/<id>/like       like (DELETE: unlike)
+"""
+
+from flask import Blueprint, abort, g, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from current_user import forget_snapshot, prime_follow_states
+from models import db, Message, User
+import recommend
+import search
+import social
+import timeline
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# What the API shows of a message (and its author) ...
+MESSAGE_FIELDS = (Message.id, Message.text, Message.timestamp,
+                  Message.user_id, User.username, User.image_url)
+
+# ... of a user in a list ...
+USER_FIELDS = (User.id, User.username, User.image_url, User.header_image_url,
+               User.bio)
+
+# ... and of a user on their profile.
+PROFILE_FIELDS = USER_FIELDS + (User.location, User.messages_count,
+                                User.following_count, User.followers_count,
+                                User.likes_count)
+
+
+def message_rows():
+    return (db.session.query(*MESSAGE_FIELDS)
+            .join(User, User.id == Message.user_id))
+
+
+def serialize_message(row, liked_ids):
+    return {
+        'id': row.id,
+        'text': row.text,
+        'timestamp': row.timestamp.isoformat(),
+        'user': {
+            'id': row.user_id,
+            'username': row.username,
+            'image_url': row.image_url,
+        },
+        'liked': row.id in liked_ids,
+    }
+
+
+def serialize_user(row, fields=USER_FIELDS):
+    data = {column.key: getattr(row, column.key) for column in fields}
+    data['following'] = prime_follow_states([row.id])[row.id]
+    return data
+
+
+def serialize_messages(rows):
+    liked = (User.liked_among(g.user.id, [row.id for row in rows])
+             if g.user else set())
+    return [serialize_message(row, liked) for row in rows]
+
+
+def require_user():
+    if not g.user:
+        abort(401)
+    return g.user
+
+
+def first_or_404(query):
+    row = query.first()
+    if row is None:
+        abort(404)
+    return row
+
+
+@api.errorhandler(HTTPException)
+def http_error(error):
+    return jsonify(error=error.description), error.code
+
+
+##############################################################################
+# Reading
+
+
+@api.route('/feed')
+def feed():
+    user = require_user()
+    page = timeline.home_timeline(user.id, request.args.get('cursor'),
+                                  query=message_rows())
+    return jsonify(items=serialize_messages(page.items),
+                   next_cursor=page.next_cursor)
+
+
+@api.route('/users/<int:user_id>')
+def user(user_id):
+    row = first_or_404(db.session.query(*PROFILE_FIELDS)
+                       .filter(User.id == user_id)
+                       .filter(User.deleted_at.is_(None)))
+    page = timeline.user_messages(user_id, request.args.get('cursor'),
+                                  query=message_rows())
+    return jsonify(user=serialize_user(row, PROFILE_FIELDS),
+                   messages=serialize_messages(page.items),
+                   next_cursor=page.next_cursor)
+
+
+@api.route('/messages/<int:message_id>')
+def message(message_id):
+    row = first_or_404(message_rows().filter(Message.id == message_id)
+                       .filter(User.deleted_at.is_(None)))
+    return jsonify(message=serialize_messages([row])[0])
+
+
+@api.route('/search')
+def search_view():
+    q = request.args.get('q', '')
+    kind = request.args.get('type', 'users')
+    page = request.args.get('page', 1, type=int)
+
+    if kind == 'messages':
+        results = search.search_messages(q, page, query=message_rows())
+        items = serialize_messages(results.items)
+    elif kind == 'users':
+        results = search.search_users(q, page,
+                                      query=db.session.query(*USER_FIELDS))
+        prime_follow_states([row.id for row in results.items])
+        items = [serialize_user(row) for row in results.items]
+    else:
+        abort(400, "type must be 'users' or 'messages'")
+
+    return jsonify(items=items, page=results.page, has_more=results.has_more)
+
+
+@api.route('/trending')
+def trending():
+    rows = recommend.trending(query=message_rows())
+    return jsonify(items=serialize_messages(rows))
+
+
+@api.route('/suggestions')
+def suggestions():
+    user = require_user()
+    rows = recommend.who_to_follow(user.id, limit=10,
+                                   query=db.session.query(*USER_FIELDS))
+    prime_follow_states([row.id for row in rows])
+    return jsonify(items=[serialize_user(row) for row in rows])
+
+
+##############################################################################
+# Actions
+
+
+@api.route('/users/<int:user_id>/follow', methods=['PUT', 'DELETE'])
+def follow(user_id):
+    user = require_user()
+    other = first_or_404(db.session.query(User.id)
+                         .filter(User.id == user_id)
+                         .filter(User.deleted_at.is_(None)))
+
+    following = request.method == 'PUT' and user_id != user.id
+    if request.method == 'PUT':
+        social.follow(user, other)
+    else:
+        social.unfollow(user, other)
+    db.session.commit()
+    forget_snapshot()
+
+    return jsonify(user_id=user_id, following=following)
+
+
+@api.route('/messages/<int:message_id>/like', methods=['PUT', 'DELETE'])
+def like(message_id):
+    user = require_user()
+    msg = first_or_404(db.session.query(Message.id, Message.user_id)
+                       .filter(Message.id == message_id))
+
+    liked = social.set_like(user, msg, request.method == 'PUT')
+    db.session.commit()
+    forget_snapshot()
+
+    return jsonify(message_id=message_id, liked=liked)
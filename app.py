@@ -1,15 +1,41 @@
 import os
+import time
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import (Flask, render_template, request, flash, redirect, session, g,
+                   jsonify)
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
 
+from current_user import (CURR_USER_KEY, LazyUserGlobals,
+                          current_user_snapshot, forget_snapshot,
+                          is_following, liked_message_ids,
+                          prime_follow_states)
+from api import api
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
 from models import db, connect_db, User, Message, Likes, Follows
-
-CURR_USER_KEY = "curr_user"
+from loaders import message_cards, user_cards
+from pagination import paginate
+import counters
+import database
+import fragments
+import graph_index
+import http_cache
+import importer
+import instrumentation
+import jobs
+import live
+import migrations
+import passwords
+import query_plans
+import recommend
+import search
+import social
+import timeline
 
 app = Flask(__name__)
+app.app_ctx_globals_class = LazyUserGlobals
+app.add_template_global(is_following)
 
 # Get DB_URI from environ variable (useful for production/testing) or,
 # if not set there, use development local db.
@@ -18,32 +44,62 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
+for key in ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT',
+            'DB_POOL_RECYCLE'):
+    if key in os.environ:
+        app.config[key] = int(os.environ[key])
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING') != '0'
+app.config['DB_REPLICA_URLS'] = (
+    os.environ['DB_REPLICA_URLS'].split(',')
+    if os.environ.get('DB_REPLICA_URLS') else [])
+app.config['DB_REPLICA_STICKY_SECONDS'] = int(
+    os.environ.get('DB_REPLICA_STICKY_SECONDS', 10))
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING') == '1'
+app.config['LIVE_BACKEND'] = os.environ.get('LIVE_BACKEND', 'local')
+app.config['JOB_MODE'] = os.environ.get('JOB_MODE', 'queue')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 0))
+app.config['GRAPH_INDEX'] = os.environ.get('GRAPH_INDEX') == '1'
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+database.init_app(app)
+fragments.init_app(app)
+passwords.init_app(app)
+instrumentation.init_app(app)
+http_cache.init_app(app)
+live.init_app(app)
+jobs.init_app(app)
+recommend.init_app(app)
+graph_index.init_app(app)
+app.register_blueprint(api)
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
-def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+# g.user is loaded on first use by LazyUserGlobals (see current_user.py).
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
 
-    else:
-        g.user = None
+@app.context_processor
+def add_curr_user_to_templates():
+    """Give templates the cached snapshot of the logged-in user."""
+
+    return {'curr_user': current_user_snapshot()}
 
 
 def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    forget_snapshot()
 
 
 def do_logout():
@@ -51,6 +107,7 @@ def do_logout():
 
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
+    forget_snapshot()
 
 
 @app.route('/signup', methods=["GET", "POST"])
@@ -100,6 +157,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # Saves the password's new hash if authenticate() re-hashed it
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -122,36 +181,57 @@ def logout():
 
 @app.route('/users')
 def list_users():
-    """Page with listing of users.
+    """Page with listing of users, alphabetically, a page at a time.
 
     Can take a 'q' param in querystring to search by that username.
     """
 
-    search = request.args.get('q')
+    q = request.args.get('q')
+
+    if not q:
+        page = paginate(user_cards(User.query.filter_by(deleted_at=None)),
+                        [User.username],
+                        request.args.get('cursor'), descending=False)
+        users = page.items
+    else:
+        page = None
+        users = search.search_users(q).items
+
+    prime_follow_states([user.id for user in users])
+    return render_template('users/index.html', users=users, page=page)
+
+
+@app.route('/search')
+def search_page():
+    """Ranked search of users (by name or bio) or messages (by text).
+
+    Takes 'q', 'type' ('users' or 'messages') and 'page' query params.
+    """
+
+    q = request.args.get('q', '')
+    kind = request.args.get('type', 'users')
+    page_number = request.args.get('page', 1, type=int)
 
-    if not search:
-        users = User.query.all()
+    if kind == 'messages':
+        results = search.search_messages(q, page_number)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        kind = 'users'
+        results = search.search_users(q, page_number)
+        prime_follow_states([user.id for user in results.items])
 
-    return render_template('users/index.html', users=users)
+    return render_template('search.html', q=q, kind=kind, results=results)
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    page = timeline.user_messages(user_id, request.args.get('cursor'))
+    return render_template('users/show.html', user=user,
+                           messages=page.items, page=page,
+                           likes=liked_message_ids(page.items))
 
 
 @app.route('/users/<int:user_id>/following')
@@ -162,8 +242,15 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
+    page = paginate((user_cards(User.query.filter_by(deleted_at=None))
+                     .join(Follows, Follows.user_being_followed_id == User.id)
+                     .filter(Follows.user_following_id == user_id)),
+                    [User.id],
+                    request.args.get('cursor'))
+    prime_follow_states([followed.id for followed in page.items])
+    return render_template('users/following.html', user=user,
+                           following=page.items, page=page)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -174,8 +261,15 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
+    page = paginate((user_cards(User.query.filter_by(deleted_at=None))
+                     .join(Follows, Follows.user_following_id == User.id)
+                     .filter(Follows.user_being_followed_id == user_id)),
+                    [User.id],
+                    request.args.get('cursor'))
+    prime_follow_states([follower.id for follower in page.items])
+    return render_template('users/followers.html', user=user,
+                           followers=page.items, page=page)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -186,9 +280,11 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    followed_user = (User.query.filter_by(id=follow_id, deleted_at=None)
+                     .first_or_404())
+    social.follow(g.user, followed_user)
     db.session.commit()
+    forget_snapshot()
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -201,9 +297,10 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    followed_user = User.query.get_or_404(follow_id)
+    social.unfollow(g.user, followed_user)
     db.session.commit()
+    forget_snapshot()
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -230,6 +327,8 @@ def profile():
             user.location = form.location.data
             user.bio = form.bio.data
             db.session.commit()
+            forget_snapshot()
+            fragments.invalidate_user(user.id)
             return redirect(f"/users/{user.id}")
         else:
             form.password.errors = ["Invalid Password"]
@@ -250,7 +349,7 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    social.delete_account(g.user)
     db.session.commit()
 
     return redirect("/signup")
@@ -261,8 +360,15 @@ def show_likes():
         flash("Access unauthorized","danger")
         return redirect("/")
 
-    likes = g.user.likes
-    return render_template("users/likes.html", likes=likes,user=g.user) 
+    page = paginate((message_cards(Message.query)
+                     .join(Likes, Likes.message_id == Message.id)
+                     .filter(Likes.user_id == g.user.id)),
+                    [Message.timestamp, Message.id],
+                    request.args.get('cursor'))
+    # Everything listed here is liked, so the page is its own liked set.
+    return render_template("users/likes.html", likes=page.items, page=page,
+                           user=g.user,
+                           liked={message.id for message in page.items})
 
 @app.route("/users/add_like/<int:message_id>", methods=["POST"])
 def add_like(message_id):
@@ -272,15 +378,9 @@ def add_like(message_id):
         return redirect("/")
 
     message = Message.query.get_or_404(message_id)
-    likes = g.user.likes
-    #if the message is not the user's message and if message is not in user's likes, add like. else if message is in user's likes, remove like.
-    if message.user_id != g.user.id:
-        if message not in likes:
-            likes.append(message)
-            db.session.commit()
-        elif message in likes: 
-            likes.remove(message)
-            db.session.commit()
+    social.toggle_like(g.user, message)
+    db.session.commit()
+    forget_snapshot()
     return redirect("/")
 
 
@@ -301,9 +401,9 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        social.post_message(g.user, form.text.data)
         db.session.commit()
+        forget_snapshot()
 
         return redirect(f"/users/{g.user.id}")
 
@@ -314,8 +414,36 @@ def messages_add():
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = (message_cards(Message.query)
+           .filter(Message.id == message_id)
+           .filter(Message.user.has(deleted_at=None))
+           .first_or_404())
+    return render_template('messages/show.html', message=msg,
+                           liked=msg.id in liked_message_ids([msg]))
+
+
+@app.route('/messages/<int:message_id>/like', methods=["POST"])
+def messages_like(message_id):
+    """Like or unlike a message without leaving the page.
+
+    A JSON body of {"liked": true|false} sets the state; without one the
+    like is toggled. Responds with {"message_id": ..., "liked": ...}.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    message = Message.query.get_or_404(message_id)
+    data = request.get_json(silent=True) or {}
+
+    if 'liked' in data:
+        liked = social.set_like(g.user, message, bool(data['liked']))
+    else:
+        liked = social.toggle_like(g.user, message)
+
+    db.session.commit()
+    forget_snapshot()
+    return jsonify(message_id=message_id, liked=liked)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -327,8 +455,9 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
-    db.session.delete(msg)
+    social.delete_message(msg)
     db.session.commit()
+    forget_snapshot()
 
     return redirect(f"/users/{g.user.id}")
 
@@ -341,38 +470,119 @@ def messages_destroy(message_id):
 def homepage():
     """Show homepage:
 
-    - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - anon users: trending messages
+    - logged in: most recent messages of followed_users, a page at a time,
+      and who to follow
     """
 
     if g.user:
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        likes = [message.id for message in g.user.likes]
-        return render_template('home.html', messages=messages, likes=likes)
+        page = timeline.home_timeline(g.user.id, request.args.get('cursor'))
+        likes = liked_message_ids(page.items)
+        suggestions = recommend.who_to_follow(
+            g.user.id, query=user_cards(User.query))
+        return render_template('home.html', messages=page.items, page=page,
+                               likes=likes, suggestions=suggestions)
 
     else:
-        return render_template('home-anon.html')
+        messages = recommend.trending(query=message_cards(Message.query))
+        return render_template('home-anon.html', messages=messages)
+
+
+@app.errorhandler(passwords.HasherBusy)
+def password_hasher_busy(error):
+    """Too many logins/signups are waiting on password hashing."""
+
+    flash("We're very busy right now; please try again in a moment.",
+          "danger")
+    return render_template('base.html'), 503
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# Command-line tasks
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    """Apply any pending schema migrations."""
+
+    applied = migrations.upgrade()
+    print(f"Applied migrations: {applied or 'none pending'}")
+
+
+@app.cli.command('import-data')
+@click.argument('directory', default='generator')
+@click.option('--chunk-size', default=importer.CHUNK_SIZE,
+              help="Rows written per transaction.")
+@click.option('--workers', default=2,
+              help="Tables loaded in parallel (Postgres only).")
+def import_data(directory, chunk_size, workers):
+    """Load users, messages and follows CSVs from DIRECTORY.
+
+    Safe to rerun: an interrupted import resumes where it stopped.
+    """
+
+    loaded = importer.import_dir(directory, chunk_size, workers)
+    print(f"Imported: {loaded}")
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    """Show whether each hot query's plan uses its intended index."""
+
+    results = query_plans.check()
+    for result in results:
+        status = "ok" if result.uses_index else "MISSING INDEX"
+        print(f"{status:>13}  {result.name} ({result.index})")
+
+    if not all(result.uses_index for result in results):
+        raise SystemExit(1)
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Rebuild every user's home timeline from messages and follows."""
+
+    count = timeline.rebuild()
+    db.session.commit()
+    print(f"Rebuilt timelines: {count} rows.")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recompute users' denormalized counters, fixing any drift."""
+
+    fixed = counters.reconcile()
+    db.session.commit()
+    print(f"Reconciled counters: {fixed} users corrected.")
+
+
+@app.cli.command('refresh-recommendations')
+def refresh_recommendations():
+    """Recompute every user's follow suggestions and trending messages."""
+
+    after_id = 0
+    while True:
+        user_ids = recommend.next_batch(after_id)
+        if not user_ids:
+            break
+        recommend.refresh_suggestions(user_ids)
+        db.session.commit()
+        after_id = user_ids[-1]
+
+    recommend.refresh_trending()
+    db.session.commit()
+    print("Refreshed recommendations.")
+
+
+@app.cli.command('run-jobs')
+@click.option('--workers', default=2, help="Jobs run in parallel.")
+def run_jobs(workers):
+    """Run queued background jobs until interrupted."""
+
+    jobs.start(app, workers)
+    print(f"Running jobs with {workers} workers. Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,118 @@
+"""Memory and lookup speed of the in-memory graph index against SQL.
+
+Seeds a database with the generator and importer (or reuses one), loads
+graph_index.GraphIndex from it, and reports how long loading took and how
+much memory the index holds. Then it times, over `--lookups` random
+users, each follow question both from the index and with the query the
+app runs without it:
+
+- follow states for a page of `--page` users (the buttons on a list);
+- whom two users both follow (an intersection);
+- following and unfollowing (the index's incremental update).
+
+Run from the project root:
+
+    python benchmarks/graph_index.py --follows 1000000
+    python benchmarks/graph_index.py --skip-seed
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from routes import percentile, seed  # noqa: E402
+
+
+def time_each(name, run, cases):
+    timings = []
+    for case in cases:
+        started = time.perf_counter()
+        run(*case)
+        timings.append(time.perf_counter() - started)
+    print(f"{name:<32} {percentile(timings, 50) * 1e6:>10.1f} "
+          f"{percentile(timings, 95) * 1e6:>10.1f} "
+          f"{percentile(timings, 99) * 1e6:>10.1f}")
+
+
+def sql_common_following(user_id, other_id):
+    from sqlalchemy import select
+
+    from models import db, Follows
+
+    follows = Follows.__table__
+    mine, theirs = follows.alias(), follows.alias()
+    return db.session.execute(
+        select([mine.c.user_being_followed_id])
+        .select_from(mine.join(theirs, theirs.c.user_being_followed_id
+                               == mine.c.user_being_followed_id))
+        .where(mine.c.user_following_id == user_id)
+        .where(theirs.c.user_following_id == other_id)
+        .order_by(mine.c.user_being_followed_id)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default=os.environ.get(
+        'DATABASE_URL', 'postgresql:///warbler-bench'))
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--follows', type=int, default=1000000)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help="reuse the data already in --database")
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--page', type=int, default=20,
+                        help="users per follow-state lookup")
+    opts = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = opts.database
+    from app import app
+    from models import db, User
+    import graph_index
+
+    rng = random.Random('graph-index')
+
+    with app.app_context():
+        if not opts.skip_seed:
+            seed(opts)
+
+        started = time.perf_counter()
+        graph = graph_index.GraphIndex.load()
+        load_seconds = time.perf_counter() - started
+
+        # Again, tracing allocations (which slows loading down a lot).
+        tracemalloc.start()
+        graph_index.GraphIndex.load()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = graph.stats()
+        print(f"loaded {stats['follows']} follows of {stats['users']} users "
+              f"in {load_seconds:.1f}s")
+        print(f"index holds {stats['bytes'] / 2 ** 20:.1f} MiB "
+              f"({stats['bytes'] / max(stats['follows'], 1):.1f} bytes per "
+              f"follow); loading peaked at {peak / 2 ** 20:.1f} MiB")
+
+        user_ids = [user_id for (user_id, ) in db.session.query(User.id)]
+        pages = [(rng.choice(user_ids), rng.sample(user_ids, opts.page))
+                 for _ in range(opts.lookups)]
+        pairs = [(rng.choice(user_ids), rng.choice(user_ids))
+                 for _ in range(opts.lookups)]
+
+        print(f"\n{'lookup':<32} {'p50 us':>10} {'p95 us':>10} "
+              f"{'p99 us':>10}")
+        time_each("follow states (index)", graph.followed_among, pages)
+        time_each("follow states (SQL)", User.followed_among, pages)
+        time_each("common following (index)", graph.common_following, pairs)
+        time_each("common following (SQL)", sql_common_following, pairs)
+        time_each("follow (index update)", graph.add, pairs)
+        time_each("unfollow (index update)", graph.remove, pairs)
+
+
+if __name__ == '__main__':
+    main()
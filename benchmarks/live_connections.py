@@ -0,0 +1,215 @@
+"""Open live streams, delivery latency and database load, by stream count.
+
+For each `--connections` count, opens that many /stream connections to a
+threaded WSGI server, all for a user who follows the poster, then posts
+`--posts` messages and times how long each takes to reach every stream.
+It also counts the SQL run while the streams sit idle for `--idle`
+seconds (it should be none), and sets it against what the same clients
+would cost reloading the home page every `--poll-interval` seconds.
+Run from the project root:
+
+    python benchmarks/live_connections.py --connections 100 500 1000
+
+Each stream holds a server thread here; under serve.py with gevent it
+holds a greenlet instead, which is what lets one process keep thousands
+open.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from routes import percentile  # noqa: E402
+
+
+class Client:
+    """One browser's stream: records when each message id arrives."""
+
+    def __init__(self, port, cookie):
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.conn.connect()
+        # The connection lets go of its socket once the response is read.
+        self.sock = self.conn.sock
+        self.conn.request('GET', '/stream', headers={'Cookie': cookie})
+        self.response = self.conn.getresponse()
+        self.status = self.response.status
+        self.arrivals = {}
+        if self.status == 200:
+            self.thread = threading.Thread(target=self.read, daemon=True)
+            self.thread.start()
+
+    def read(self):
+        try:
+            for line in iter(self.response.readline, b''):
+                if line.startswith(b'data: '):
+                    msg_id = json.loads(line[6:])['id']
+                    self.arrivals[msg_id] = time.perf_counter()
+        except (OSError, ValueError, http.client.HTTPException):
+            pass
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if self.status == 200:
+            self.thread.join()
+        self.response.close()
+        self.sock.close()
+
+
+def setup(app):
+    """A fresh database with a poster and a reader who follows them."""
+
+    from models import db, User
+    import migrations
+    import social
+
+    with app.app_context():
+        db.drop_all()
+        migrations.upgrade()
+        author = User(username="poster", email="poster@test.com",
+                      password="HASHED_PASSWORD")
+        reader = User(username="reader", email="reader@test.com",
+                      password="HASHED_PASSWORD")
+        db.session.add_all([author, reader])
+        db.session.flush()
+        social.follow(reader, author)
+        db.session.commit()
+        return author.id, reader.id
+
+
+def polling_queries(app, reader_id):
+    """SQL statements one reload of the reader's home page runs."""
+
+    from current_user import CURR_USER_KEY
+    from testing import count_queries
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = reader_id
+
+    client.get('/')
+    with count_queries() as statements:
+        client.get('/')
+    return len(statements)
+
+
+def run(app, port, cookie, author_id, connections, posts, idle):
+    import live
+    from models import db, User
+    from testing import count_queries
+    import social
+
+    started = time.perf_counter()
+    clients = [Client(port, cookie) for _ in range(connections)]
+    open_seconds = time.perf_counter() - started
+    streaming = [c for c in clients if c.status == 200]
+
+    with app.app_context():
+        with count_queries() as statements:
+            time.sleep(idle)
+        idle_queries = len(statements)
+
+        author = User.query.get(author_id)
+        posted = {}
+        for n in range(posts):
+            msg = social.post_message(author, f"live benchmark {n}")
+            posted[msg.id] = time.perf_counter()
+            db.session.commit()
+            time.sleep(0.05)
+        db.session.remove()
+
+    deadline = time.monotonic() + 10
+    while (time.monotonic() < deadline
+           and any(len(c.arrivals) < posts for c in streaming)):
+        time.sleep(0.05)
+
+    latencies = [arrived - posted[msg_id]
+                 for c in streaming for msg_id, arrived in c.arrivals.items()]
+
+    for c in clients:
+        c.close()
+    deadline = time.monotonic() + 10
+    while live.bus.stats()['subscribers'] and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    return {
+        'open': len(streaming),
+        'refused': len(clients) - len(streaming),
+        'open_s': open_seconds,
+        'delivered': len(latencies),
+        'expected': len(streaming) * posts,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else 0,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else 0,
+        'max_ms': max(latencies) * 1000 if latencies else 0,
+        'idle_queries': idle_queries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default=os.environ.get(
+        'DATABASE_URL', 'postgresql:///warbler-bench'))
+    parser.add_argument('--connections', type=int, nargs='+',
+                        default=[100, 500])
+    parser.add_argument('--posts', type=int, default=20)
+    parser.add_argument('--idle', type=float, default=5,
+                        help="seconds to count queries with streams open")
+    parser.add_argument('--poll-interval', type=float, default=30,
+                        help="seconds between reloads, for the comparison")
+    opts = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = opts.database
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    from app import app
+    from current_user import CURR_USER_KEY
+    import live
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    author_id, reader_id = setup(app)
+    per_reload = polling_queries(app, reader_id)
+
+    # Notice closed clients quickly, so each round starts from zero.
+    live._heartbeat_seconds = 1
+    live.bus.max_subscribers = max(opts.connections)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookie = (f"{app.session_cookie_name}="
+              f"{serializer.dumps({CURR_USER_KEY: reader_id})}")
+
+    print(f"{'streams':>8} {'refused':>8} {'open s':>8} {'delivered':>12} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'idle SQL':>9} "
+          f"{'polling SQL':>12}")
+    try:
+        for connections in opts.connections:
+            r = run(app, server.server_port, cookie, author_id, connections,
+                    opts.posts, opts.idle)
+            polling = round(connections * per_reload * opts.idle
+                            / opts.poll_interval)
+            print(f"{r['open']:>8} {r['refused']:>8} {r['open_s']:>8.2f} "
+                  f"{r['delivered']:>5}/{r['expected']:<6} "
+                  f"{r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+                  f"{r['max_ms']:>8.1f} {r['idle_queries']:>9} {polling:>12}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
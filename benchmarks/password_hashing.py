@@ -0,0 +1,71 @@
+"""Login throughput by password-hashing worker count.
+
+Simulates a burst of logins: `--threads` request threads each check a
+password against a bcrypt hash as fast as they can, for `--seconds`, with
+the hasher configured for each worker count in turn (0 means inline, on
+the request thread). Throughput can't exceed what the machine's cores
+allow; what the pool adds is a bound on how many hashes compete with
+request handling at once. Run from the project root:
+
+    python benchmarks/password_hashing.py --workers 0 1 2 4 --threads 16
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher  # noqa: E402
+
+
+def run(workers, threads, seconds, log_rounds):
+    """Return (logins per second, peak in flight) for one configuration."""
+
+    hasher = PasswordHasher(log_rounds=log_rounds, workers=workers,
+                            max_queue=threads, timeout=60)
+    pw_hash = hasher.hash("password")
+    deadline = time.monotonic() + seconds
+    done = []
+
+    def login():
+        count = 0
+        while time.monotonic() < deadline:
+            hasher.verify(pw_hash, "password")
+            count += 1
+        done.append(count)
+
+    started = time.monotonic()
+    pool = [threading.Thread(target=login) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    stats = hasher.stats()
+    hasher.shutdown()
+    return sum(done) / elapsed, stats['peak_in_flight']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[0, 1, 2, os.cpu_count() or 1])
+    parser.add_argument('--threads', type=int, default=16,
+                        help="concurrent request threads")
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--log-rounds', type=int, default=12,
+                        help="bcrypt cost factor")
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'logins/s':>10} {'peak in flight':>15}")
+    for workers in args.workers:
+        rate, peak = run(workers, args.threads, args.seconds, args.log_rounds)
+        print(f"{workers:>8} {rate:>10.1f} {peak:>15}")
+
+
+if __name__ == '__main__':
+    main()
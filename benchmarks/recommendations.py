@@ -0,0 +1,201 @@
+"""Recommendation refresh cost and read latency on a large follow graph.
+
+Seeds a database with the generator and importer (by default 1M follows
+among 50k users), adds `--likes` likes spread over the trending window,
+then times:
+
+- a full refresh of every user's follow suggestions, batch by batch;
+- a full trending refresh, and an incremental one after `--new-likes`
+  more likes;
+- reading one user's suggestions and the trending messages from the
+  precomputed tables, against computing the same on the fly with SQL.
+
+Run from the project root:
+
+    python benchmarks/recommendations.py
+    python benchmarks/recommendations.py --skip-seed    # reuse the data
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from routes import percentile, seed  # noqa: E402
+
+
+def add_likes(count, spread, now, rng):
+    """Insert `count` likes made over the `spread` before `now`."""
+
+    from sqlalchemy import func, select
+
+    from models import db, Likes, Message, User
+
+    likes = Likes.__table__
+    max_user = db.session.query(func.max(User.id)).scalar()
+    max_message = db.session.query(func.max(Message.id)).scalar()
+    seen = {tuple(row) for row in db.session.execute(
+        select([likes.c.user_id, likes.c.message_id]))}
+
+    added, rows = 0, []
+    while added < count:
+        pair = (rng.randint(1, max_user),
+                # Popular messages get most of the likes.
+                int(max_message * rng.random() ** 3) + 1)
+        if pair in seen:
+            continue
+        seen.add(pair)
+        added += 1
+        rows.append({'user_id': pair[0], 'message_id': pair[1],
+                     'created_at': now - spread * rng.random()})
+        if len(rows) == 10000 or added == count:
+            db.session.execute(likes.insert(), rows)
+            rows = []
+    db.session.commit()
+
+
+def time_suggestions_refresh():
+    import recommend
+    from models import db
+
+    started = time.perf_counter()
+    batch_times, after_id, users = [], 0, 0
+    while True:
+        batch_started = time.perf_counter()
+        user_ids = recommend.next_batch(after_id)
+        if not user_ids:
+            break
+        recommend.refresh_suggestions(user_ids)
+        db.session.commit()
+        batch_times.append(time.perf_counter() - batch_started)
+        after_id, users = user_ids[-1], users + len(user_ids)
+
+    rows = db.session.query(recommend.follow_suggestions).count()
+    print(f"suggestions: {users} users in {len(batch_times)} batches, "
+          f"{time.perf_counter() - started:.1f}s "
+          f"(batch p50 {percentile(batch_times, 50) * 1000:.0f}ms, "
+          f"p99 {percentile(batch_times, 99) * 1000:.0f}ms), {rows} rows")
+
+
+def time_trending_refresh(label, now):
+    import recommend
+    from models import db
+
+    started = time.perf_counter()
+    recommend.refresh_trending(now)
+    db.session.commit()
+    rows = db.session.query(recommend.trending_messages).count()
+    print(f"trending {label}: {time.perf_counter() - started:.2f}s, "
+          f"{rows} messages scored")
+
+
+def on_the_fly_suggestions(user_id, limit):
+    """Friends of friends computed per request, for comparison."""
+
+    from sqlalchemy import exists, func, select
+
+    from models import db, Follows
+
+    follows = Follows.__table__
+    mine, theirs, already = (follows.alias(), follows.alias(),
+                             follows.alias())
+    suggested_id = theirs.c.user_being_followed_id
+    return db.session.execute(
+        select([suggested_id, func.count().label('score')])
+        .select_from(mine.join(theirs, theirs.c.user_following_id
+                               == mine.c.user_being_followed_id))
+        .where(mine.c.user_following_id == user_id)
+        .where(suggested_id != user_id)
+        .where(~exists().where(already.c.user_following_id == user_id)
+               .where(already.c.user_being_followed_id == suggested_id))
+        .group_by(suggested_id)
+        .order_by(func.count().desc(), suggested_id)
+        .limit(limit)).fetchall()
+
+
+def on_the_fly_trending(now, limit):
+    """Likes per message over the window counted per request (undecayed)."""
+
+    from sqlalchemy import func, select
+
+    from models import db, Likes
+    import recommend
+
+    likes = Likes.__table__
+    return db.session.execute(
+        select([likes.c.message_id, func.count().label('likes')])
+        .where(likes.c.created_at > now - recommend.TRENDING_WINDOW)
+        .group_by(likes.c.message_id)
+        .order_by(func.count().desc())
+        .limit(limit)).fetchall()
+
+
+def time_reads(name, read, requests):
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        read()
+        timings.append(time.perf_counter() - started)
+    print(f"{name:<28} {percentile(timings, 50) * 1000:>8.2f} "
+          f"{percentile(timings, 95) * 1000:>8.2f} "
+          f"{percentile(timings, 99) * 1000:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default=os.environ.get(
+        'DATABASE_URL', 'postgresql:///warbler-bench'))
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--follows', type=int, default=1000000)
+    parser.add_argument('--likes', type=int, default=200000)
+    parser.add_argument('--new-likes', type=int, default=5000)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help="reuse the data already in --database")
+    parser.add_argument('--requests', type=int, default=200,
+                        help="reads timed per query")
+    opts = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = opts.database
+    from app import app
+    from models import db
+    import recommend
+
+    rng = random.Random('recommendations')
+    now = datetime.utcnow()
+
+    with app.app_context():
+        if not opts.skip_seed:
+            seed(opts)
+            add_likes(opts.likes, recommend.TRENDING_WINDOW, now, rng)
+
+        db.session.execute(recommend.trending_messages.delete())
+        db.session.execute(recommend.recommendation_runs.delete())
+        db.session.commit()
+
+        time_suggestions_refresh()
+        time_trending_refresh("full", now)
+        later = now + timedelta(minutes=5)
+        add_likes(opts.new_likes, timedelta(minutes=5), later, rng)
+        time_trending_refresh(f"+{opts.new_likes} likes", later)
+
+        user_ids = recommend.next_batch(0)
+        print(f"\n{'read':<28} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        time_reads("who_to_follow (table)",
+                   lambda: recommend.who_to_follow(rng.choice(user_ids)),
+                   opts.requests)
+        time_reads("who_to_follow (on the fly)",
+                   lambda: on_the_fly_suggestions(rng.choice(user_ids), 3),
+                   opts.requests)
+        time_reads("trending (table)", recommend.trending, opts.requests)
+        time_reads("trending (on the fly)",
+                   lambda: on_the_fly_trending(later, 10), opts.requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""Latency and query-count benchmark for Warbler's main routes.
+
+Seeds a database at the requested scale with the generator and importer,
+then requests each route `--requests` times, both through Flask's test
+client (app cost alone) and over HTTP from a real WSGI server (adding
+request parsing and the network stack). For every route it records p50,
+p95 and p99 latency and the SQL queries per request.
+
+Results can be saved as a baseline and later runs compared against it;
+a route whose p95 grew by more than `--tolerance`, or which now runs more
+queries, is flagged and the run exits non-zero. Run from the project root:
+
+    python benchmarks/routes.py --users 10000 --messages 200000 \\
+        --follows 500000 --save-baseline
+    python benchmarks/routes.py --skip-seed    # compare with the baseline
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The user the benchmark logs in as, and the message it likes.
+USER_ID = 1
+MESSAGE_ID = 1
+
+# Route name -> (method, path). Paths are for USER_ID and MESSAGE_ID.
+ROUTES = {
+    'homepage': ('GET', '/'),
+    'users_show': ('GET', f'/users/{USER_ID}'),
+    'list_users': ('GET', '/users'),
+    'search_users': ('GET', '/users?q=john'),
+    'show_following': ('GET', f'/users/{USER_ID}/following'),
+    'show_likes': ('GET', '/users/likes'),
+    'messages_show': ('GET', f'/messages/{MESSAGE_ID}'),
+    'add_like': ('POST', f'/users/add_like/{MESSAGE_ID}'),
+    'messages_like': ('POST', f'/messages/{MESSAGE_ID}/like'),
+}
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of `samples`."""
+
+    ordered = sorted(samples)
+    index = max(0, -(-len(ordered) * pct // 100) - 1)
+    return ordered[int(index)]
+
+
+def summarize(timings, queries):
+    return {
+        'p50_ms': round(percentile(timings, 50) * 1000, 2),
+        'p95_ms': round(percentile(timings, 95) * 1000, 2),
+        'p99_ms': round(percentile(timings, 99) * 1000, 2),
+        'queries': max(queries),
+    }
+
+
+def seed(opts):
+    """Generate CSVs at the requested scale and load a fresh database."""
+
+    from models import db
+    import importer
+    import migrations
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'generator', 'create_csvs.py'),
+             '--users', str(opts.users), '--messages', str(opts.messages),
+             '--follows', str(opts.follows), '--out', directory,
+             '--seed', 'benchmark'],
+            check=True)
+
+        db.drop_all()
+        migrations.upgrade()
+        importer.import_dir(directory, log=lambda line: None)
+
+
+def run_test_client(app, count_queries, requests):
+    """Time each route through the test client, logged in as USER_ID."""
+
+    from current_user import CURR_USER_KEY
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = USER_ID
+
+    results = {}
+    for name, (method, path) in ROUTES.items():
+        timings, queries = [], []
+        for _ in range(requests):
+            with count_queries() as statements:
+                started = time.perf_counter()
+                client.open(path, method=method)
+                timings.append(time.perf_counter() - started)
+            queries.append(len(statements))
+        results[name] = summarize(timings, queries)
+
+    return results
+
+
+def run_wsgi(app, count_queries, requests):
+    """Time each route over HTTP against a threaded WSGI server."""
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+        NoRedirect())
+
+    def fetch(method, path, data=None):
+        request = urllib.request.Request(base + path, data=data, method=method)
+        try:
+            with opener.open(request) as response:
+                response.read()
+        except urllib.error.HTTPError as error:
+            if error.code >= 400:
+                raise
+
+    from models import User
+    username = User.query.get(USER_ID).username
+    fetch('POST', '/login', urllib.parse.urlencode(
+        {'username': username, 'password': 'password'}).encode())
+
+    results = {}
+    try:
+        for name, (method, path) in ROUTES.items():
+            timings, queries = [], []
+            for _ in range(requests):
+                with count_queries() as statements:
+                    started = time.perf_counter()
+                    fetch(method, path, b'' if method == 'POST' else None)
+                    timings.append(time.perf_counter() - started)
+                queries.append(len(statements))
+            results[name] = summarize(timings, queries)
+    finally:
+        server.shutdown()
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """List the routes that got slower or run more queries than baseline."""
+
+    regressions = []
+    for mode, routes in results['modes'].items():
+        for name, now in routes.items():
+            before = baseline.get('modes', {}).get(mode, {}).get(name)
+            if not before:
+                continue
+            if now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{mode} {name}: p95 {before['p95_ms']}ms "
+                                   f"-> {now['p95_ms']}ms")
+            if now['queries'] > before['queries']:
+                regressions.append(f"{mode} {name}: queries "
+                                   f"{before['queries']} -> {now['queries']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default=os.environ.get(
+        'DATABASE_URL', 'postgresql:///warbler-bench'))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=50000)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help="reuse the data already in --database")
+    parser.add_argument('--requests', type=int, default=200,
+                        help="requests per route")
+    parser.add_argument('--modes', nargs='+', default=['test_client', 'wsgi'],
+                        choices=['test_client', 'wsgi'])
+    parser.add_argument('--baseline',
+                        default=os.path.join(ROOT, 'benchmarks',
+                                             'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed p95 growth over the baseline (0.2 = 20%%)")
+    opts = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = opts.database
+    from app import app
+    from testing import count_queries
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    if not opts.skip_seed:
+        seed(opts)
+
+    runners = {'test_client': run_test_client, 'wsgi': run_wsgi}
+    results = {
+        'scale': {'users': opts.users, 'messages': opts.messages,
+                  'follows': opts.follows},
+        'modes': {mode: runners[mode](app, count_queries, opts.requests)
+                  for mode in opts.modes},
+    }
+
+    for mode, routes in results['modes'].items():
+        print(f"\n{mode}")
+        print(f"{'route':<16} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'queries':>8}")
+        for name, r in routes.items():
+            print(f"{name:<16} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+                  f"{r['p99_ms']:>8} {r['queries']:>8}")
+
+    if opts.save_baseline:
+        with open(opts.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved baseline to {opts.baseline}")
+        return
+
+    if os.path.exists(opts.baseline):
+        with open(opts.baseline) as f:
+            regressions = compare(results, json.load(f), opts.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            print("\n".join(f"  {line}" for line in regressions))
+            raise SystemExit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Denormalized per-user counters.
+
+`User` carries messages/following/followers/likes counts so templates don't
+have to load whole relationships just to take their length. Counters are
+only ever changed with `UPDATE users SET col = col + n`, which the database
+applies atomically, so concurrent requests can't lose each other's updates.
+`reconcile()` recomputes them from the underlying tables to repair drift.
+"""
+
+from sqlalchemy import func, or_, select
+
+from models import db, Follows, Likes, Message, User
+
+users = User.__table__
+
+# Counter column -> the column whose rows it counts, per owning user.
+COUNTER_SOURCES = {
+    'messages_count': Message.__table__.c.user_id,
+    'following_count': Follows.__table__.c.user_following_id,
+    'followers_count': Follows.__table__.c.user_being_followed_id,
+    'likes_count': Likes.__table__.c.user_id,
+}
+
+
+def adjust(user_id, counter, delta):
+    """Atomically add `delta` to one counter on one user."""
+
+    column = users.c[counter]
+    db.session.execute(users.update()
+                       .where(users.c.id == user_id)
+                       .values({counter: column + delta}))
+
+
+def adjust_where(counter, delta, user_ids):
+    """Atomically add `delta` to a counter for every user in `user_ids`.
+
+    `user_ids` may be a list or a select producing one id per affected row;
+    a user appearing n times in a select still only changes by `delta`, so
+    use `subtract_counts` when a user can be affected more than once.
+    """
+
+    column = users.c[counter]
+    db.session.execute(users.update()
+                       .where(users.c.id.in_(user_ids))
+                       .values({counter: column + delta}))
+
+
+def subtract_counts(counter, counts_by_user):
+    """Atomically subtract a correlated per-user count from a counter.
+
+    `counts_by_user` is a function taking the users.id column and returning
+    a scalar select counting how much to subtract for that user.
+    """
+
+    column = users.c[counter]
+    amount = counts_by_user(users.c.id)
+    db.session.execute(users.update()
+                       .where(amount > 0)
+                       .values({counter: column - amount}))
+
+
+def _actual(counter):
+    """Correlated subquery counting the real rows behind `counter`."""
+
+    owner_column = COUNTER_SOURCES[counter]
+    return (select([func.count()])
+            .select_from(owner_column.table)
+            .where(owner_column == users.c.id)
+            .as_scalar())
+
+
+def reconcile():
+    """Recompute every counter from source tables.
+
+    Returns the number of users whose counters had drifted.
+    """
+
+    actual = {counter: _actual(counter) for counter in COUNTER_SOURCES}
+    drifted = or_(*[users.c[counter] != actual[counter]
+                    for counter in COUNTER_SOURCES])
+
+    result = db.session.execute(users.update()
+                                .where(drifted)
+                                .values(actual))
+    return result.rowcount
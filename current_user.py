@@ -0,0 +1,121 @@
+"""The logged-in user, loaded only when a request actually needs it.
+
+`g.user` is filled in on first access rather than in a before-request hook,
+so requests that never look at it (static files, redirects, anonymous
+pages) don't query the users table at all.
+
+Most pages only need a few fields of the current user for the nav bar and
+"is this me?" checks. Those are kept in a small snapshot in the session
+cookie and offered to templates as `curr_user`; views that change any of
+those fields must call `forget_snapshot()`.
+"""
+
+import time
+
+from flask import g, session
+from flask.ctx import _AppCtxGlobals
+
+from models import User
+import graph_index
+
+CURR_USER_KEY = "curr_user"
+SNAPSHOT_KEY = "curr_user_snapshot"
+
+# Only fields that change through the user's own actions belong here; a
+# counter someone else can change (like followers_count) would go stale.
+SNAPSHOT_FIELDS = ('id', 'username', 'image_url', 'header_image_url',
+                   'messages_count', 'following_count', 'likes_count')
+
+# Re-read the snapshot now and then, in case it was changed elsewhere
+# (e.g. a profile edit from another browser).
+SNAPSHOT_MAX_AGE = 300
+
+
+def load_user():
+    """Return the logged-in User, or None."""
+
+    if CURR_USER_KEY not in session:
+        return None
+
+    user = User.query.get(session[CURR_USER_KEY])
+    # A deleted account stays logged out, even while it's being purged.
+    if user is None or user.deleted_at is not None:
+        return None
+    return user
+
+
+class LazyUserGlobals(_AppCtxGlobals):
+    """Flask's `g`, but loading `g.user` on first access."""
+
+    def __getattr__(self, name):
+        if name == 'user':
+            self.user = load_user()
+            return self.user
+
+        raise AttributeError(name)
+
+
+def current_user_snapshot():
+    """Return a dict of the logged-in user's SNAPSHOT_FIELDS, or None."""
+
+    if CURR_USER_KEY not in session:
+        return None
+
+    snapshot = session.get(SNAPSHOT_KEY)
+    fresh = (snapshot
+             and snapshot['id'] == session[CURR_USER_KEY]
+             and time.time() - snapshot['taken_at'] < SNAPSHOT_MAX_AGE)
+
+    if not fresh:
+        if not g.user:
+            return None
+
+        snapshot = {field: getattr(g.user, field) for field in SNAPSHOT_FIELDS}
+        snapshot['taken_at'] = time.time()
+        session[SNAPSHOT_KEY] = snapshot
+
+    return snapshot
+
+
+def forget_snapshot():
+    """Drop the cached snapshot; the next use re-reads the user."""
+
+    session.pop(SNAPSHOT_KEY, None)
+
+
+def prime_follow_states(user_ids):
+    """Find out, in one query, whether the logged-in user follows `user_ids`.
+
+    Answers are cached on `g` for the rest of the request, so views listing
+    many users call this once with the whole page and templates then ask
+    `is_following()` per card without further queries. With the graph
+    index on, there's no query at all.
+    """
+
+    states = g.setdefault('follow_states', {})
+    missing = [user_id for user_id in user_ids if user_id not in states]
+
+    if missing:
+        if CURR_USER_KEY in session:
+            followed = graph_index.followed_among(session[CURR_USER_KEY],
+                                                  missing)
+        else:
+            followed = set()
+        states.update((user_id, user_id in followed) for user_id in missing)
+
+    return states
+
+
+def is_following(user):
+    """Does the logged-in user follow `user`? Cached for the request."""
+
+    return prime_follow_states([user.id])[user.id]
+
+
+def liked_message_ids(messages):
+    """Ids of those of `messages` the logged-in user has liked, as a set."""
+
+    if CURR_USER_KEY not in session:
+        return set()
+    return User.liked_among(session[CURR_USER_KEY],
+                            [message.id for message in messages])
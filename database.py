@@ -0,0 +1,147 @@
+"""Database connections: pool settings and read-replica routing.
+
+Pool settings come from app config (Postgres only; SQLite opens a
+connection per use):
+
+- DB_POOL_SIZE: connections each process keeps open.
+- DB_MAX_OVERFLOW: extra connections allowed under load, closed after.
+- DB_POOL_TIMEOUT: seconds to wait for a free connection before failing.
+- DB_POOL_RECYCLE: seconds after which a connection is replaced, so none
+  outlive a server or proxy's idle timeout.
+- DB_POOL_PRE_PING: test connections as they're checked out (default on),
+  so one the server dropped is replaced instead of failing a request.
+
+With DB_REPLICA_URLS set, GET requests read from one of those replicas,
+picked at random per request, and everything else uses the primary:
+other methods, anything run outside a request (commands, the importer),
+and any write or flush even within a GET. A replica lags behind the
+primary, so for DB_REPLICA_STICKY_SECONDS after a user's POST (or other
+write request) their reads stay on the primary too, and they see what
+they just did.
+"""
+
+import random
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import UpdateBase
+
+# Pool options, by the app config key they're set from.
+POOL_OPTIONS = {
+    'pool_size': 'DB_POOL_SIZE',
+    'max_overflow': 'DB_MAX_OVERFLOW',
+    'pool_timeout': 'DB_POOL_TIMEOUT',
+    'pool_recycle': 'DB_POOL_RECYCLE',
+}
+
+# Methods that don't change anything, so may read from a replica.
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Session key: until when this visitor's reads go to the primary.
+STICKY_KEY = 'read_primary_until'
+
+# Bind keys of the configured replicas.
+_replicas = []
+
+# How long reads stay on the primary after a write request.
+_sticky_seconds = 10
+
+
+class RoutingSession(SignallingSession):
+    """A session that reads from the request's replica, if it has one."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_request_context() else None
+        if replica is None:
+            return super().get_bind(mapper, clause)
+
+        if self._flushing or isinstance(clause, UpdateBase):
+            # Once a request writes, it reads back from the primary.
+            g.db_replica = None
+            return super().get_bind(mapper, clause)
+
+        return self.db.get_engine(self.app, bind=replica)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy, with pool settings and replica routing."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        if not sa_url.drivername.startswith('sqlite'):
+            for option, key in POOL_OPTIONS.items():
+                if app.config.get(key) is not None:
+                    options[option] = app.config[key]
+        options['pool_pre_ping'] = app.config.get('DB_POOL_PRE_PING', True)
+
+        return super().apply_driver_hacks(app, sa_url, options)
+
+
+def use_replicas(app, urls):
+    """Route GET requests' reads to the databases at `urls` (none: stop)."""
+
+    global _replicas
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for key in _replicas:
+        binds.pop(key, None)
+
+    _replicas = [f"replica{i}" for i in range(len(urls))]
+    binds.update(zip(_replicas, urls))
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_app(app):
+    """Set up replica routing from DB_REPLICA_URLS, if there are any."""
+
+    global _sticky_seconds
+    _sticky_seconds = app.config.get('DB_REPLICA_STICKY_SECONDS', 10)
+
+    use_replicas(app, app.config.get('DB_REPLICA_URLS') or [])
+    app.before_request(_choose_database)
+    app.after_request(_stick_after_write)
+
+
+def _choose_database():
+    g.db_replica = None
+    if not _replicas or request.method not in SAFE_METHODS:
+        return
+
+    if STICKY_KEY in session:
+        if session[STICKY_KEY] > time.time():
+            return
+        del session[STICKY_KEY]
+
+    g.db_replica = random.choice(_replicas)
+
+
+def _stick_after_write(response):
+    if _replicas and request.method not in SAFE_METHODS:
+        session[STICKY_KEY] = time.time() + _sticky_seconds
+    return response
+
+
+##############################################################################
+# Metrics
+
+
+def pool_stats(db):
+    """{database: (size, checked out, overflow)} for pools that track it."""
+
+    engines = {'primary': db.engine}
+    for key in _replicas:
+        engines[key] = db.get_engine(db.get_app(), bind=key)
+
+    # overflow() counts up from -size while the pool is filling.
+    return {name: (engine.pool.size(), engine.pool.checkedout(),
+                   max(engine.pool.overflow(), 0))
+            for name, engine in engines.items()
+            if hasattr(engine.pool, 'checkedout')}
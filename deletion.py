@@ -0,0 +1,161 @@
+"""Account deletion: hidden at once, purged in the background.
+
+Deleting an account in one go means deleting its follows, its likes, every
+like and timeline row of each of its messages, and the messages, and
+fixing the counters of everyone connected, in a single transaction that
+for a long-standing account can run for minutes and hold locks throughout.
+
+Instead the request only soft-deletes the user, setting `deleted_at`,
+which hides them (they can't log in, and their profile and search
+results are gone), and enqueues a purge job. The purge deletes the rows
+a chunk of PURGE_CHUNK at a time, each chunk its own short job and
+transaction, children before parents, fixing the counters of the users
+each chunk touches. Once nothing is left, it deletes the user.
+
+Progress is kept in `account_deletions`: when deletion was requested,
+how many rows have been purged so far and when it finished. A purge that
+is interrupted simply picks up with the rows that remain.
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+
+from models import db, Follows, Likes, Message, TimelineEntry, User
+from sqlutil import insert_ignore
+import counters
+import fragments
+import graph_index
+import jobs
+
+# Rows deleted per job (and per transaction).
+PURGE_CHUNK = 1000
+
+follows = Follows.__table__
+likes = Likes.__table__
+messages = Message.__table__
+timelines = TimelineEntry.__table__
+users = User.__table__
+
+account_deletions = db.Table(
+    'account_deletions',
+    db.Column('user_id', db.Integer, primary_key=True),
+    db.Column('requested_at', db.DateTime, nullable=False),
+    db.Column('rows_deleted', db.BigInteger, nullable=False, default=0),
+    db.Column('finished_at', db.DateTime),
+)
+
+
+def _their_messages(user_id):
+    return select([messages.c.id]).where(messages.c.user_id == user_id)
+
+
+# What to purge, in order: (table, the user's rows in it, the columns
+# identifying a row, and the counter to decrement for the user in the
+# given column of each deleted row, if any). Timelines go first, so the
+# user's messages leave other users' feeds soonest.
+STAGES = [
+    (timelines,
+     lambda user_id: timelines.c.message_id.in_(_their_messages(user_id)),
+     [timelines.c.user_id, timelines.c.message_id],
+     None),
+    (timelines, lambda user_id: timelines.c.user_id == user_id,
+     [timelines.c.user_id, timelines.c.message_id],
+     None),
+    (follows, lambda user_id: follows.c.user_following_id == user_id,
+     [follows.c.user_being_followed_id, follows.c.user_following_id],
+     ('followers_count', follows.c.user_being_followed_id)),
+    (follows, lambda user_id: follows.c.user_being_followed_id == user_id,
+     [follows.c.user_being_followed_id, follows.c.user_following_id],
+     ('following_count', follows.c.user_following_id)),
+    (likes, lambda user_id: likes.c.message_id.in_(_their_messages(user_id)),
+     [likes.c.id],
+     ('likes_count', likes.c.user_id)),
+    (likes, lambda user_id: likes.c.user_id == user_id,
+     [likes.c.id],
+     None),
+    (messages, lambda user_id: messages.c.user_id == user_id,
+     [messages.c.id],
+     None),
+]
+
+
+def request_deletion(user):
+    """Hide `user` now and schedule the purge of their account."""
+
+    now = datetime.utcnow()
+    db.session.execute(users.update().where(users.c.id == user.id)
+                       .values(deleted_at=now))
+    insert_ignore(account_deletions,
+                  {'user_id': user.id, 'requested_at': now, 'rows_deleted': 0},
+                  unique=['user_id'])
+    jobs.enqueue('purge_account', key=f"purge_account:{user.id}",
+                 user_id=user.id)
+    fragments.invalidate_on_commit('user', user.id)
+    # They're hidden now, so their follows can go from the index at once.
+    graph_index.remove_user_on_commit(user.id)
+
+
+def progress(user_id):
+    """The `account_deletions` row for `user_id`, or None."""
+
+    return db.session.execute(
+        account_deletions.select()
+        .where(account_deletions.c.user_id == user_id)).first()
+
+
+def _purge_chunk(user_id, table, owned_by, keys, counter):
+    """Delete up to PURGE_CHUNK of one stage's rows; returns how many."""
+
+    columns = list(keys) + ([counter[1].label('affected')] if counter else [])
+    rows = db.session.execute(select(columns).where(owned_by(user_id))
+                              .limit(PURGE_CHUNK)).fetchall()
+    if not rows:
+        return 0
+
+    if counter:
+        # Decrement each affected user once per row: group users by how
+        # many rows they lose, and update each group in one statement.
+        by_amount = defaultdict(list)
+        for affected, amount in Counter(row.affected for row in rows).items():
+            by_amount[amount].append(affected)
+        for amount, user_ids in by_amount.items():
+            counters.adjust_where(counter[0], -amount, user_ids)
+
+    if len(keys) == 1:
+        chunk = keys[0].in_([row[0] for row in rows])
+    else:
+        chunk = tuple_(*keys).in_([tuple(row[:len(keys)]) for row in rows])
+    return db.session.execute(table.delete().where(chunk)).rowcount
+
+
+def _record(user_id, deleted, finished=False):
+    values = {'rows_deleted': account_deletions.c.rows_deleted + deleted}
+    if finished:
+        values['finished_at'] = datetime.utcnow()
+    db.session.execute(account_deletions.update()
+                       .where(account_deletions.c.user_id == user_id)
+                       .values(values))
+
+
+@jobs.handler('purge_account')
+def purge(user_id):
+    """Purge the next chunk of a deleted account, enqueueing the rest."""
+
+    deleted_at = db.session.execute(
+        select([users.c.deleted_at]).where(users.c.id == user_id)).scalar()
+    if deleted_at is None:
+        # Already purged (or never deleted).
+        return
+
+    for table, owned_by, keys, counter in STAGES:
+        deleted = _purge_chunk(user_id, table, owned_by, keys, counter)
+        if deleted:
+            _record(user_id, deleted)
+            jobs.enqueue('purge_account', user_id=user_id)
+            return
+
+    db.session.execute(users.delete().where(users.c.id == user_id))
+    _record(user_id, 1, finished=True)
+    fragments.invalidate_on_commit('user', user_id)
@@ -0,0 +1,217 @@
+"""Cache of rendered template fragments.
+
+Message cards and profile headers are re-rendered on every page that shows
+them, though they rarely change. Templates wrap them in a call block:
+
+    {% call cached_message(msg, liked) %} ...card markup... {% endcall %}
+
+and the rendered markup is kept under a key made of the object's id and a
+version stamp. Changing the object bumps its stamp (`invalidate_message`,
+`invalidate_user`), so stale entries are simply never asked for again and
+age out of the cache.
+
+The default backend is an in-process LRU, which is right for a single
+process. With several worker processes, configure a shared backend (any
+client with get/set, such as a memcached or redis client) so a profile
+edit handled by one worker is seen by all of them.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask_sqlalchemy import SignallingSession
+from markupsafe import Markup
+from sqlalchemy import event
+
+from models import db
+
+
+class LRUBackend:
+    """In-process, thread-safe, least-recently-used cache."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ClientBackend:
+    """Adapter for a shared cache client (memcached, redis, ...).
+
+    The client needs get(key) and set(key, value); values are stored as
+    UTF-8 text under `prefix`.
+    """
+
+    def __init__(self, client, prefix="warbler:fragment:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value)
+
+    def clear(self):
+        # Shared caches are cleared by bumping versions, not wholesale.
+        pass
+
+
+class FragmentCache:
+    """Versioned fragment cache with hit/miss counts."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or LRUBackend()
+        self.hits = 0
+        self.misses = 0
+        # Guards the counts, which request threads update concurrently.
+        self._lock = threading.Lock()
+
+    def version(self, kind, obj_id):
+        """Return the current version stamp of one object."""
+
+        key = f"version:{kind}:{obj_id}"
+        stamp = self.backend.get(key)
+
+        if stamp is None:
+            # A time-based start, rather than 0, means a version that was
+            # evicted can't come back as a stamp that was used before.
+            stamp = str(time.time_ns())
+            self.backend.set(key, stamp)
+
+        return stamp
+
+    def invalidate(self, kind, obj_id):
+        """Give one object a new version stamp."""
+
+        self.backend.set(f"version:{kind}:{obj_id}", str(time.time_ns()))
+
+    def get_or_render(self, key, render):
+        """Return the markup cached at `key`, rendering and storing on a miss."""
+
+        html = self.backend.get(key)
+        if html is not None:
+            with self._lock:
+                self.hits += 1
+            return Markup(html)
+
+        with self._lock:
+            self.misses += 1
+        html = str(render())
+        self.backend.set(key, html)
+        return Markup(html)
+
+    def stats(self):
+        """Hit and miss counts since start-up (or the last clear)."""
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+fragment_cache = FragmentCache()
+
+
+def init_app(app):
+    """Configure the cache from app config and register template helpers.
+
+    FRAGMENT_CACHE_CLIENT, if set, is a shared cache client to use instead
+    of the in-process LRU, whose size is FRAGMENT_CACHE_SIZE.
+    """
+
+    client = app.config.get('FRAGMENT_CACHE_CLIENT')
+    if client is not None:
+        fragment_cache.backend = ClientBackend(client)
+    else:
+        fragment_cache.backend = LRUBackend(
+            app.config.get('FRAGMENT_CACHE_SIZE', 10000))
+
+    app.add_template_global(cached_message)
+    app.add_template_global(cached_profile)
+
+
+##############################################################################
+# Keys and invalidation for the fragments Warbler caches
+
+
+def cached_message(msg, *variant, caller):
+    """Cache a message card; `variant` covers viewer-specific differences."""
+
+    key = ":".join(str(p) for p in [
+        "message", msg.id, msg.timestamp.isoformat(),
+        fragment_cache.version('message', msg.id),
+        fragment_cache.version('user', msg.user_id),
+        *variant])
+    return fragment_cache.get_or_render(key, caller)
+
+
+def cached_profile(user, part, caller):
+    """Cache one part of a profile header (it shows the user's counters)."""
+
+    key = ":".join(str(p) for p in [
+        "profile", user.id, part, user.username,
+        fragment_cache.version('user', user.id),
+        user.messages_count, user.following_count,
+        user.followers_count, user.likes_count])
+    return fragment_cache.get_or_render(key, caller)
+
+
+def invalidate_message(message_id):
+    """Forget cached cards of a message that was deleted or (un)liked."""
+
+    fragment_cache.invalidate('message', message_id)
+
+
+def invalidate_user(user_id):
+    """Forget a user's cached profile header and message cards."""
+
+    fragment_cache.invalidate('user', user_id)
+
+
+def invalidate_on_commit(kind, obj_id):
+    """Invalidate an object once the current transaction commits.
+
+    Bumping the version before commit would let a concurrent request cache
+    the old data under the new stamp, where it would then stay.
+    """
+
+    pending = db.session.info.setdefault('fragment_invalidations', set())
+    pending.add((kind, obj_id))
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _invalidate_committed(session):
+    for kind, obj_id in session.info.pop('fragment_invalidations', ()):
+        fragment_cache.invalidate(kind, obj_id)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('fragment_invalidations', None)
@@ -2,15 +2,31 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. load-test fixtures:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 50000000 --out /tmp/fixtures --processes 8
+
+Rows are written as they're generated, a shard at a time, so memory use
+stays flat however many are asked for; shards are generated in parallel
+and then joined in order. Who follows whom follows a power law: a few
+users have huge followings, most have few. The same --seed and --until
+always produce the same files, whatever the number of processes.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import random
+import shutil
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
 from faker import Faker
-from helpers import get_random_datetime
+
+from helpers import (HEADER_IMAGE_URLS, get_random_datetime, power_law_rank,
+                     scatter)
 
 MAX_WARBLER_LENGTH = 140
 
@@ -22,56 +38,185 @@ NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
 
-fake = Faker()
+# Hash of "password", shared by every generated user.
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-# Generate random profile image URLs to use for users
-
-image_urls = [
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
+def shard_rng(seed, kind, shard):
+    """A random generator, and a Faker, private to one shard."""
+
+    rng = random.Random(f"{seed}:{kind}:{shard}")
+    fake = Faker()
+    fake.seed_instance(f"{seed}:{kind}:{shard}")
+    return rng, fake
+
+
+def write_users(writer, rng, fake, start, stop, opts):
+    """Users with ids start..stop-1 (ids are row numbers)."""
+
+    for user_id in range(start, stop):
+        # The id suffix keeps usernames and emails unique at any scale.
+        username = f"{fake.user_name()}{user_id}"
+        writer.writerow([
+            f"{username}@{fake.free_email_domain()}",
+            username,
+            rng.choice(IMAGE_URLS),
+            PASSWORD_HASH,
+            fake.sentence(),
+            rng.choice(HEADER_IMAGE_URLS),
+            fake.city(),
+        ])
+
+
+def write_messages(writer, rng, fake, start, stop, opts):
+    """Messages start..stop-1, by users picked at random."""
+
+    for _ in range(start, stop):
+        writer.writerow([
+            fake.paragraph()[:MAX_WARBLER_LENGTH],
+            get_random_datetime(rng=rng, now=opts.until),
+            rng.randint(1, opts.users),
+        ])
+
+
+def follows_of(user_id, opts):
+    """How many users `user_id` follows: the follows, spread evenly."""
+
+    count = opts.follows // opts.users
+    if user_id <= opts.follows % opts.users:
+        count += 1
+    return min(count, opts.users - 1)
+
+
+def write_follows(writer, rng, fake, start, stop, opts):
+    """Whom users start..stop-1 follow, favoring popular users."""
+
+    for follower in range(start, stop):
+        wanted = follows_of(follower, opts)
+
+        if wanted > opts.users // 2:
+            # Following most users: rejection sampling would crawl.
+            followed = [user_id for user_id
+                        in rng.sample(range(1, opts.users + 1), wanted + 1)
+                        if user_id != follower][:wanted]
+        else:
+            followed = set()
+            while len(followed) < wanted:
+                rank = power_law_rank(rng, opts.users, opts.exponent)
+                user_id = scatter(rank, opts.users)
+                if user_id != follower:
+                    followed.add(user_id)
+
+        for user_id in sorted(followed):
+            writer.writerow([user_id, follower])
+
+
+WRITERS = {
+    'users': write_users,
+    'messages': write_messages,
+    'follows': write_follows,
+}
+
+
+def shards(total, per_shard):
+    """Split ids 1..total into (start, stop) ranges of `per_shard`."""
+
+    return [(start, min(start + per_shard, total + 1))
+            for start in range(1, total + 1, per_shard)]
+
+
+def plan(opts):
+    """Every shard to generate, as (kind, index, start, stop)."""
+
+    # Follows are sharded by follower, sized to give shards about
+    # --shard-size follows each.
+    followers_per_shard = max(1, opts.shard_size * opts.users
+                              // max(opts.follows, 1))
+    ranges = {
+        'users': shards(opts.users, opts.shard_size),
+        'messages': shards(opts.messages, opts.shard_size),
+        'follows': shards(opts.users if opts.follows else 0,
+                          followers_per_shard),
+    }
+    return [(kind, index, start, stop)
+            for kind, kind_ranges in ranges.items()
+            for index, (start, stop) in enumerate(kind_ranges)]
+
+
+def part_path(opts, kind, index):
+    return os.path.join(opts.out, f"{kind}.csv.part{index:05d}")
+
+
+def generate_shard(job):
+    """Write one shard to its part file; returns its kind."""
+
+    kind, index, start, stop, opts = job
+    rng, fake = shard_rng(opts.seed, kind, index)
+
+    with open(part_path(opts, kind, index), 'w', newline='') as f:
+        WRITERS[kind](csv.writer(f), rng, fake, start, stop, opts)
+
+    return kind
+
+
+def join_parts(opts, kind, headers, count):
+    """Concatenate a kind's part files, in order, under its header."""
+
+    with open(os.path.join(opts.out, f"{kind}.csv"), 'w', newline='') as out:
+        csv.writer(out).writerow(headers)
+        for index in range(count):
+            path = part_path(opts, kind, index)
+            with open(path, newline='') as part:
+                shutil.copyfileobj(part, out)
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Warbler CSVs.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS)
+    parser.add_argument('--out', default='generator',
+                        help="directory to write the CSVs to")
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--until', type=datetime.fromisoformat,
+                        default=datetime.now().replace(hour=0, minute=0,
+                                                       second=0, microsecond=0),
+                        help="latest message time (default: start of today)")
+    parser.add_argument('--exponent', type=float, default=1.5,
+                        help="power-law exponent of follower counts")
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--shard-size', type=int, default=100000,
+                        help="rows per shard")
+    opts = parser.parse_args()
+
+    os.makedirs(opts.out, exist_ok=True)
+    jobs = plan(opts)
+    started = time.monotonic()
+
+    with Pool(opts.processes) as pool:
+        for _ in pool.imap_unordered(generate_shard,
+                                     [job + (opts, ) for job in jobs]):
+            pass
+
+    for kind, headers in [('users', USERS_CSV_HEADERS),
+                          ('messages', MESSAGES_CSV_HEADERS),
+                          ('follows', FOLLOWS_CSV_HEADERS)]:
+        join_parts(opts, kind, headers,
+                   sum(1 for job in jobs if job[0] == kind))
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+    elapsed = time.monotonic() - started
+    total = opts.users + opts.messages + opts.follows
+    print(f"Wrote {opts.users} users, {opts.messages} messages and "
+          f"{opts.follows} follows to {opts.out}/ in {elapsed:.1f}s "
+          f"({total / elapsed:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,99 @@
 """Support functions for CSV generation."""
 
+import random
 from datetime import datetime
-from random import uniform
+from functools import lru_cache
+from math import gcd
 
+# Header images for generated users (from splashbase.co, listed here so
+# generating data doesn't need the network).
+HEADER_IMAGE_URLS = [
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2x3aAnRH1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2xijE2nr1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh17lfd9R1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6rzyNlAN1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo1h6tGOZf1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh1d7s3UD1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh2m1hnS81st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6f50W261st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s32zb6l1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6scv2xrZ1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2xgqdEFn1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh0uemhCk1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh25vNOvI1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh29fxz111st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh1uhYnog1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh1jdFvHR1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopq4kHmAg1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqamedKu1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6tjdFhf1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2xdqmle51st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s7lR1lS1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopq69jlcS1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopq8fyQwI1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6sasSvPZ1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6poZxE51st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6w0dxAm1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqdfx05t1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqj9QUeq1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh0n9pHJW1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6l06zXi1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqc3ZZcz1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2wz2LTCs1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s1hAudo1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqhxFulr1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh121HEWa1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6gwrYvm1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqfpSTPN1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s995bvI1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s4dzqHA1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2x9xqeef1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqkkwK2M1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2xbk8JUK1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s661UgK1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2x80NkDu1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2xfarCvW1st5lhmo1_1280.jpg",
+]
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
 
-    now = datetime.now()
+def get_random_datetime(year_gap=2, rng=random, now=None):
+    """Get a random datetime within the `year_gap` years before `now`."""
+
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    random_timestamp = rng.uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def power_law_rank(rng, n, exponent):
+    """Draw a rank in 1..n with P(rank k) roughly proportional to k ** -exponent.
+
+    Samples the continuous bounded power law by inverting its CDF, so it
+    takes constant time and memory for any n.
+    """
+
+    u = rng.random()
+    if exponent == 1:
+        x = n ** u
+    else:
+        x = ((n ** (1 - exponent) - 1) * u + 1) ** (1 / (1 - exponent))
+    return min(n, int(x))
+
+
+def scatter(rank, n):
+    """Map rank 1..n onto user ids 1..n, one to one, without a table.
+
+    Keeps the most-followed users from all having the lowest ids.
+    """
+
+    step = _coprime_step(n)
+    return (rank - 1) * step % n + 1
+
+
+@lru_cache()
+def _coprime_step(n):
+    step = int(n * 0.6180339887) or 1
+    while gcd(step, n) != 1:
+        step += 1
+    return step
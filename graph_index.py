@@ -0,0 +1,270 @@
+"""An optional in-process index of who follows whom.
+
+Without it, follow checks ("does the viewer follow each user on this
+page?") cost an indexed query per request. With GRAPH_INDEX set, the
+process loads the whole follow graph at startup and answers them from
+memory. Each user's followed ids, and separately their followers' ids,
+are kept as a sorted array('i') of 4 bytes per id, with no per-edge
+Python objects. So:
+
+- membership (does a follow b?) is a binary search, O(log n) in a's
+  following count;
+- intersections (whom do both a and b follow? who follows a back?) look
+  the smaller array up in the larger one.
+
+Follows, unfollows and account deletions update the index incrementally
+once they commit. An update replaces the user's array with an updated
+copy rather than changing it in place, so readers never see a
+half-updated array and don't need a lock.
+
+The index only sees changes made through this process. Leave it off
+wherever several processes change follows (more than one server, say),
+or restart them after `flask import-data`. serve.py runs a single
+process, which suits it:
+
+    GRAPH_INDEX=1 python serve.py
+"""
+
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, select
+
+from models import db, Follows, User
+
+follows = Follows.__table__
+
+# Array type: C int, which holds any users.id.
+TYPECODE = 'i'
+EMPTY = array(TYPECODE)
+
+# Rows fetched at a time while loading.
+LOAD_BATCH = 10000
+
+# When one array is this many times longer than the other, intersect()
+# binary-searches the short one's ids in it instead of hashing it whole.
+SEARCH_RATIO = 32
+
+
+def contains(ids, value):
+    """Is `value` in the sorted array `ids`?"""
+
+    i = bisect_left(ids, value)
+    return i < len(ids) and ids[i] == value
+
+
+def intersect(a, b):
+    """Sorted list of the ids in both sorted arrays `a` and `b`."""
+
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return []
+
+    if len(b) > SEARCH_RATIO * len(a):
+        found, lo = [], 0
+        for value in a:
+            lo = bisect_left(b, value, lo)
+            if lo == len(b):
+                break
+            if b[lo] == value:
+                found.append(value)
+        return found
+
+    return sorted(set(a).intersection(b))
+
+
+def _with(ids, value):
+    i = bisect_left(ids, value)
+    if i < len(ids) and ids[i] == value:
+        return None
+    updated = array(TYPECODE, ids)
+    updated.insert(i, value)
+    return updated
+
+
+def _without(ids, value):
+    i = bisect_left(ids, value)
+    if i == len(ids) or ids[i] != value:
+        return None
+    return ids[:i] + ids[i + 1:]
+
+
+class GraphIndex:
+    """Sorted adjacency arrays of the follow graph, both directions."""
+
+    def __init__(self):
+        # user id -> sorted ids of the users they follow / who follow them.
+        self.following = {}
+        self.followers = {}
+        # Serializes writers (and stats()); readers go without.
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        """Build the index from the follows table."""
+
+        graph = cls()
+        graph._load(graph.following, follows.c.user_following_id,
+                    follows.c.user_being_followed_id)
+        graph._load(graph.followers, follows.c.user_being_followed_id,
+                    follows.c.user_following_id)
+        return graph
+
+    @staticmethod
+    def _load(adjacency, key, value):
+        # Rows come in (key, value) order, so each array is built sorted
+        # by appending; both orders are index scans.
+        result = (db.session.connection()
+                  .execution_options(stream_results=True)
+                  .execute(select([key, value]).order_by(key, value)))
+        current, ids = None, None
+        while True:
+            rows = result.fetchmany(LOAD_BATCH)
+            if not rows:
+                break
+            for user_id, other_id in rows:
+                if user_id != current:
+                    current, ids = user_id, array(TYPECODE)
+                    adjacency[user_id] = ids
+                ids.append(other_id)
+
+    def follows(self, follower_id, followed_id):
+        return contains(self.following.get(follower_id, EMPTY), followed_id)
+
+    def followed_among(self, follower_id, user_ids):
+        """Which of `user_ids` does `follower_id` follow? As a set."""
+
+        ids = self.following.get(follower_id, EMPTY)
+        return {user_id for user_id in user_ids if contains(ids, user_id)}
+
+    def following_of(self, user_id):
+        return self.following.get(user_id, EMPTY)
+
+    def followers_of(self, user_id):
+        return self.followers.get(user_id, EMPTY)
+
+    def common_following(self, user_id, other_id):
+        """Ids of the users both `user_id` and `other_id` follow."""
+
+        return intersect(self.following_of(user_id),
+                         self.following_of(other_id))
+
+    def mutuals(self, user_id):
+        """Ids of the users `user_id` follows who follow them back."""
+
+        return intersect(self.following_of(user_id),
+                         self.followers_of(user_id))
+
+    def _replace(self, adjacency, key, change, value):
+        updated = change(adjacency.get(key, EMPTY), value)
+        if updated is None:
+            return
+        if updated:
+            adjacency[key] = updated
+        else:
+            adjacency.pop(key, None)
+
+    def add(self, follower_id, followed_id):
+        with self._lock:
+            self._replace(self.following, follower_id, _with, followed_id)
+            self._replace(self.followers, followed_id, _with, follower_id)
+
+    def remove(self, follower_id, followed_id):
+        with self._lock:
+            self._replace(self.following, follower_id, _without, followed_id)
+            self._replace(self.followers, followed_id, _without, follower_id)
+
+    def remove_user(self, user_id):
+        """Drop every follow to and from `user_id`."""
+
+        with self._lock:
+            for followed_id in self.following.pop(user_id, EMPTY):
+                self._replace(self.followers, followed_id, _without, user_id)
+            for follower_id in self.followers.pop(user_id, EMPTY):
+                self._replace(self.following, follower_id, _without, user_id)
+
+    def stats(self):
+        """Users with follows, follows, and bytes held by the index."""
+
+        # Under the writers' lock, so the dicts don't change as we go.
+        with self._lock:
+            nbytes = (sys.getsizeof(self.following)
+                      + sys.getsizeof(self.followers))
+            for adjacency in (self.following, self.followers):
+                nbytes += sum(sys.getsizeof(ids) for ids in adjacency.values())
+            return {'users': len(self.following.keys()
+                                 | self.followers.keys()),
+                    'follows': sum(len(ids)
+                                   for ids in self.following.values()),
+                    'bytes': nbytes}
+
+
+# The index, when GRAPH_INDEX is on.
+index = None
+
+
+def enable():
+    """Load the index from the database and use it from now on."""
+
+    global index
+    index = GraphIndex.load()
+
+
+def disable():
+    global index
+    index = None
+
+
+def followed_among(follower_id, user_ids):
+    """Which of `user_ids` does `follower_id` follow? From the index if on."""
+
+    if index is not None:
+        return index.followed_among(follower_id, user_ids)
+    return User.followed_among(follower_id, user_ids)
+
+
+##############################################################################
+# Keeping the index current
+
+
+def _on_commit(change, *args):
+    if index is not None:
+        db.session.info.setdefault('graph_index_changes', []).append(
+            (change, args))
+
+
+def add_on_commit(follower_id, followed_id):
+    _on_commit('add', follower_id, followed_id)
+
+
+def remove_on_commit(follower_id, followed_id):
+    _on_commit('remove', follower_id, followed_id)
+
+
+def remove_user_on_commit(user_id):
+    _on_commit('remove_user', user_id)
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _apply_committed(session):
+    changes = session.info.pop('graph_index_changes', ())
+    if index is not None:
+        for change, args in changes:
+            getattr(index, change)(*args)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('graph_index_changes', None)
+
+
+def init_app(app):
+    """Load the index at startup if GRAPH_INDEX is set."""
+
+    if app.config.get('GRAPH_INDEX'):
+        with app.app_context():
+            enable()
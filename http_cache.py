@@ -0,0 +1,118 @@
+"""HTTP caching policy.
+
+Each response gets a Cache-Control header from the rule for its endpoint
+(`CACHE_RULES`, falling back to `DEFAULT_RULE`):
+
+- Static files linked through `static_url()` carry a fingerprint of their
+  contents in the URL, so browsers may keep them for a year without
+  asking again; a changed file gets a new URL.
+- Profile and message pages, and the home page, are "conditional":
+  they're sent with an ETag (a hash of the page), and a browser
+  revalidating with If-None-Match gets a bodyless 304 when nothing
+  changed. Anonymous visitors may also reuse them for a short while, and
+  shared caches may hold them.
+- Other pages show per-user data, so only the user's browser may keep
+  them, and it must revalidate each time.
+- Responses to POSTs and anything sensitive aren't stored at all.
+"""
+
+import hashlib
+import os
+from collections import namedtuple
+
+from flask import current_app, g, request, session, url_for
+
+from current_user import CURR_USER_KEY
+
+# How long browsers may keep fingerprinted static files.
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# cache_control: the Cache-Control header; for conditional rules it
+# applies to anonymous visitors, while logged-in users get PRIVATE.
+# conditional: send an ETag and answer matching requests with 304.
+CacheRule = namedtuple('CacheRule', ['cache_control', 'conditional'])
+
+PRIVATE = "private, no-cache"
+NO_STORE = "no-store"
+
+DEFAULT_RULE = CacheRule(PRIVATE, False)
+
+CACHE_RULES = {
+    'static': CacheRule("public, max-age=3600", False),
+    'homepage': CacheRule("public, max-age=60", True),
+    'users_show': CacheRule("public, max-age=60", True),
+    'messages_show': CacheRule("public, max-age=60", True),
+    'api.user': CacheRule("public, max-age=60", True),
+    'api.message': CacheRule("public, max-age=60", True),
+    'metrics': CacheRule(NO_STORE, False),
+    'stream': CacheRule(NO_STORE, False),
+}
+
+_fingerprints = {}
+
+
+def fingerprint(path):
+    """Short hash of a file's contents, cached until the file changes."""
+
+    mtime = os.path.getmtime(path)
+    cached = _fingerprints.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = (mtime, hashlib.md5(f.read()).hexdigest()[:12])
+        _fingerprints[path] = cached
+    return cached[1]
+
+
+def static_url(filename):
+    """URL of a static file, fingerprinted so it can be cached forever."""
+
+    path = os.path.join(current_app.static_folder, filename)
+    return url_for('static', filename=filename, v=fingerprint(path))
+
+
+def _note_anonymous():
+    # Decided before the view runs: by the time the response is ready, the
+    # page has popped any flash messages it showed. Pending flash messages
+    # are per-visitor too.
+    g.anonymous = CURR_USER_KEY not in session and '_flashes' not in session
+
+
+def _is_public(response):
+    """May shared caches keep this response for everyone?"""
+
+    return (g.get('anonymous', False)
+            and not session.modified and not session.accessed
+            and 'Set-Cookie' not in response.headers)
+
+
+def apply_cache_policy(response):
+    """Set Cache-Control (and ETag, answering with 304s) per the route's rule."""
+
+    rule = CACHE_RULES.get(request.endpoint, DEFAULT_RULE)
+
+    if request.method not in ('GET', 'HEAD') or response.status_code >= 400:
+        response.headers['Cache-Control'] = NO_STORE
+        return response
+
+    if request.endpoint == 'static' and request.args.get('v'):
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+    if rule.conditional:
+        public = _is_public(response)
+        response.headers['Cache-Control'] = (rule.cache_control if public
+                                             else PRIVATE)
+        if response.status_code == 200 and not response.is_streamed:
+            response.add_etag()
+            response.make_conditional(request)
+        response.vary.add('Cookie')
+        return response
+
+    response.headers['Cache-Control'] = rule.cache_control
+    return response
+
+
+def init_app(app):
+    app.add_template_global(static_url)
+    app.before_request(_note_anonymous)
+    app.after_request(apply_cache_policy)
@@ -0,0 +1,210 @@
+"""Streaming bulk import of users, messages and follows from CSV files.
+
+Files are read a chunk at a time, so memory use doesn't grow with their
+size, and each chunk is written without going through the ORM: with
+COPY on Postgres (via a staging table, so rows already present are
+skipped) and executemany with INSERT OR IGNORE on SQLite.
+
+Imports are idempotent and resumable:
+
+- Users and messages get their CSV row number as their id (which is how
+  messages.csv and follows.csv refer to users), so loading a row twice
+  finds it already there and skips it.
+- Each chunk commits together with the number of rows of its file loaded
+  so far, in `import_progress`. A rerun after a crash, or on a database
+  already loaded, starts after the last committed chunk.
+
+Tables are loaded in foreign-key order: those that only depend on tables
+already loaded (messages and follows, once users are in) load in parallel.
+
+Run with:
+
+    flask import-data generator/
+"""
+
+import csv
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from sqlalchemy import select, text
+
+from models import db
+import counters
+import timeline
+
+CHUNK_SIZE = 10000
+
+# Table -> CSV file loaded into it.
+SOURCES = {
+    'users': 'users.csv',
+    'messages': 'messages.csv',
+    'follows': 'follows.csv',
+}
+
+import_progress = db.Table(
+    'import_progress',
+    db.Column('source', db.String(100), primary_key=True),
+    db.Column('rows_done', db.BigInteger, nullable=False),
+)
+
+
+def load_levels(tables):
+    """Group `tables` so each group only references tables in earlier ones."""
+
+    remaining = set(tables)
+    levels = []
+
+    while remaining:
+        level = sorted(
+            name for name in remaining
+            if not {fk.column.table.name
+                    for fk in db.metadata.tables[name].foreign_keys
+                    } & (remaining - {name}))
+        if not level:
+            raise ValueError(f"Circular foreign keys among {remaining}")
+        levels.append(level)
+        remaining -= set(level)
+
+    return levels
+
+
+def _chunks(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _rows_done(connection, source):
+    return connection.execute(
+        select([import_progress.c.rows_done])
+        .where(import_progress.c.source == source)).scalar() or 0
+
+
+def _save_progress(connection, source, rows_done):
+    connection.execute(text("""
+        INSERT INTO import_progress (source, rows_done)
+        VALUES (:source, :rows_done)
+        ON CONFLICT (source) DO UPDATE SET rows_done = excluded.rows_done"""),
+        source=source, rows_done=rows_done)
+
+
+def _copy_chunk(cursor, table, columns, chunk):
+    """Load rows on Postgres: COPY to a staging table, then insert new ones."""
+
+    staging = f"import_staging_{table}"
+    cols = ", ".join(columns)
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+                   f"(LIKE {table} INCLUDING DEFAULTS)")
+
+    # Quoting every field keeps empty strings from being read as NULL.
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(chunk)
+    buffer.seek(0)
+
+    cursor.copy_expert(f"COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv)",
+                       buffer)
+    cursor.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {staging} "
+                   f"ON CONFLICT DO NOTHING")
+    cursor.execute(f"TRUNCATE {staging}")
+
+
+def _insert_chunk(cursor, table, columns, chunk):
+    """Load rows on SQLite, skipping any already present."""
+
+    marks = ", ".join("?" for _ in columns)
+    cursor.executemany(f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) "
+                       f"VALUES ({marks})", chunk)
+
+
+def load_table(engine, table, path, chunk_size=CHUNK_SIZE, log=print):
+    """Stream one CSV file into `table`; returns the number of rows loaded."""
+
+    numbered = 'id' in db.metadata.tables[table].c
+    write_chunk = (_copy_chunk if engine.dialect.name == 'postgresql'
+                   else _insert_chunk)
+    started = time.monotonic()
+    loaded = 0
+
+    with engine.connect() as connection, open(path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        if numbered:
+            columns = ['id'] + columns
+
+        done = _rows_done(connection, table)
+        rows = islice(reader, done, None)
+        if numbered:
+            rows = ([row_number] + row
+                    for row_number, row in enumerate(rows, start=done + 1))
+
+        for chunk in _chunks(rows, chunk_size):
+            with connection.begin():
+                cursor = connection.connection.cursor()
+                try:
+                    write_chunk(cursor, table, columns, chunk)
+                finally:
+                    cursor.close()
+                done += len(chunk)
+                _save_progress(connection, table, done)
+
+            loaded += len(chunk)
+            elapsed = time.monotonic() - started
+            log(f"{table}: {done} rows "
+                f"({loaded / max(elapsed, 1e-9):,.0f} rows/s)")
+
+    return loaded
+
+
+def reset_sequences(connection, tables):
+    """Move Postgres id sequences past the ids the import assigned."""
+
+    if connection.dialect.name != 'postgresql':
+        return
+
+    for table in tables:
+        if 'id' in db.metadata.tables[table].c:
+            connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)"))
+
+
+def import_dir(directory, chunk_size=CHUNK_SIZE, workers=2, log=print):
+    """Import every known CSV in `directory`; returns rows loaded per table.
+
+    Afterwards the derived data (id sequences, home timelines and user
+    counters) is rebuilt from the imported tables, also on a rerun that
+    found nothing left to load, in case the previous run stopped first.
+    """
+
+    engine = db.engine
+    import_progress.create(engine, checkfirst=True)
+
+    # SQLite allows one writer at a time, so parallel loads would only
+    # take turns waiting on each other's locks.
+    if engine.dialect.name == 'sqlite':
+        workers = 1
+
+    paths = {table: os.path.join(directory, filename)
+             for table, filename in SOURCES.items()
+             if os.path.exists(os.path.join(directory, filename))}
+    loaded = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for level in load_levels(paths):
+            futures = {table: pool.submit(load_table, engine, table,
+                                          paths[table], chunk_size, log)
+                       for table in level}
+            for table, future in futures.items():
+                loaded[table] = future.result()
+
+    reset_sequences(db.session.connection(), paths)
+    timeline.rebuild()
+    counters.reconcile()
+    db.session.commit()
+
+    return loaded
@@ -0,0 +1,347 @@
+"""Per-request SQL and timing instrumentation.
+
+Every request records how many SQL statements it ran, the time spent in
+the database and in template rendering, and its total time. Totals per
+endpoint are kept in memory and served at /metrics in the Prometheus text
+format. With SERVER_TIMING set, each response also carries a
+Server-Timing header with its own numbers, which browsers' dev tools
+display; it's off by default, since it tells any client how long the
+database took.
+
+Statements slower than SLOW_QUERY_MS are counted by fingerprint: the SQL
+with literals and parameter lists collapsed, so the same query with
+different values is one entry (and no user data ends up in metrics).
+
+The bookkeeping is a few clock reads and dictionary updates per request
+and per statement, cheap enough to leave on in production. /metrics
+requires `Authorization: Bearer <token>` with the token METRICS_TOKEN;
+without one set, it isn't served at all (it lists endpoints and query
+shapes, which shouldn't be public).
+"""
+
+import re
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+from flask import (Response, abort, before_render_template, current_app, g,
+                   has_request_context, request, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database import pool_stats
+from fragments import fragment_cache
+import graph_index
+from jobs import runner
+from live import bus
+from models import db
+from passwords import hasher
+
+# Upper bounds, in seconds, of the request duration histogram's buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Most distinct slow-query fingerprints kept; later ones are dropped.
+MAX_FINGERPRINTS = 500
+
+# Statements at least this slow are captured; set from SLOW_QUERY_MS.
+_slow_query_ms = 100
+
+
+class Metrics:
+    """Totals across requests, per endpoint, safe to update from threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.durations = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+            self.seconds = defaultdict(float)
+            self.queries = defaultdict(int)
+            self.db_seconds = defaultdict(float)
+            self.render_seconds = defaultdict(float)
+            self.slow_queries = {}
+
+    def record_request(self, endpoint, method, status, stats, duration):
+        bucket = next((i for i, bound in enumerate(BUCKETS)
+                       if duration <= bound), len(BUCKETS))
+
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            self.durations[endpoint][bucket] += 1
+            self.seconds[endpoint] += duration
+            self.queries[endpoint] += stats.queries
+            self.db_seconds[endpoint] += stats.db_seconds
+            self.render_seconds[endpoint] += stats.render_seconds
+
+    def record_slow_query(self, statement, duration):
+        key = fingerprint(statement)
+
+        with self._lock:
+            entry = self.slow_queries.get(key)
+            if entry is None:
+                if len(self.slow_queries) >= MAX_FINGERPRINTS:
+                    return
+                entry = self.slow_queries[key] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += duration
+
+
+metrics = Metrics()
+
+
+class RequestStats:
+    """What one request has spent so far."""
+
+    __slots__ = ('started', 'queries', 'db_seconds', 'render_seconds',
+                 'render_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started = None
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement):
+    """Normalize SQL so that runs with different values compare equal."""
+
+    sql = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"%\(\w+\)s|:\w+|\$\d+", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+##############################################################################
+# Collection
+
+
+def _current_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context,
+                   executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context,
+                    executemany):
+    started = conn.info.pop('query_started', None)
+    if started is None:
+        # Instrumentation was set up while this statement ran.
+        return
+    duration = time.perf_counter() - started
+
+    stats = _current_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += duration
+
+    if duration * 1000 >= _slow_query_ms:
+        metrics.record_slow_query(statement, duration)
+
+
+def _render_started(sender, template, context, **extra):
+    stats = _current_stats()
+    if stats is not None and stats.render_started is None:
+        stats.render_started = time.perf_counter()
+
+
+def _render_finished(sender, template, context, **extra):
+    stats = _current_stats()
+    if stats is not None and stats.render_started is not None:
+        stats.render_seconds += time.perf_counter() - stats.render_started
+        stats.render_started = None
+
+
+def _start_request():
+    g.request_stats = RequestStats()
+
+
+def _finish_request(response):
+    stats = _current_stats()
+    if stats is None:
+        return response
+
+    duration = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'none'
+    metrics.record_request(endpoint, request.method, response.status_code,
+                           stats, duration)
+
+    if not current_app.config.get('SERVER_TIMING'):
+        return response
+
+    response.headers['Server-Timing'] = (
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries", '
+        f'render;dur={stats.render_seconds * 1000:.1f}, '
+        f'total;dur={duration * 1000:.1f}')
+    return response
+
+
+def init_app(app):
+    """Start collecting for `app` and add its /metrics endpoint.
+
+    SLOW_QUERY_MS (default 100) is the threshold for slow-query capture;
+    SERVER_TIMING adds the Server-Timing header to responses.
+    """
+
+    global _slow_query_ms
+    _slow_query_ms = app.config.get('SLOW_QUERY_MS', 100)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+##############################################################################
+# Exposition
+
+
+def _label(value):
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return '"' + value.replace('\n', '\\n') + '"'
+
+
+def render_metrics(extra=()):
+    """All metrics in the Prometheus text exposition format.
+
+    `extra` is (name, type, help, value) for further samples, where value
+    is a number or a list of (labels, number).
+    """
+
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    with metrics._lock:
+        family('warbler_requests_total', 'counter', "Requests handled.")
+        for (endpoint, method, status), count in sorted(
+                metrics.requests.items()):
+            lines.append(f"warbler_requests_total{{endpoint={_label(endpoint)},"
+                         f"method={_label(method)},status={_label(status)}}} "
+                         f"{count}")
+
+        family('warbler_request_duration_seconds', 'histogram',
+               "Time to handle a request.")
+        for endpoint, counts in sorted(metrics.durations.items()):
+            label = f"endpoint={_label(endpoint)}"
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf', ), counts):
+                cumulative += count
+                lines.append(f"warbler_request_duration_seconds_bucket"
+                             f"{{{label},le=\"{bound}\"}} {cumulative}")
+            lines.append(f"warbler_request_duration_seconds_sum{{{label}}} "
+                         f"{metrics.seconds[endpoint]:.6f}")
+            lines.append(f"warbler_request_duration_seconds_count{{{label}}} "
+                         f"{cumulative}")
+
+        for name, values, help_text in [
+                ('warbler_db_queries_total', metrics.queries,
+                 "SQL statements run."),
+                ('warbler_db_seconds_total', metrics.db_seconds,
+                 "Time spent running SQL."),
+                ('warbler_render_seconds_total', metrics.render_seconds,
+                 "Time spent rendering templates.")]:
+            family(name, 'counter', help_text)
+            for endpoint, value in sorted(values.items()):
+                lines.append(f"{name}{{endpoint={_label(endpoint)}}} {value}")
+
+        family('warbler_slow_queries_total', 'counter',
+               "Statements slower than SLOW_QUERY_MS, by fingerprint.")
+        family('warbler_slow_query_seconds_total', 'counter',
+               "Time spent in slow statements, by fingerprint.")
+        for sql, (count, seconds) in sorted(metrics.slow_queries.items()):
+            lines.append(f"warbler_slow_queries_total"
+                         f"{{fingerprint={_label(sql)}}} {count}")
+            lines.append(f"warbler_slow_query_seconds_total"
+                         f"{{fingerprint={_label(sql)}}} {seconds:.6f}")
+
+    for name, kind, help_text, value in extra:
+        family(name, kind, help_text)
+        if not isinstance(value, list):
+            lines.append(f"{name} {value}")
+            continue
+        for labels, sample in value:
+            label_text = ",".join(f"{key}={_label(label)}"
+                                  for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {sample}")
+
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view():
+    """Serve the metrics, and other components' counters and gauges."""
+
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        abort(404)
+    if request.headers.get('Authorization') != f"Bearer {token}":
+        abort(401)
+
+    cache = fragment_cache.stats()
+    hashing = hasher.stats()
+    streams = bus.stats()
+    pools = sorted(pool_stats(db).items())
+    job_counts = runner.stats()
+    graph = (graph_index.index.stats() if graph_index.index is not None
+             else {'follows': 0, 'bytes': 0})
+    extra = [
+        ('warbler_fragment_cache_hits_total', 'counter',
+         "Fragment cache hits.", cache['hits']),
+        ('warbler_fragment_cache_misses_total', 'counter',
+         "Fragment cache misses.", cache['misses']),
+        ('warbler_password_hash_in_flight', 'gauge',
+         "Password hashes running or queued.", hashing['in_flight']),
+        ('warbler_password_hash_queued', 'gauge',
+         "Password hashes waiting for a worker.", hashing['queued']),
+        ('warbler_password_hash_completed_total', 'counter',
+         "Password hashes computed.", hashing['completed']),
+        ('warbler_password_hash_rejected_total', 'counter',
+         "Password hashes refused because the queue was full.",
+         hashing['rejected']),
+        ('warbler_live_streams', 'gauge',
+         "Live streams open.", streams['subscribers']),
+        ('warbler_live_events_delivered_total', 'counter',
+         "Events queued for live streams.", streams['delivered']),
+        ('warbler_live_streams_dropped_total', 'counter',
+         "Live streams dropped for falling behind.", streams['dropped']),
+        ('warbler_live_streams_rejected_total', 'counter',
+         "Live streams refused at LIVE_MAX_STREAMS.", streams['rejected']),
+        ('warbler_jobs_completed_total', 'counter',
+         "Background jobs completed.", job_counts['completed']),
+        ('warbler_jobs_retried_total', 'counter',
+         "Background job attempts that failed and will be retried.",
+         job_counts['retried']),
+        ('warbler_jobs_failed_total', 'counter',
+         "Background jobs given up on after MAX_ATTEMPTS.",
+         job_counts['failed']),
+        ('warbler_graph_index_follows', 'gauge',
+         "Follows held by the in-memory graph index.", graph['follows']),
+        ('warbler_graph_index_bytes', 'gauge',
+         "Memory used by the graph index's arrays.", graph['bytes']),
+        ('warbler_db_pool_size', 'gauge',
+         "Connections the pool keeps open.",
+         [({'database': name}, size) for name, (size, _, _) in pools]),
+        ('warbler_db_pool_checked_out', 'gauge',
+         "Connections in use.",
+         [({'database': name}, used) for name, (_, used, _) in pools]),
+        ('warbler_db_pool_overflow', 'gauge',
+         "Connections open beyond the pool size.",
+         [({'database': name}, over) for name, (_, _, over) in pools]),
+    ]
+
+    return Response(render_metrics(extra),
+                    mimetype='text/plain; version=0.0.4')
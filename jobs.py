@@ -0,0 +1,352 @@
+"""Background jobs for side effects that needn't hold up a request.
+
+A request makes its own change (a message row, a follow, the counters
+it shows straight back) and enqueues the expensive consequences, such as
+copying a message into every follower's timeline, as jobs. A job is a row
+in the `jobs` table inserted in the request's transaction, so it exists
+exactly when the change that needs it committed, and it survives restarts
+until it's done. The request's work no longer depends on how many
+followers, messages or likes are involved.
+
+Worker threads claim due jobs and run each in its own transaction,
+together with marking it done, so its effects apply exactly once. A job
+that raises is retried with exponential backoff, up to MAX_ATTEMPTS
+times, then left `failed` with its error for inspection. A job whose
+worker died mid-run is claimed again after LOCK_TIMEOUT.
+
+A job may carry an idempotency key: enqueueing a key that's already been
+used does nothing, so the same side effect can't be scheduled twice.
+
+Some jobs recur (refreshing recommendations, say): `schedule()` has
+workers enqueue one every so many seconds. Each period's job has a key
+naming the period, so however many workers and processes there are, it's
+enqueued once.
+
+Jobs are queued by default (JOB_MODE = 'queue'). A process starts
+JOB_WORKERS worker threads (serve.py's --job-workers, 2 by default); with
+none, the default for `flask run` and gunicorn, it only enqueues, and
+separate worker processes run the jobs:
+
+    flask run-jobs
+
+With JOB_MODE = 'inline' (what tests use) nothing is queued: jobs run at
+once, inside the enqueuing transaction, just as if the request did the
+work itself.
+"""
+
+import json
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import and_, event, or_, select
+
+from models import db
+from sqlutil import insert_ignore
+
+# Attempts before a job is given up on.
+MAX_ATTEMPTS = 5
+
+# A job running longer than this is assumed lost with its worker.
+LOCK_TIMEOUT = timedelta(minutes=10)
+
+# Jobs considered per claim; workers race for them, one wins each.
+CLAIM_BATCH = 10
+
+# How long finished jobs (and so their idempotency keys) are kept, and
+# how often workers delete older ones.
+RETENTION = timedelta(days=7)
+PURGE_EVERY_SECONDS = 3600
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+jobs = db.Table(
+    'jobs',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('kind', db.String(50), nullable=False),
+    db.Column('payload', db.Text, nullable=False),
+    db.Column('idempotency_key', db.String(200), unique=True),
+    db.Column('status', db.String(10), nullable=False),
+    db.Column('attempts', db.Integer, nullable=False, default=0),
+    db.Column('run_after', db.DateTime, nullable=False),
+    db.Column('locked_at', db.DateTime),
+    db.Column('finished_at', db.DateTime),
+    db.Column('last_error', db.Text),
+    db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+)
+
+# Job kind -> the function that does it, called with the payload.
+HANDLERS = {}
+
+# Job kind -> seconds between runs, for jobs workers enqueue themselves;
+# and the period each was last enqueued for by this process.
+SCHEDULE = {}
+_scheduled_periods = {}
+
+# Whether jobs run at once instead of being queued; set from JOB_MODE.
+_inline = False
+_inline_jobs = threading.local()
+
+
+def handler(kind):
+    """Register the decorated function as the handler for jobs of `kind`."""
+
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+
+    return register
+
+
+def schedule(kind, every_seconds):
+    """Have workers enqueue a `kind` job (with no payload) periodically."""
+
+    SCHEDULE[kind] = every_seconds
+
+
+def backoff(attempts):
+    """How long to wait before retrying a job that failed `attempts` times."""
+
+    return timedelta(seconds=2 ** attempts)
+
+
+def enqueue(kind, key=None, **payload):
+    """Have `HANDLERS[kind](**payload)` run after the current transaction.
+
+    The job is queued with the transaction (or, inline, run right away
+    within it). `payload` must be JSON-serializable. Returns False if
+    `key` was already used, so nothing was enqueued.
+    """
+
+    if _inline:
+        _run_inline(kind, payload)
+        return True
+
+    values = {'kind': kind, 'payload': json.dumps(payload),
+              'idempotency_key': key, 'status': QUEUED, 'attempts': 0,
+              'run_after': datetime.utcnow()}
+    if key is None:
+        db.session.execute(jobs.insert().values(values))
+    elif not insert_ignore(jobs, values, unique=['idempotency_key']):
+        return False
+
+    db.session.info['jobs_enqueued'] = True
+    return True
+
+
+def _run_inline(kind, payload):
+    # A job may enqueue a follow-up, which may enqueue another, and so on
+    # (see deletion.py); run them in turn rather than nested, however long
+    # the chain.
+    pending = getattr(_inline_jobs, 'pending', None)
+    if pending is not None:
+        pending.append((kind, payload))
+        return
+
+    _inline_jobs.pending = [(kind, payload)]
+    try:
+        while _inline_jobs.pending:
+            kind, payload = _inline_jobs.pending.pop(0)
+            HANDLERS[kind](**payload)
+    finally:
+        _inline_jobs.pending = None
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_enqueued', False):
+        runner.wake()
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+##############################################################################
+# Running jobs
+
+
+def _claimable(now):
+    return or_(and_(jobs.c.status == QUEUED, jobs.c.run_after <= now),
+               and_(jobs.c.status == RUNNING,
+                    jobs.c.locked_at < now - LOCK_TIMEOUT))
+
+
+def claim():
+    """Take one due job for this worker; returns its row, or None."""
+
+    now = datetime.utcnow()
+    candidates = db.session.execute(
+        select([jobs.c.id]).where(_claimable(now))
+        .order_by(jobs.c.id).limit(CLAIM_BATCH)).fetchall()
+
+    for (job_id, ) in candidates:
+        # Only one worker's UPDATE still finds the job claimable.
+        claimed = db.session.execute(
+            jobs.update()
+            .where(jobs.c.id == job_id).where(_claimable(now))
+            .values(status=RUNNING, locked_at=now,
+                    attempts=jobs.c.attempts + 1)).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.execute(
+                jobs.select().where(jobs.c.id == job_id)).first()
+
+    db.session.commit()
+    return None
+
+
+def run(job):
+    """Run a claimed job; returns True if it succeeded."""
+
+    try:
+        HANDLERS[job.kind](**json.loads(job.payload))
+        db.session.execute(jobs.update().where(jobs.c.id == job.id)
+                           .values(status=DONE, locked_at=None,
+                                   finished_at=datetime.utcnow()))
+        db.session.commit()
+        runner.count('completed')
+        return True
+
+    except Exception:
+        db.session.rollback()
+        gave_up = job.attempts >= MAX_ATTEMPTS
+        db.session.execute(
+            jobs.update().where(jobs.c.id == job.id)
+            .values(status=FAILED if gave_up else QUEUED, locked_at=None,
+                    run_after=datetime.utcnow() + backoff(job.attempts),
+                    last_error=traceback.format_exc()[-4000:]))
+        db.session.commit()
+        runner.count('failed' if gave_up else 'retried')
+        return False
+
+
+def run_pending(limit=None):
+    """Run due jobs in this thread until none are left; returns how many."""
+
+    count = 0
+    while limit is None or count < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        count += 1
+    return count
+
+
+def enqueue_scheduled(now=None):
+    """Enqueue the scheduled jobs whose period has begun; returns how many."""
+
+    now = time.time() if now is None else now
+    count = 0
+    for kind, every_seconds in list(SCHEDULE.items()):
+        period = int(now // every_seconds)
+        if _scheduled_periods.get(kind) == period:
+            continue
+        # Another worker or process may have enqueued it already.
+        if enqueue(kind, key=f"{kind}@{period * every_seconds}"):
+            count += 1
+        _scheduled_periods[kind] = period
+    db.session.commit()
+    return count
+
+
+def purge_finished(before=None):
+    """Delete jobs done before `before`; returns how many."""
+
+    before = before or datetime.utcnow() - RETENTION
+    deleted = db.session.execute(
+        jobs.delete().where(jobs.c.status == DONE)
+        .where(jobs.c.finished_at < before)).rowcount
+    db.session.commit()
+    return deleted
+
+
+class JobRunner:
+    """Worker threads running queued jobs, for one app."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self.counts = {'completed': 0, 'retried': 0, 'failed': 0}
+
+    def count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, workers=len(self._threads))
+
+    def wake(self):
+        """Tell idle workers a job was just enqueued."""
+
+        self._wakeup.set()
+
+    def start(self, app, workers, poll_seconds=5):
+        for n in range(workers):
+            thread = threading.Thread(target=self.work,
+                                      args=(app, poll_seconds),
+                                      name=f'job-worker-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def work(self, app, poll_seconds):
+        """Run jobs as they come due, forever."""
+
+        next_purge = time.monotonic()
+
+        with app.app_context():
+            while True:
+                try:
+                    if time.monotonic() >= next_purge:
+                        purge_finished()
+                        next_purge = time.monotonic() + PURGE_EVERY_SECONDS
+                    enqueue_scheduled()
+                    if run_pending(limit=CLAIM_BATCH):
+                        continue
+                except Exception:
+                    # The database is unreachable, say; try again later.
+                    app.logger.exception("Job worker error")
+                finally:
+                    db.session.remove()
+
+                self._wakeup.wait(poll_seconds)
+                self._wakeup.clear()
+
+
+runner = JobRunner()
+
+
+def start(app, workers):
+    """Queue jobs, and run them on `workers` threads in this process.
+
+    Workers look for due jobs every JOB_POLL_SECONDS, and at once when
+    this process enqueues one.
+    """
+
+    global _inline
+
+    # Jobs the workers' handlers enqueue must be queued too, not run
+    # inside the worker's transaction.
+    _inline = False
+    runner.start(app, workers, app.config.get('JOB_POLL_SECONDS', 5))
+
+
+def init_app(app):
+    """Set the JOB_MODE and start JOB_WORKERS worker threads, if any."""
+
+    global _inline
+
+    mode = app.config.get('JOB_MODE', 'queue')
+    if mode not in ('queue', 'inline'):
+        raise ValueError(f"JOB_MODE must be 'queue' or 'inline', not {mode!r}")
+
+    _inline = mode == 'inline'
+    workers = app.config.get('JOB_WORKERS', 0)
+    if workers and not _inline:
+        start(app, workers)
@@ -0,0 +1,355 @@
+"""Live timeline updates, pushed to browsers as server-sent events.
+
+Instead of reloading the home page to look for new messages, browsers keep
+one EventSource open on /stream, and messages from the users they follow
+(and their own) are pushed down it as they're posted.
+
+Posting a message publishes it on its author's channel once the
+transaction commits. Each open stream subscribes to the channels of its
+user and everyone they follow, read once when the stream opens (a new
+follow shows up from the next reconnect); after that, a connected client
+costs no queries at all, however often messages arrive.
+
+Every subscriber has a bounded queue. A client too slow to drain it isn't
+allowed to hold up publishers or grow memory without limit: the bus drops
+it, and its stream sends a `resync` event, telling the browser to reload
+the timeline, and closes. Past LIVE_MAX_STREAMS open streams, new ones are
+refused with a 503 and the browser retries later.
+
+The default backend delivers within the process, which is right for a
+single process. With several worker processes or servers, set LIVE_BACKEND
+to "postgres": messages are then published with NOTIFY, which Postgres
+delivers at commit to every process LISTENing, and each passes them on to
+its own subscribers.
+"""
+
+import json
+import queue
+import select
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, abort, g
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, func
+
+from models import db, Follows
+
+# Sent to a subscriber that fell too far behind, in place of more events.
+RESYNC = object()
+
+# How long browsers wait before reconnecting a dropped stream.
+RETRY_MS = 5000
+
+
+class StreamsFull(RuntimeError):
+    """Raised when subscribing would go over the subscriber limit."""
+
+
+class Subscription:
+    """One stream's queue of events from the channels it listens to."""
+
+    def __init__(self, bus, channels, maxsize):
+        self.bus = bus
+        self.channels = frozenset(channels)
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def get(self, timeout):
+        """The next event; None after `timeout` seconds without one.
+
+        Returns RESYNC once events have been lost to a full queue.
+        """
+
+        if self.overflowed:
+            return RESYNC
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return RESYNC if self.overflowed else None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class LocalBackend:
+    """Delivers events to subscribers in this process only."""
+
+    # Whether publish() can be called inside the transaction (the backend
+    # holding events back until commit), or only after it commits.
+    transactional = False
+
+    def __init__(self):
+        self._deliver = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, channel, payload):
+        # Not started means nothing has subscribed yet: no one to tell.
+        if self._deliver is not None:
+            self._deliver(channel, payload)
+
+
+class PostgresBackend:
+    """Delivers events to every process, through LISTEN/NOTIFY.
+
+    A NOTIFY sent inside a transaction is delivered when it commits, and
+    not at all if it rolls back. Each process holds one connection
+    LISTENing, on a background thread, for its subscribers.
+    """
+
+    transactional = True
+
+    def __init__(self, engine, pg_channel='warbler_live', poll_seconds=5):
+        self.engine = engine
+        self.pg_channel = pg_channel
+        self.poll_seconds = poll_seconds
+
+    def start(self, deliver):
+        thread = threading.Thread(target=self._listen, args=(deliver, ),
+                                  name='live-listener', daemon=True)
+        thread.start()
+
+    def publish(self, channel, payload):
+        db.session.execute(func.pg_notify(
+            self.pg_channel, json.dumps([channel, payload])).select())
+
+    def _listen(self, deliver):
+        while True:
+            try:
+                self._listen_once(deliver)
+            except Exception:
+                # Lost the connection; reconnect after a pause.
+                time.sleep(self.poll_seconds)
+
+    def _listen_once(self, deliver):
+        conn = self.engine.raw_connection()
+        try:
+            dbapi_conn = conn.connection
+            dbapi_conn.autocommit = True
+            with dbapi_conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.pg_channel}"')
+
+            while True:
+                select.select([dbapi_conn], [], [], self.poll_seconds)
+                dbapi_conn.poll()
+                while dbapi_conn.notifies:
+                    note = dbapi_conn.notifies.pop(0)
+                    channel, payload = json.loads(note.payload)
+                    deliver(channel, payload)
+        finally:
+            conn.invalidate()
+
+
+class Bus:
+    """Fans events out from channels to the subscriptions listening."""
+
+    def __init__(self, backend=None, queue_size=100, max_subscribers=5000):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._listeners = defaultdict(set)
+        self._subscriptions = set()
+        self._started = False
+        self.delivered = self.dropped = self.rejected = 0
+        self.backend = backend or LocalBackend()
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+        self._started = False
+
+    def _start(self):
+        # Backends start with the first subscriber, so commands and
+        # processes that only publish never open a listening connection.
+        if not self._started:
+            self._started = True
+            self._backend.start(self.deliver)
+
+    def subscribe(self, channels):
+        """Listen to `channels`; raises StreamsFull past the limit."""
+
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                self.rejected += 1
+                raise StreamsFull()
+            self._start()
+            subscription = Subscription(self, channels, self.queue_size)
+            self._subscriptions.add(subscription)
+            for channel in subscription.channels:
+                self._listeners[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription not in self._subscriptions:
+                return
+            self._subscriptions.discard(subscription)
+            for channel in subscription.channels:
+                listeners = self._listeners[channel]
+                listeners.discard(subscription)
+                if not listeners:
+                    del self._listeners[channel]
+
+    def deliver(self, channel, payload):
+        """Queue `payload` for every subscription to `channel`."""
+
+        with self._lock:
+            listeners = list(self._listeners.get(channel, ()))
+
+        overflowed = []
+        for subscription in listeners:
+            try:
+                subscription.queue.put_nowait(payload)
+            except queue.Full:
+                overflowed.append(subscription)
+
+        for subscription in overflowed:
+            subscription.overflowed = True
+            self.unsubscribe(subscription)
+
+        with self._lock:
+            self.delivered += len(listeners) - len(overflowed)
+            self.dropped += len(overflowed)
+
+    def publish(self, channel, payload):
+        self._backend.publish(channel, payload)
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscriptions),
+                    'channels': len(self._listeners),
+                    'delivered': self.delivered, 'dropped': self.dropped,
+                    'rejected': self.rejected}
+
+
+bus = Bus()
+
+# How often an idle stream sends a comment line, which keeps proxies from
+# timing it out and notices clients that went away; set from LIVE_HEARTBEAT.
+_heartbeat_seconds = 15
+
+
+def init_app(app):
+    """Configure the bus from app config and add the /stream endpoint.
+
+    LIVE_BACKEND is "local" (the default) or "postgres"; LIVE_QUEUE_SIZE
+    is how many events a stream may fall behind by before it's dropped,
+    and LIVE_MAX_STREAMS how many may be open in this process.
+    """
+
+    global _heartbeat_seconds
+    _heartbeat_seconds = app.config.get('LIVE_HEARTBEAT', 15)
+
+    bus.queue_size = app.config.get('LIVE_QUEUE_SIZE', 100)
+    bus.max_subscribers = app.config.get('LIVE_MAX_STREAMS', 5000)
+    if app.config.get('LIVE_BACKEND', 'local') == 'postgres':
+        with app.app_context():
+            bus.backend = PostgresBackend(db.engine)
+    else:
+        bus.backend = LocalBackend()
+
+    app.add_url_rule('/stream', 'stream', stream_view)
+
+
+##############################################################################
+# Publishing
+
+
+def message_event(msg, user):
+    """What a stream is sent about a new message `msg` by `user`."""
+
+    return {
+        'id': msg.id,
+        'text': msg.text,
+        'timestamp': msg.timestamp.isoformat(),
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'image_url': user.image_url,
+        },
+    }
+
+
+def publish_on_commit(channel, payload):
+    """Publish an event once the current transaction commits.
+
+    Publishing earlier could announce a message that then rolls back, or
+    one that a client following the link can't see yet.
+    """
+
+    if bus.backend.transactional:
+        bus.publish(channel, payload)
+    else:
+        db.session.info.setdefault('live_events', []).append(
+            (channel, payload))
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _publish_committed(session):
+    for channel, payload in session.info.pop('live_events', ()):
+        bus.publish(channel, payload)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('live_events', None)
+
+
+##############################################################################
+# Streaming
+
+
+def format_event(payload):
+    return (f"id: {payload['id']}\nevent: message\n"
+            f"data: {json.dumps(payload)}\n\n")
+
+
+def events(subscription, heartbeat):
+    """The text of an event stream, until the client goes away."""
+
+    try:
+        # Sent at once, so the response starts (and the browser knows the
+        # stream is open) without waiting for the first event.
+        yield f"retry: {RETRY_MS}\n\n"
+        while True:
+            payload = subscription.get(heartbeat)
+            if payload is None:
+                yield ": keepalive\n\n"
+            elif payload is RESYNC:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            else:
+                yield format_event(payload)
+    finally:
+        subscription.close()
+
+
+def stream_view():
+    """Stream new messages from the users the logged-in user follows."""
+
+    if not g.user:
+        abort(401)
+
+    user_id = g.user.id
+    followed = [row.user_being_followed_id for row in
+                db.session.query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == user_id)]
+    # The stream may stay open for hours: give the connection back now.
+    db.session.close()
+
+    try:
+        subscription = bus.subscribe(followed + [user_id])
+    except StreamsFull:
+        return Response("Too many open streams.\n", status=503,
+                        headers={'Retry-After': '30'})
+
+    return Response(events(subscription, _heartbeat_seconds),
+                    mimetype='text/event-stream',
+                    headers={'X-Accel-Buffering': 'no'})
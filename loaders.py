@@ -0,0 +1,37 @@
+"""Loader strategies for the list views.
+
+Message and user cards only show a handful of columns, and every message
+card shows its author. Left to the defaults, SQLAlchemy loads every column
+and then lazily SELECTs each author as the template reaches it: one query
+per card. These helpers add options to a query so the cards, and their
+authors, arrive in the query that fetches the page.
+"""
+
+from sqlalchemy.orm import joinedload, load_only
+
+from models import Message
+
+# What a message card (home, profile, likes) reads from the message ...
+MESSAGE_CARD_COLUMNS = ('id', 'text', 'timestamp', 'user_id')
+
+# ... and from its author.
+AUTHOR_COLUMNS = ('id', 'username', 'image_url')
+
+# What a user card (followers, following, /users) reads from the user.
+USER_CARD_COLUMNS = ('id', 'username', 'image_url', 'header_image_url', 'bio')
+
+
+def message_cards(query, with_author=True):
+    """Load just what message cards need, joining in authors if asked."""
+
+    options = [load_only(*MESSAGE_CARD_COLUMNS)]
+    if with_author:
+        options.append(joinedload(Message.user).load_only(*AUTHOR_COLUMNS))
+
+    return query.options(*options)
+
+
+def user_cards(query):
+    """Load just what user cards need."""
+
+    return query.options(load_only(*USER_CARD_COLUMNS))
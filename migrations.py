@@ -0,0 +1,253 @@
+"""Versioned schema migrations for Warbler.
+
+Each migration is a function registered with a version number. `upgrade()`
+runs, in order, every migration not yet recorded in the `schema_migrations`
+table, so an existing database keeps its data while gaining new tables,
+columns and indexes. A fresh database gets the whole schema from the
+baseline migration; later steps then find nothing left to do.
+
+Run with:
+
+    flask upgrade-db
+"""
+
+from datetime import datetime
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.schema import CreateIndex
+
+from models import db, Likes, TimelineEntry
+import counters
+import deletion
+import importer
+import jobs
+import recommend
+import search
+import timeline
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('description', db.Text, nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register the decorated function as migration `version`."""
+
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+
+    return register
+
+
+def applied_versions():
+    """Return the set of migration versions already applied."""
+
+    schema_migrations.create(db.engine, checkfirst=True)
+    rows = db.session.execute(schema_migrations.select())
+    return {row.version for row in rows}
+
+
+def upgrade():
+    """Apply pending migrations in order; returns the versions applied."""
+
+    done = applied_versions()
+    ran = []
+
+    for version, description, fn in MIGRATIONS:
+        if version in done:
+            continue
+
+        fn()
+        db.session.execute(schema_migrations.insert().values(
+            version=version,
+            description=description,
+            applied_at=datetime.utcnow()))
+        db.session.commit()
+        ran.append(version)
+
+    return ran
+
+
+##############################################################################
+# Helpers for writing migrations that are safe to run on any prior state
+
+
+def add_missing_columns(table):
+    """ALTER `table` to add any model columns the database doesn't have.
+
+    Returns the names of the columns added. A column whose server default
+    is an expression (like CURRENT_TIMESTAMP) is added nullable and without
+    it, since SQLite only adds columns with constant defaults; the
+    migration fills it in, then calls `require_column()`.
+    """
+
+    dialect = db.engine.dialect
+    existing = {c['name'] for c in inspect(db.engine).get_columns(table.name)}
+    added = []
+
+    for column in table.columns:
+        if column.name in existing:
+            continue
+
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+        ddl += column.type.compile(dialect=dialect)
+        default = column.server_default
+        if default is None or isinstance(default.arg, str):
+            if default is not None:
+                ddl += f" DEFAULT {default.arg}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+        db.session.execute(text(ddl))
+        added.append(column.name)
+
+    return added
+
+
+def require_column(column):
+    """Give a column added by add_missing_columns its default and NOT NULL.
+
+    SQLite can't alter a column; there the model's default and NOT NULL
+    only apply to tables created afresh.
+    """
+
+    if db.engine.dialect.name == 'sqlite':
+        return
+
+    name = f"{column.table.name} ALTER COLUMN {column.name}"
+    if column.server_default is not None:
+        db.session.execute(text(f"ALTER TABLE {name} SET DEFAULT "
+                                f"{column.server_default.arg}"))
+    if not column.nullable:
+        db.session.execute(text(f"ALTER TABLE {name} SET NOT NULL"))
+
+
+def create_missing_indexes(table, names):
+    """Create those of `table`'s model indexes `names` that don't exist.
+
+    A migration names the indexes it introduces: the model may have gained
+    others since, on columns a later migration adds.
+
+    Uses CREATE INDEX IF NOT EXISTS (Postgres 9.5+, SQLite) rather than
+    reflection, which doesn't round-trip DESC index columns everywhere.
+    """
+
+    dialect = db.engine.dialect
+    indexes = {index.name: index for index in table.indexes}
+
+    for name in names:
+        index = indexes[name]
+        ddl = str(CreateIndex(index).compile(dialect=dialect))
+        ddl = ddl.replace(" INDEX ", " INDEX IF NOT EXISTS ", 1)
+        db.session.execute(text(ddl))
+
+
+##############################################################################
+# Migrations
+
+
+@migration(1, "baseline schema")
+def create_baseline():
+    """Create any tables that don't exist yet."""
+
+    db.create_all()
+
+
+@migration(2, "populate home timelines")
+def populate_timelines():
+    """Build timelines for databases that predate the timelines table."""
+
+    if not db.session.query(TimelineEntry.query.exists()).scalar():
+        timeline.rebuild()
+
+
+@migration(3, "indexes for hot queries")
+def add_hot_query_indexes():
+    """Index messages, likes, follows and timelines for their hot queries.
+
+    Duplicate likes are removed first so the unique index can be built.
+    """
+
+    likes = Likes.__table__
+    keep = (select([func.min(likes.c.id)])
+            .group_by(likes.c.user_id, likes.c.message_id))
+    db.session.execute(likes.delete().where(~likes.c.id.in_(keep)))
+
+    for name, indexes in [
+            ('messages', ['ix_messages_user_id_timestamp',
+                          'ix_messages_timestamp_id']),
+            ('likes', ['uq_likes_user_id_message_id']),
+            ('follows', ['ix_follows_user_following_id']),
+            ('timelines', ['ix_timelines_user_id_timestamp'])]:
+        create_missing_indexes(db.metadata.tables[name], indexes)
+
+
+@migration(4, "denormalized user counters")
+def add_user_counters():
+    """Add the users' counter columns and fill them in."""
+
+    add_missing_columns(db.metadata.tables['users'])
+    counters.reconcile()
+
+
+@migration(5, "full-text search indexes")
+def add_search_indexes():
+    """Add the search indexes (Postgres) or FTS5 tables (SQLite)."""
+
+    search.install(db.session.connection())
+
+
+@migration(6, "bulk import progress")
+def add_import_progress():
+    """Add the table tracking how far each CSV import got."""
+
+    importer.import_progress.create(db.session.connection(), checkfirst=True)
+
+
+@migration(7, "background job queue")
+def add_jobs():
+    """Add the table background jobs are queued in."""
+
+    jobs.jobs.create(db.session.connection(), checkfirst=True)
+
+
+@migration(8, "soft-deleted accounts")
+def add_account_deletion():
+    """Add users.deleted_at, deletion progress and purge indexes."""
+
+    add_missing_columns(db.metadata.tables['users'])
+    deletion.account_deletions.create(db.session.connection(), checkfirst=True)
+    create_missing_indexes(Likes.__table__, ['ix_likes_message_id'])
+    create_missing_indexes(TimelineEntry.__table__,
+                           ['ix_timelines_message_id'])
+
+
+@migration(9, "recommendations")
+def add_recommendations():
+    """Add likes.created_at and the precomputed recommendation tables.
+
+    Existing likes get their message's timestamp, the earliest they could
+    have been made, so they don't all count as new towards trending.
+    """
+
+    likes = Likes.__table__
+    if add_missing_columns(likes):
+        messages = db.metadata.tables['messages']
+        db.session.execute(likes.update().values(
+            created_at=func.coalesce(
+                select([messages.c.timestamp])
+                .where(messages.c.id == likes.c.message_id)
+                .as_scalar(),
+                func.current_timestamp())))
+        require_column(likes.c.created_at)
+    create_missing_indexes(likes, ['ix_likes_created_at'])
+
+    for table in [recommend.follow_suggestions, recommend.trending_messages,
+                  recommend.recommendation_runs]:
+        table.create(db.session.connection(), checkfirst=True)
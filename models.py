@@ -2,11 +2,10 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from database import RoutingSQLAlchemy
+from passwords import hasher
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -26,6 +25,13 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key leads with user_being_followed_id (who follows me?);
+    # this serves the other direction (who do I follow?).
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id',
+                 user_following_id, user_being_followed_id),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -47,6 +53,23 @@ class Likes(db.Model):
         db.ForeignKey('messages.id', ondelete='cascade')
     )
 
+    # When the like was made, for ranking trending messages (see
+    # recommend.py).
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.text('CURRENT_TIMESTAMP'),
+    )
+
+    __table_args__ = (
+        db.Index('uq_likes_user_id_message_id',
+                 user_id, message_id, unique=True),
+        # Finds a message's likes when it (or its author) is deleted.
+        db.Index('ix_likes_message_id', message_id),
+        db.Index('ix_likes_created_at', created_at),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -93,26 +116,69 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # Denormalized counts, kept in step by social.py and repaired by
+    # counters.reconcile(); templates read these instead of len(relationship).
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Set when the user deletes their account; their rows are then purged
+    # in the background (see deletion.py) and the user hidden meanwhile.
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    # passive_deletes: deleting a user leaves their rows to the database's
+    # ON DELETE CASCADE instead of loading every one of them first.
+
+    messages = db.relationship('Message', passive_deletes='all')
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True,
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True,
     )
 
     likes = db.relationship(
         'Message',
-        secondary="likes"
-    ) 
+        secondary="likes",
+        passive_deletes=True,
+    )
 
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
@@ -120,14 +186,48 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return self.id in User.followed_among(other_user.id, [self.id])
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in User.followed_among(self.id, [other_user.id])
+
+    @classmethod
+    def followed_among(cls, follower_id, user_ids):
+        """Which of `user_ids` does user `follower_id` follow?
+
+        Answers for any number of users with a single indexed query and
+        returns the followed ids as a set.
+        """
+
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == follower_id,
+                        Follows.user_being_followed_id.in_(user_ids)))
+        return {user_id for (user_id, ) in rows}
+
+    @classmethod
+    def liked_among(cls, user_id, message_ids):
+        """Which of `message_ids` has user `user_id` liked?
+
+        Uses the (user_id, message_id) index on likes to answer for a whole
+        page of messages in one query, returning the liked ids as a set.
+        """
+
+        message_ids = list(message_ids)
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(Likes.message_id)
+                .filter(Likes.user_id == user_id,
+                        Likes.message_id.in_(message_ids)))
+        return {message_id for (message_id, ) in rows}
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -136,7 +236,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -157,13 +257,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the password was hashed at a different cost factor, its hash is
+        replaced with one at the current cost (the caller commits).
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth, new_hash = hasher.verify(user.password, password)
             if is_auth:
+                if new_hash:
+                    user.password = new_hash
                 return user
 
         return False
@@ -187,7 +292,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -198,6 +303,55 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp',
+                 user_id, timestamp.desc(), id.desc()),
+        db.Index('ix_messages_timestamp_id',
+                 timestamp.desc(), id.desc()),
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a user's home timeline.
+
+    Rows are written when a message is posted (fan-out on write) and when
+    a follow is added, so the homepage reads one user's rows in timestamp
+    order instead of searching every followed user's messages.
+    """
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        # Finds a message's timeline rows when it (or its author) is
+        # deleted.
+        db.Index('ix_timelines_message_id', 'message_id'),
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,86 @@
+"""Keyset (cursor) pagination for Warbler listings.
+
+Instead of OFFSET, each page remembers the sort key of its last row in an
+opaque cursor. The next page asks for rows strictly after that key, which
+an index on the sort columns answers with a range scan, so page 500 costs
+the same as page 1.
+"""
+
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+PAGE_SIZE = 20
+
+
+class Page(namedtuple('Page', ['items', 'next_cursor'])):
+    """One page of results, plus the cursor for the page after it (or None)."""
+
+
+def encode_cursor(values):
+    """Turn a tuple of sort-key values into an opaque, URL-safe string."""
+
+    plain = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(plain).encode()).decode()
+
+
+def decode_cursor(cursor, columns):
+    """Turn a cursor back into sort-key values typed like `columns`.
+
+    Returns None if the cursor is missing or malformed, so a bad cursor
+    just restarts from the first page.
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        plain = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(plain, list) or len(plain) != len(columns):
+            return None
+
+        values = []
+        for column, value in zip(columns, plain):
+            python_type = column.type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            # bool is an int to isinstance(), but not a valid id.
+            elif (not isinstance(value, python_type)
+                  or isinstance(value, bool) and python_type is not bool):
+                return None
+            values.append(value)
+        return tuple(values)
+
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+
+
+def paginate(query, columns, cursor=None, per_page=PAGE_SIZE,
+             descending=True, key=None):
+    """Return one Page of `query`, ordered by `columns`.
+
+    `columns` must be unique together (end with a primary key) so every row
+    has a distinct position. `key` maps a result row to its values for
+    `columns`; by default attributes of the same names are read from it.
+    """
+
+    after = decode_cursor(cursor, columns)
+
+    if after is not None:
+        position = tuple_(*columns)
+        bound = tuple_(*after)
+        query = query.filter(position < bound if descending else position > bound)
+
+    ordering = [c.desc() if descending else c.asc() for c in columns]
+    rows = query.order_by(*ordering).limit(per_page + 1).all()
+
+    if len(rows) <= per_page:
+        return Page(rows, None)
+
+    rows = rows[:per_page]
+    last = rows[-1]
+    values = key(last) if key else tuple(getattr(last, c.key) for c in columns)
+    return Page(rows, encode_cursor(values))
@@ -0,0 +1,151 @@
+"""Password hashing off the request thread.
+
+bcrypt is deliberately slow, and a burst of logins run inline keeps every
+worker busy hashing. Hashes are instead computed in a small process pool:
+`PASSWORD_HASH_WORKERS` processes, with at most `PASSWORD_HASH_QUEUE`
+further requests waiting for one. When the queue is full, callers wait up
+to `PASSWORD_HASH_TIMEOUT` seconds and then get `HasherBusy` rather than
+piling up. With 0 workers, hashing runs inline.
+
+The cost factor is `BCRYPT_LOG_ROUNDS`. Raising it doesn't invalidate
+anything: a successful login with a hash of a different cost re-hashes
+the password at the new cost, which `User.authenticate` then stores.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+DEFAULT_LOG_ROUNDS = 12
+
+
+class HasherBusy(RuntimeError):
+    """Raised when the hashing queue stays full for too long."""
+
+
+def _hash(password, log_rounds):
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(log_rounds)).decode('utf-8')
+
+
+def _verify(pw_hash, password, log_rounds):
+    """Check `password`; if it matches a hash of another cost, re-hash it.
+
+    Returns (matches, new hash or None), so a login needs one trip to the
+    pool even when it re-hashes.
+    """
+
+    if not bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8')):
+        return False, None
+
+    if hash_cost(pw_hash) != log_rounds:
+        return True, _hash(password, log_rounds)
+    return True, None
+
+
+def hash_cost(pw_hash):
+    """The cost factor a bcrypt hash was made with ("$2b$12$..." -> 12)."""
+
+    return int(pw_hash.split('$')[2])
+
+
+class PasswordHasher:
+    """bcrypt hashing on a bounded process pool, with queue metrics."""
+
+    def __init__(self, log_rounds=DEFAULT_LOG_ROUNDS, workers=0,
+                 max_queue=64, timeout=10):
+        self._pool = None
+        self._lock = threading.Lock()
+        self.configure(log_rounds, workers, max_queue, timeout)
+
+    def configure(self, log_rounds, workers, max_queue, timeout):
+        """Change the cost and pool size; a running pool is shut down."""
+
+        self.shutdown()
+        self.log_rounds = log_rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy("Too many password checks waiting")
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+            self._slots.release()
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured cost."""
+
+        return self._run(_hash, password, self.log_rounds)
+
+    def verify(self, pw_hash, password):
+        """Check `password` against `pw_hash`.
+
+        Returns (matches, new_hash); new_hash is set when the password
+        matched but `pw_hash` was made at another cost and should be
+        replaced.
+        """
+
+        return self._run(_verify, pw_hash, password, self.log_rounds)
+
+    def stats(self):
+        """Queue depth and throughput counts since start-up."""
+
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'in_flight': self.in_flight,
+                'queued': max(0, self.in_flight - self.workers),
+                'peak_in_flight': self.peak_in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+hasher = PasswordHasher()
+
+
+def init_app(app):
+    """Configure the hasher from app config.
+
+    BCRYPT_LOG_ROUNDS is the cost factor; PASSWORD_HASH_WORKERS (default:
+    the number of CPUs), PASSWORD_HASH_QUEUE and PASSWORD_HASH_TIMEOUT size
+    the pool and its queue.
+    """
+
+    hasher.configure(
+        log_rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS),
+        workers=app.config.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1),
+        max_queue=app.config.get('PASSWORD_HASH_QUEUE', 64),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10))
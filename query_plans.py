@@ -0,0 +1,73 @@
+"""EXPLAIN-based checks that Warbler's hot queries use their indexes.
+
+Each hot query is paired with the index it is meant to use. `check()` asks
+the database for each query's plan and reports whether that index appears
+in it. On Postgres, sequential scans are disabled for the check so that a
+tiny development table still shows whether the index is *usable*, which is
+what we want to know; the planner's choice on real data follows from that.
+
+Run with:
+
+    flask check-query-plans
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import text
+
+from models import db
+
+PlanCheck = namedtuple('PlanCheck', ['name', 'index', 'uses_index', 'plan'])
+
+HOT_QUERIES = [
+    ("home timeline page",
+     'ix_timelines_user_id_timestamp',
+     "SELECT message_id FROM timelines WHERE user_id = 1 "
+     "ORDER BY timestamp DESC, message_id DESC LIMIT 20"),
+
+    ("profile messages page",
+     'ix_messages_user_id_timestamp',
+     "SELECT id FROM messages WHERE user_id = 1 "
+     "ORDER BY timestamp DESC, id DESC LIMIT 20"),
+
+    ("newest messages",
+     'ix_messages_timestamp_id',
+     "SELECT id FROM messages ORDER BY timestamp DESC, id DESC LIMIT 20"),
+
+    ("has user liked message",
+     'uq_likes_user_id_message_id',
+     "SELECT 1 FROM likes WHERE user_id = 1 AND message_id = 1"),
+
+    ("who does user follow",
+     'ix_follows_user_following_id',
+     "SELECT user_being_followed_id FROM follows WHERE user_following_id = 1"),
+]
+
+
+def explain(sql):
+    """Return the database's query plan for `sql` as a single string."""
+
+    if db.engine.dialect.name == 'sqlite':
+        rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+        return "\n".join(str(row[-1]) for row in rows)
+
+    rows = db.session.execute(text(f"EXPLAIN {sql}"))
+    return "\n".join(row[0] for row in rows)
+
+
+def check():
+    """Explain every hot query; returns a list of PlanCheck results."""
+
+    results = []
+
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+
+    try:
+        for name, index, sql in HOT_QUERIES:
+            plan = explain(sql)
+            results.append(PlanCheck(name, index, index in plan, plan))
+    finally:
+        db.session.rollback()
+
+    return results
@@ -0,0 +1,270 @@
+"""Recommendations: who to follow, and trending messages.
+
+Both are computed ahead of time by scheduled jobs into small tables that
+pages read with one indexed query, so showing them costs the same however
+big the follow graph or the likes table gets.
+
+Who to follow is friends of friends: a user is suggested the accounts
+most followed by the accounts they follow, that they don't follow yet.
+It's computed SUGGESTION_BATCH users per job, by one statement joining
+`follows` to itself, so only edges that exist are visited (never a
+users-by-users matrix), and keeping each user's top SUGGESTIONS_PER_USER.
+Suggestions someone has since followed, or who have since left, are
+filtered out when served.
+
+Trending ranks messages by time-decayed likes: each like counts
+0.5 ** (its age / TRENDING_HALF_LIFE), so a burst of recent likes beats
+a larger number long ago. Scores are kept as of the last refresh. Since
+every score decays by the same factor, a refresh multiplies them all by
+it, adds the likes made since, and drops messages whose score has decayed
+below TRENDING_MIN_SCORE, reading only the new likes each time. (An unlike
+isn't subtracted; its like decays away like the rest.)
+
+Workers refresh both on a schedule; so does
+
+    flask refresh-recommendations
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, exists, func, select
+
+from models import db, Follows, Likes, Message, User
+import jobs
+
+# Suggestions kept per user, and users computed per job.
+SUGGESTIONS_PER_USER = 20
+SUGGESTION_BATCH = 500
+
+# How fast likes stop counting towards trending, and which are ignored:
+# those older than TRENDING_WINDOW, and messages whose score has decayed
+# below TRENDING_MIN_SCORE (one like, five half-lives ago).
+TRENDING_HALF_LIFE = timedelta(hours=6)
+TRENDING_WINDOW = timedelta(days=2)
+TRENDING_MIN_SCORE = 0.5 ** 5
+
+# Default seconds between scheduled refreshes.
+SUGGESTIONS_EVERY_SECONDS = 6 * 3600
+TRENDING_EVERY_SECONDS = 300
+
+follows = Follows.__table__
+likes = Likes.__table__
+messages = Message.__table__
+users = User.__table__
+
+follow_suggestions = db.Table(
+    'follow_suggestions',
+    db.Column('user_id', db.Integer, primary_key=True),
+    db.Column('suggested_id', db.Integer, primary_key=True),
+    # How many of the accounts user_id follows follow suggested_id.
+    db.Column('score', db.Integer, nullable=False),
+)
+
+trending_messages = db.Table(
+    'trending_messages',
+    db.Column('message_id', db.Integer,
+              db.ForeignKey('messages.id', ondelete='cascade'),
+              primary_key=True),
+    db.Column('score', db.Float, nullable=False),
+    db.Index('ix_trending_messages_score', 'score'),
+)
+
+# When each refresh last ran; trending adds the likes made since.
+recommendation_runs = db.Table(
+    'recommendation_runs',
+    db.Column('name', db.String(50), primary_key=True),
+    db.Column('ran_at', db.DateTime, nullable=False),
+)
+
+
+def last_run(name):
+    return db.session.execute(
+        select([recommendation_runs.c.ran_at])
+        .where(recommendation_runs.c.name == name)).scalar()
+
+
+def _record_run(name, ran_at):
+    if not db.session.execute(
+            recommendation_runs.update()
+            .where(recommendation_runs.c.name == name)
+            .values(ran_at=ran_at)).rowcount:
+        db.session.execute(recommendation_runs.insert()
+                           .values(name=name, ran_at=ran_at))
+
+
+##############################################################################
+# Who to follow
+
+
+def refresh_suggestions(user_ids):
+    """Recompute the follow suggestions of `user_ids`."""
+
+    mine, theirs, already = (follows.alias('mine'), follows.alias('theirs'),
+                             follows.alias('already'))
+    user_id = mine.c.user_following_id
+    suggested_id = theirs.c.user_being_followed_id
+
+    candidates = (
+        select([user_id.label('user_id'),
+                suggested_id.label('suggested_id'),
+                func.count().label('score')])
+        .select_from(mine.join(theirs, theirs.c.user_following_id
+                               == mine.c.user_being_followed_id))
+        .where(user_id.in_(user_ids))
+        .where(suggested_id != user_id)
+        .where(~exists().where(already.c.user_following_id == user_id)
+               .where(already.c.user_being_followed_id == suggested_id))
+        .group_by(user_id, suggested_id)
+        .alias('candidates'))
+
+    ranked = select([
+        candidates,
+        func.row_number().over(
+            partition_by=candidates.c.user_id,
+            order_by=[candidates.c.score.desc(),
+                      candidates.c.suggested_id]).label('rank'),
+    ]).alias('ranked')
+
+    db.session.execute(follow_suggestions.delete()
+                       .where(follow_suggestions.c.user_id.in_(user_ids)))
+    db.session.execute(follow_suggestions.insert().from_select(
+        ['user_id', 'suggested_id', 'score'],
+        select([ranked.c.user_id, ranked.c.suggested_id, ranked.c.score])
+        .where(ranked.c.rank <= SUGGESTIONS_PER_USER)))
+
+
+def next_batch(after_id):
+    """Ids of the next SUGGESTION_BATCH users after `after_id`."""
+
+    return [user_id for (user_id, ) in db.session.execute(
+        select([users.c.id])
+        .where(users.c.id > after_id).where(users.c.deleted_at.is_(None))
+        .order_by(users.c.id).limit(SUGGESTION_BATCH))]
+
+
+@jobs.handler('refresh_suggestions')
+def refresh_suggestions_after(after_id=0):
+    """Refresh a batch of users after `after_id`; enqueue the next batch."""
+
+    user_ids = next_batch(after_id)
+    if not user_ids:
+        _record_run('suggestions', datetime.utcnow())
+        return
+
+    refresh_suggestions(user_ids)
+    jobs.enqueue('refresh_suggestions', after_id=user_ids[-1])
+
+
+def who_to_follow(user_id, limit=3, query=None):
+    """Up to `limit` users suggested for `user_id` to follow, best first.
+
+    `query` selects what to load per user; by default the whole User.
+    """
+
+    following = (select([follows.c.user_being_followed_id])
+                 .where(follows.c.user_following_id == user_id))
+    top = (select([follow_suggestions.c.suggested_id,
+                   follow_suggestions.c.score])
+           .select_from(follow_suggestions.join(
+               users, users.c.id == follow_suggestions.c.suggested_id))
+           .where(follow_suggestions.c.user_id == user_id)
+           .where(users.c.deleted_at.is_(None))
+           .where(follow_suggestions.c.suggested_id.notin_(following))
+           .order_by(follow_suggestions.c.score.desc(),
+                     follow_suggestions.c.suggested_id)
+           .limit(limit)
+           .alias('top'))
+
+    query = User.query if query is None else query
+    return (query.join(top, top.c.suggested_id == User.id)
+            .order_by(top.c.score.desc(), User.id)
+            .all())
+
+
+##############################################################################
+# Trending
+
+
+def _decay(age):
+    return 0.5 ** (age / TRENDING_HALF_LIFE)
+
+
+@jobs.handler('refresh_trending')
+def refresh_trending(now=None):
+    """Bring trending scores up to `now` (by default, the current time)."""
+
+    now = now or datetime.utcnow()
+    since = now - TRENDING_WINDOW
+    previous = last_run('trending')
+
+    if previous is not None:
+        db.session.execute(trending_messages.update().values(
+            score=trending_messages.c.score * _decay(now - previous)))
+        since = max(since, previous)
+
+    # A like committed after this runs but timestamped before `now` is
+    # missed; for a ranking that's noise.
+    added = defaultdict(float)
+    for message_id, created_at in db.session.execute(
+            select([likes.c.message_id, likes.c.created_at])
+            .where(likes.c.created_at > since)
+            .where(likes.c.created_at <= now)):
+        added[message_id] += _decay(now - created_at)
+
+    if added:
+        present = {message_id for (message_id, ) in db.session.execute(
+            select([trending_messages.c.message_id])
+            .where(trending_messages.c.message_id.in_(list(added))))}
+        if present:
+            db.session.execute(
+                trending_messages.update()
+                .where(trending_messages.c.message_id == bindparam('id'))
+                .values(score=trending_messages.c.score + bindparam('add')),
+                [{'id': message_id, 'add': added[message_id]}
+                 for message_id in present])
+        new = [{'message_id': message_id, 'score': score}
+               for message_id, score in added.items()
+               if message_id not in present]
+        if new:
+            db.session.execute(trending_messages.insert(), new)
+
+    db.session.execute(trending_messages.delete().where(
+        trending_messages.c.score < TRENDING_MIN_SCORE))
+    _record_run('trending', now)
+
+
+def trending(limit=10, query=None):
+    """The `limit` top trending messages, best first.
+
+    `query` selects what to load per message; by default the whole
+    Message.
+    """
+
+    top = (select([trending_messages.c.message_id, trending_messages.c.score])
+           .select_from(trending_messages
+                        .join(messages,
+                              messages.c.id == trending_messages.c.message_id)
+                        .join(users, users.c.id == messages.c.user_id))
+           .where(users.c.deleted_at.is_(None))
+           .order_by(trending_messages.c.score.desc())
+           .limit(limit)
+           .alias('top'))
+
+    query = Message.query if query is None else query
+    return (query.join(top, top.c.message_id == Message.id)
+            .order_by(top.c.score.desc(), Message.id.desc())
+            .all())
+
+
+def init_app(app):
+    """Have job workers refresh suggestions and trending periodically.
+
+    Every SUGGESTIONS_EVERY_SECONDS and TRENDING_EVERY_SECONDS, unless
+    configured otherwise.
+    """
+
+    jobs.schedule('refresh_suggestions', app.config.get(
+        'SUGGESTIONS_EVERY_SECONDS', SUGGESTIONS_EVERY_SECONDS))
+    jobs.schedule('refresh_trending', app.config.get(
+        'TRENDING_EVERY_SECONDS', TRENDING_EVERY_SECONDS))
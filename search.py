@@ -0,0 +1,214 @@
+"""Ranked full-text search over users and messages.
+
+On Postgres, users are matched on username and bio with a tsvector index
+plus a pg_trgm index on username (which also serves substring matches),
+and messages with a tsvector index on their text. On SQLite, used for
+local testing, FTS5 tables shadow `users` and `messages`, kept current by
+triggers. Any other database falls back to LIKE.
+
+The indexes are created along with their tables (see the DDL events at the
+bottom of this module) and added to existing databases by a migration.
+"""
+
+import re
+from collections import namedtuple
+
+from sqlalchemy import DDL, event, text
+
+from loaders import message_cards, user_cards
+from models import db, Message, User
+
+PER_PAGE = 20
+
+# Ranked results are paged by offset, so cap how deep anyone can page.
+MAX_PAGE = 50
+
+SearchPage = namedtuple('SearchPage', ['items', 'page', 'has_more'])
+
+USER_DOCUMENT = "coalesce(username, '') || ' ' || coalesce(bio, '')"
+
+POSTGRES_DDL = {
+    'users': [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_users_search ON users "
+        f"USING gin (to_tsvector('english', {USER_DOCUMENT}))",
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users "
+        "USING gin (username gin_trgm_ops)",
+    ],
+    'messages': [
+        "CREATE INDEX IF NOT EXISTS ix_messages_search ON messages "
+        "USING gin (to_tsvector('english', text))",
+    ],
+}
+
+
+def _sqlite_fts_ddl(table, columns):
+    """DDL for an FTS5 table shadowing `table`, plus its sync triggers."""
+
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{c}" for c in columns)
+    old = ", ".join(f"old.{c}" for c in columns)
+    fts = f"{table}_fts"
+
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{cols}, content='{table}', content_rowid='id')",
+
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} "
+        f"BEGIN INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} "
+        f"BEGIN INSERT INTO {fts}({fts}, rowid, {cols}) "
+        f"VALUES ('delete', old.id, {old}); END",
+
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update "
+        f"AFTER UPDATE OF {cols} ON {table} "
+        f"BEGIN INSERT INTO {fts}({fts}, rowid, {cols}) "
+        f"VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+SQLITE_DDL = {
+    'users': _sqlite_fts_ddl('users', ['username', 'bio']),
+    'messages': _sqlite_fts_ddl('messages', ['text']),
+}
+
+
+def install(connection):
+    """Create the search indexes for this database, if it has any."""
+
+    ddl = {'postgresql': POSTGRES_DDL, 'sqlite': SQLITE_DDL}
+    for statements in ddl.get(connection.dialect.name, {}).values():
+        for statement in statements:
+            connection.execute(text(statement))
+
+
+##############################################################################
+# Queries
+
+
+def _fts_match(q):
+    """Turn free text into an FTS5 query matching every word as a prefix."""
+
+    words = re.findall(r"\w+", q)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _like_pattern(q):
+    """Turn free text into a LIKE pattern matching it anywhere."""
+
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _ranked_ids(kind, q, limit, offset):
+    """Return ids of matching users or messages, best match first."""
+
+    dialect = db.engine.dialect.name
+    params = {'q': q, 'limit': limit, 'offset': offset}
+
+    if dialect == 'postgresql':
+        if kind == 'users':
+            sql = f"""
+                SELECT id FROM users
+                WHERE username ILIKE :pattern
+                   OR username % :q
+                   OR to_tsvector('english', {USER_DOCUMENT})
+                      @@ plainto_tsquery('english', :q)
+                ORDER BY greatest(
+                    similarity(username, :q),
+                    ts_rank(to_tsvector('english', {USER_DOCUMENT}),
+                            plainto_tsquery('english', :q))) DESC, id
+                LIMIT :limit OFFSET :offset"""
+            params['pattern'] = _like_pattern(q)
+        else:
+            sql = """
+                SELECT id FROM messages
+                WHERE to_tsvector('english', text)
+                      @@ plainto_tsquery('english', :q)
+                ORDER BY ts_rank(to_tsvector('english', text),
+                                 plainto_tsquery('english', :q)) DESC,
+                         timestamp DESC, id DESC
+                LIMIT :limit OFFSET :offset"""
+
+    elif dialect == 'sqlite':
+        params['q'] = _fts_match(q)
+        if not params['q']:
+            return []
+        sql = f"""
+            SELECT rowid FROM {kind}_fts
+            WHERE {kind}_fts MATCH :q
+            ORDER BY bm25({kind}_fts), rowid
+            LIMIT :limit OFFSET :offset"""
+
+    else:
+        column = 'username' if kind == 'users' else 'text'
+        sql = f"""
+            SELECT id FROM {kind} WHERE {column} LIKE :pattern ESCAPE '\\'
+            ORDER BY id LIMIT :limit OFFSET :offset"""
+        params['pattern'] = _like_pattern(q)
+
+    return [row[0] for row in db.session.execute(text(sql), params)]
+
+
+def _search(kind, model, query, q, page, per_page):
+    """Run a ranked search and load one page of results in rank order."""
+
+    q = (q or "").strip()
+    page = max(1, min(page, MAX_PAGE))
+    if not q:
+        return SearchPage([], page, False)
+
+    ids = _ranked_ids(kind, q, per_page + 1, (page - 1) * per_page)
+    has_more = len(ids) > per_page and page < MAX_PAGE
+    ids = ids[:per_page]
+
+    rows = {row.id: row for row in query.filter(model.id.in_(ids))}
+    return SearchPage([rows[id] for id in ids if id in rows], page, has_more)
+
+
+def search_users(q, page=1, per_page=PER_PAGE, query=None):
+    """Return a SearchPage of users matching `q` by username or bio.
+
+    `query` selects what to load per user; by default user cards.
+    """
+
+    if query is None:
+        query = user_cards(User.query)
+    query = query.filter(User.deleted_at.is_(None))
+    return _search('users', User, query, q, page, per_page)
+
+
+def search_messages(q, page=1, per_page=PER_PAGE, query=None):
+    """Return a SearchPage of messages whose text matches `q`.
+
+    `query` selects what to load per message; by default message cards.
+    """
+
+    if query is None:
+        query = message_cards(Message.query)
+    query = query.filter(Message.user.has(deleted_at=None))
+    return _search('messages', Message, query, q, page, per_page)
+
+
+##############################################################################
+# Create search indexes along with their tables
+
+
+for _name in ['users', 'messages']:
+    _table = db.metadata.tables[_name]
+
+    for _statement in POSTGRES_DDL[_name]:
+        event.listen(_table, 'after_create',
+                     DDL(_statement).execute_if(dialect='postgresql'))
+
+    for _statement in SQLITE_DDL[_name]:
+        event.listen(_table, 'after_create',
+                     DDL(_statement).execute_if(dialect='sqlite'))
+
+    event.listen(_table, 'before_drop',
+                 DDL(f"DROP TABLE IF EXISTS {_name}_fts")
+                 .execute_if(dialect='sqlite'))
@@ -1,20 +1,12 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+Safe to run again: rows already loaded are skipped (see importer.py).
+"""
 
+import app  # noqa: F401 (configures the database for the app)
+import importer
+import migrations
 
-db.drop_all()
-db.create_all()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
-
-db.session.commit()
+migrations.upgrade()
+importer.import_dir('generator')
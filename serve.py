@@ -0,0 +1,65 @@
+"""Run Warbler on a server that holds many slow connections cheaply.
+
+With gevent installed, each connection is a greenlet: a worker waiting on
+a slow client, the database or a password hash yields to the others
+instead of tying up an OS thread, so one process serves thousands of
+concurrent clients. (Install psycogreen too, so psycopg2 waits on the
+database cooperatively.) Without gevent this falls back to Werkzeug's
+threaded server, one thread per connection. Background jobs (jobs.py)
+run on --job-workers threads in the same process. With --graph-index,
+follow checks are answered from an in-memory copy of the follow graph.
+
+    python serve.py --port 5000
+"""
+
+import argparse
+import os
+
+try:
+    from gevent import monkey
+except ImportError:
+    monkey = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Warbler.")
+    parser.add_argument('--host', default=os.environ.get('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int,
+                        default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--job-workers', type=int,
+                        default=int(os.environ.get('JOB_WORKERS', 2)),
+                        help="background job threads (0: only enqueue jobs)")
+    parser.add_argument('--graph-index', action='store_true',
+                        default=os.environ.get('GRAPH_INDEX') == '1',
+                        help="answer follow checks from memory")
+    opts = parser.parse_args()
+
+    # Read by app.py when it's imported.
+    os.environ['JOB_WORKERS'] = str(opts.job_workers)
+    os.environ['GRAPH_INDEX'] = '1' if opts.graph_index else '0'
+
+    if monkey is not None:
+        # Patch before the app (and its database driver) is imported.
+        monkey.patch_all()
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            pass
+
+        from gevent.pywsgi import WSGIServer
+        from app import app
+
+        print(f"Serving on http://{opts.host}:{opts.port} (gevent)")
+        WSGIServer((opts.host, opts.port), app).serve_forever()
+
+    else:
+        from werkzeug.serving import run_simple
+        from app import app
+
+        print(f"Serving on http://{opts.host}:{opts.port} (threaded)")
+        run_simple(opts.host, opts.port, app, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
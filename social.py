@@ -0,0 +1,186 @@
+"""Social actions shared by the Warbler views.
+
+Each function makes one change (follow, post, like, ...) together with its
+side effects on home timelines and denormalized counters. None of them
+commit: the caller commits so the change and its side effects land in a
+single transaction.
+"""
+
+from sqlalchemy import select
+
+from models import db, Follows, Likes, Message
+from sqlutil import insert_ignore
+import counters
+import deletion
+import fragments
+import graph_index
+import jobs
+import live
+import timeline
+
+follows = Follows.__table__
+likes = Likes.__table__
+messages = Message.__table__
+
+
+def follow(user, other_user):
+    """Have `user` start following `other_user`.
+
+    Returns True if this started a follow (False if `user` already followed
+    them, or they're the same user).
+    """
+
+    if user.id == other_user.id:
+        return False
+
+    if not insert_ignore(follows, {'user_following_id': user.id,
+                                    'user_being_followed_id': other_user.id}):
+        return False
+
+    counters.adjust(user.id, 'following_count', 1)
+    counters.adjust(other_user.id, 'followers_count', 1)
+    graph_index.add_on_commit(user.id, other_user.id)
+    jobs.enqueue('backfill_timeline', follower_id=user.id,
+                 followed_id=other_user.id)
+    return True
+
+
+def unfollow(user, other_user):
+    """Have `user` stop following `other_user`.
+
+    Returns True if there was a follow to remove.
+    """
+
+    removed = db.session.execute(
+        follows.delete()
+        .where(follows.c.user_following_id == user.id)
+        .where(follows.c.user_being_followed_id == other_user.id)).rowcount
+    if not removed:
+        return False
+
+    counters.adjust(user.id, 'following_count', -1)
+    counters.adjust(other_user.id, 'followers_count', -1)
+    graph_index.remove_on_commit(user.id, other_user.id)
+    jobs.enqueue('prune_timeline', follower_id=user.id,
+                 followed_id=other_user.id)
+    return True
+
+
+def post_message(user, text):
+    """Create a message by `user` and fan it out; returns the message.
+
+    Live streams are sent the message once the transaction commits.
+    """
+
+    msg = Message(text=text, user_id=user.id)
+    db.session.add(msg)
+    db.session.flush()
+
+    counters.adjust(user.id, 'messages_count', 1)
+    jobs.enqueue('fan_out', key=f"fan_out:{msg.id}", message_id=msg.id)
+    live.publish_on_commit(user.id, live.message_event(msg, user))
+    return msg
+
+
+def delete_message(msg):
+    """Delete `msg`, un-counting it from its author and everyone who liked it."""
+
+    counters.adjust(msg.user_id, 'messages_count', -1)
+    counters.adjust_where('likes_count', -1,
+                          select([likes.c.user_id])
+                          .where(likes.c.message_id == msg.id))
+    db.session.delete(msg)
+    fragments.invalidate_on_commit('message', msg.id)
+
+
+def _delete_like(user_id, message_id):
+    """Delete a like if it exists; returns the number of rows deleted."""
+
+    return db.session.execute(likes.delete()
+                              .where(likes.c.user_id == user_id)
+                              .where(likes.c.message_id == message_id)
+                              ).rowcount
+
+
+def _like_changed(user_id, message_id, delta):
+    counters.adjust(user_id, 'likes_count', delta)
+    fragments.invalidate_on_commit('message', message_id)
+
+
+def set_like(user, message, liked):
+    """Make `user` like (or not like) `message`; returns the new state.
+
+    Setting the state a like is already in changes nothing, so repeated
+    requests are harmless. Users can't like their own messages.
+    """
+
+    if message.user_id == user.id:
+        return False
+
+    if liked and insert_ignore(
+            likes, {'user_id': user.id, 'message_id': message.id}):
+        _like_changed(user.id, message.id, 1)
+    elif not liked and _delete_like(user.id, message.id):
+        _like_changed(user.id, message.id, -1)
+    return liked
+
+
+def toggle_like(user, message):
+    """Like `message` for `user`, or unlike it if already liked.
+
+    Users can't like their own messages. Returns True if the message is
+    now liked.
+    """
+
+    if message.user_id == user.id:
+        return False
+
+    if _delete_like(user.id, message.id):
+        _like_changed(user.id, message.id, -1)
+        return False
+    return set_like(user, message, True)
+
+
+def delete_account(user):
+    """Delete `user` and everything of theirs.
+
+    They're hidden at once; their rows are purged by jobs, a chunk at a
+    time, since a user with a long history has a lot of rows to delete
+    and counters to fix (see deletion.py).
+    """
+
+    deletion.request_deletion(user)
+
+
+##############################################################################
+# Jobs
+
+
+def _is_following(follower_id, followed_id):
+    return db.session.query(
+        Follows.query.filter_by(user_following_id=follower_id,
+                                user_being_followed_id=followed_id)
+        .exists()).scalar()
+
+
+@jobs.handler('fan_out')
+def _fan_out(message_id):
+    msg = Message.query.get(message_id)
+    # The message (or its author) may have been deleted before the job ran.
+    if msg is not None and msg.user.deleted_at is None:
+        timeline.fan_out(msg)
+
+
+@jobs.handler('backfill_timeline')
+def _backfill_timeline(follower_id, followed_id):
+    # Jobs can run late or out of order: only act if the follow still
+    # stands (for prune, if it's still gone).
+    if _is_following(follower_id, followed_id):
+        timeline.backfill(follower_id, followed_id)
+
+
+@jobs.handler('prune_timeline')
+def _prune_timeline(follower_id, followed_id):
+    if not _is_following(follower_id, followed_id):
+        timeline.prune(follower_id, followed_id)
+
@@ -0,0 +1,33 @@
+"""SQL statements Warbler builds differently per database."""
+
+from sqlalchemy import and_, literal, select
+from sqlalchemy.dialects import postgresql
+
+from models import db
+
+
+def insert_ignore(table, values, unique=None):
+    """Insert a row unless it already exists; returns the rows inserted.
+
+    Relies on a primary key or unique index over the `unique` columns (by
+    default, all of `values`' columns), so concurrent requests can't
+    create a duplicate.
+    """
+
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        stmt = postgresql.insert(table).values(values).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        stmt = table.insert().prefix_with('OR IGNORE').values(values)
+    else:
+        exists = (select([literal(1)])
+                  .where(and_(*[table.c[name] == values[name]
+                                for name in unique or values]))
+                  .exists())
+        stmt = table.insert().from_select(
+            list(values),
+            select([literal(value) for value in values.values()])
+            .where(~exists))
+
+    return db.session.execute(stmt).rowcount
@@ -0,0 +1,14 @@
+// Toggle likes in place instead of posting the form and reloading the page.
+// Forms with a data-like-url post there and flip their button to match the
+// state the server returns; without JavaScript they still submit normally.
+
+$(document).on("submit", "form[data-like-url]", function (evt) {
+  evt.preventDefault();
+  const $button = $(this).find("button");
+
+  $.post($(this).data("like-url")).done(function (resp) {
+    $button
+      .toggleClass("btn-primary", resp.liked)
+      .toggleClass("btn-secondary", !resp.liked);
+  });
+});
@@ -0,0 +1,35 @@
+// Show new messages on the home timeline as they're posted, instead of
+// waiting for a reload. The server pushes them over /stream; EventSource
+// reconnects by itself if the connection drops.
+
+$(function () {
+  const $messages = $("#messages[data-live]");
+  if (!$messages.length || !window.EventSource) return;
+
+  const stream = new EventSource("/stream");
+
+  stream.addEventListener("message", function (evt) {
+    const msg = JSON.parse(evt.data);
+    const date = new Date(msg.timestamp + "Z").toLocaleDateString(undefined,
+      { day: "2-digit", month: "long", year: "numeric" });
+
+    const $item = $('<li class="list-group-item">').append(
+      $('<a class="message-link">').attr("href", `/messages/${msg.id}`),
+      $("<a>").attr("href", `/users/${msg.user.id}`).append(
+        $('<img class="timeline-image" alt="">').attr("src", msg.user.image_url)),
+      $('<div class="message-area">').append(
+        $("<a>").attr("href", `/users/${msg.user.id}`)
+          .text(`@${msg.user.username}`),
+        " ",
+        $('<span class="text-muted">').text(date),
+        $("<p>").text(msg.text)));
+
+    $messages.prepend($item);
+  });
+
+  // We fell too far behind and missed messages: start over from the page.
+  stream.addEventListener("resync", function () {
+    stream.close();
+    window.location.reload();
+  });
+});
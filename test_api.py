@@ -0,0 +1,124 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app, CURR_USER_KEY
+import social
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiTestCase(TestCase):
+    """Tests for the /api/v1 endpoints."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.reader = User(username="reader", email="reader@test.com",
+                           password="HASHED_PASSWORD")
+        self.author = User(username="author", email="author@test.com",
+                           password="HASHED_PASSWORD", bio="I write")
+        db.session.add_all([self.reader, self.author])
+        db.session.commit()
+        self.reader_id, self.author_id = self.reader.id, self.author.id
+
+        self.msg_id = social.post_message(self.author, "hello api").id
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c):
+        with c.session_transaction() as session:
+            session[CURR_USER_KEY] = self.reader_id
+
+    def test_follow_feed_and_unfollow(self):
+        """Does following fill the feed, and unfollowing empty it?"""
+
+        with self.client as c:
+            self.login(c)
+
+            resp = c.put(f"/api/v1/users/{self.author_id}/follow")
+            self.assertEqual(resp.get_json(),
+                             {"user_id": self.author_id, "following": True})
+            # Following again changes nothing
+            c.put(f"/api/v1/users/{self.author_id}/follow")
+            self.assertEqual(Follows.query.count(), 1)
+            self.assertEqual(User.query.get(self.author_id).followers_count, 1)
+
+            feed = c.get("/api/v1/feed").get_json()
+            self.assertEqual(feed["next_cursor"], None)
+            self.assertEqual(feed["items"], [{
+                "id": self.msg_id,
+                "text": "hello api",
+                "timestamp": feed["items"][0]["timestamp"],
+                "user": {"id": self.author_id, "username": "author",
+                         "image_url": "/static/images/default-pic.png"},
+                "liked": False,
+            }])
+
+            resp = c.delete(f"/api/v1/users/{self.author_id}/follow")
+            self.assertFalse(resp.get_json()["following"])
+            self.assertEqual(c.get("/api/v1/feed").get_json()["items"], [])
+
+    def test_like_and_unlike(self):
+        """Do PUT and DELETE set the like state?"""
+
+        with self.client as c:
+            self.login(c)
+
+            resp = c.put(f"/api/v1/messages/{self.msg_id}/like")
+            self.assertTrue(resp.get_json()["liked"])
+            self.assertTrue(c.get(f"/api/v1/messages/{self.msg_id}")
+                            .get_json()["message"]["liked"])
+
+            resp = c.delete(f"/api/v1/messages/{self.msg_id}/like")
+            self.assertFalse(resp.get_json()["liked"])
+            self.assertEqual(Likes.query.count(), 0)
+
+    def test_profile(self):
+        """Does a profile include counters and the user's messages?"""
+
+        data = self.client.get(f"/api/v1/users/{self.author_id}").get_json()
+
+        self.assertEqual(data["user"]["username"], "author")
+        self.assertEqual(data["user"]["bio"], "I write")
+        self.assertEqual(data["user"]["messages_count"], 1)
+        self.assertFalse(data["user"]["following"])
+        self.assertEqual([m["text"] for m in data["messages"]], ["hello api"])
+
+    def test_search(self):
+        """Does search return users or messages as JSON?"""
+
+        data = self.client.get("/api/v1/search?q=author").get_json()
+        self.assertEqual([u["username"] for u in data["items"]], ["author"])
+
+        data = self.client.get("/api/v1/search?q=hello&type=messages").get_json()
+        self.assertEqual([m["id"] for m in data["items"]], [self.msg_id])
+
+    def test_errors(self):
+        """Are errors JSON with the right status?"""
+
+        resp = self.client.get("/api/v1/feed")
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn("error", resp.get_json())
+
+        with self.client as c:
+            self.login(c)
+            resp = c.put("/api/v1/messages/99999/like")
+            self.assertEqual(resp.status_code, 404)
+            self.assertIn("error", resp.get_json())
@@ -0,0 +1,95 @@
+"""Replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_database.py
+#
+# A second database stands in for the replica: by default a SQLite file,
+# or whatever TEST_REPLICA_URL names, e.g.
+#
+#    createdb warbler-test-replica
+#    TEST_REPLICA_URL=postgresql:///warbler-test-replica python -m unittest ...
+
+
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from sqlalchemy.exc import OperationalError
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+# Nothing copies from the primary to this "replica", so a row added to
+# the primary only is found only by reads that went to the primary.
+REPLICA_URL = os.environ.get(
+    'TEST_REPLICA_URL',
+    "sqlite:///" + os.path.join(tempfile.gettempdir(),
+                                "warbler-test-replica.db"))
+
+from app import app, CURR_USER_KEY
+import database
+from database import STICKY_KEY
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Tests for sending GET requests' reads to a replica."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        # Undone however setUp ends, so later tests read the primary.
+        self.addCleanup(database.use_replicas, app, [])
+        database.use_replicas(app, [REPLICA_URL])
+        try:
+            self.replica = db.get_engine(app, bind='replica0')
+            db.Model.metadata.drop_all(self.replica)
+        except (ImportError, OperationalError) as exc:
+            self.skipTest(f"replica database unavailable: {exc}")
+        db.Model.metadata.create_all(self.replica)
+        self.addCleanup(db.Model.metadata.drop_all, self.replica)
+
+        user = User(username="primary", email="primary@test.com",
+                    password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_get_reads_replica(self):
+        """Do GET requests read from the replica?"""
+
+        resp = self.client.get(f"/users/{self.user_id}")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_outside_request_uses_primary(self):
+        """Do reads outside a request (commands, tests) use the primary?"""
+
+        self.assertIsNotNone(User.query.get(self.user_id))
+
+    def test_read_your_writes(self):
+        """Do a visitor's reads go to the primary just after their POST?"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+        self.client.post("/messages/new", data={"text": "fresh"})
+        resp = self.client.get(f"/users/{self.user_id}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("fresh", resp.get_data(as_text=True))
+
+        with self.client.session_transaction() as sess:
+            sess[STICKY_KEY] = time.time() - 1
+
+        resp = self.client.get(f"/users/{self.user_id}")
+        self.assertEqual(resp.status_code, 404)
@@ -0,0 +1,138 @@
+"""Account deletion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_deletion.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app, CURR_USER_KEY
+import deletion
+import jobs
+import search
+import social
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AccountDeletionTestCase(TestCase):
+    """Tests for hiding a deleted account, then purging it in chunks."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.users = [User(username=f"user{n}", email=f"user{n}@test.com",
+                           password="HASHED_PASSWORD") for n in range(4)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.leaver, *self.others = self.users
+        self.leaver_id = self.leaver.id
+        self.other_ids = [other.id for other in self.others]
+
+        for other in self.others:
+            social.follow(other, self.leaver)
+            social.follow(self.leaver, other)
+        msgs = [social.post_message(self.leaver, f"mine {n}")
+                for n in range(3)]
+        theirs = social.post_message(self.others[0], "theirs")
+        db.session.flush()
+        for other in self.others:
+            for msg in msgs:
+                social.set_like(other, msg, True)
+        social.set_like(self.leaver, theirs, True)
+        db.session.commit()
+
+        self.client = app.test_client()
+        jobs._inline = False
+
+    def tearDown(self):
+        db.session.remove()
+        jobs._inline = True
+        deletion.PURGE_CHUNK = 1000
+
+    def delete_leaver(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.leaver_id
+        return self.client.post("/users/delete")
+
+    def test_hidden_at_once(self):
+        """Is a deleted user hidden before their rows are purged?"""
+
+        self.delete_leaver()
+
+        self.assertIsNotNone(User.query.get(self.leaver_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.leaver_id)
+                         .count(), 3)
+        self.assertEqual(self.client.get(f"/users/{self.leaver_id}")
+                         .status_code, 404)
+        self.assertFalse(User.authenticate("user0", "HASHED_PASSWORD"))
+
+        resp = self.client.get("/users")
+        self.assertNotIn("@user0", resp.get_data(as_text=True))
+
+    def test_messages_hidden_at_once(self):
+        """Are a deleted user's messages hidden before they're purged?"""
+
+        msg_id = Message.query.filter_by(user_id=self.leaver_id).first().id
+        self.delete_leaver()
+
+        self.assertEqual(self.client.get(f"/messages/{msg_id}").status_code,
+                         404)
+        self.assertEqual(self.client.get(f"/api/v1/messages/{msg_id}")
+                         .status_code, 404)
+        self.assertEqual(search.search_messages("mine").items, [])
+        self.assertEqual(search.search_messages("theirs").items[0].user_id,
+                         self.other_ids[0])
+        feed = timeline.home_timeline(self.other_ids[0])
+        self.assertNotIn(self.leaver_id, [msg.user_id for msg in feed.items])
+
+    def test_purged_in_chunks(self):
+        """Is the account purged a chunk per job, fixing counters?"""
+
+        deletion.PURGE_CHUNK = 2
+        self.delete_leaver()
+
+        self.assertEqual(deletion.progress(self.leaver_id).rows_deleted, 0)
+        self.assertEqual(jobs.run_pending(limit=1), 1)
+        self.assertEqual(deletion.progress(self.leaver_id).rows_deleted, 2)
+
+        jobs.run_pending()
+        db.session.expire_all()
+
+        done = deletion.progress(self.leaver_id)
+        self.assertIsNotNone(done.finished_at)
+        self.assertIsNone(User.query.get(self.leaver_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.leaver_id)
+                         .count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(TimelineEntry.query.filter_by(
+            author_id=self.leaver_id).count(), 0)
+
+        for other_id in self.other_ids:
+            other = User.query.get(other_id)
+            self.assertEqual((other.followers_count, other.following_count,
+                              other.likes_count), (0, 0, 0))
+
+        # 13 timeline rows, 6 follows, 10 likes, 3 messages and the user.
+        self.assertEqual(done.rows_deleted, 33)
+
+    def test_inline_purge(self):
+        """Without workers, is the account purged in the request?"""
+
+        jobs._inline = True
+        deletion.PURGE_CHUNK = 1
+        self.delete_leaver()
+
+        self.assertIsNone(User.query.get(self.leaver_id))
+        self.assertEqual(Message.query.count(), 1)
+        self.assertEqual(Likes.query.count(), 0)
@@ -0,0 +1,133 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app, CURR_USER_KEY
+from fragments import ClientBackend, FragmentCache, LRUBackend, fragment_cache
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class DictClient:
+    """Stand-in for a shared cache client, storing bytes like memcached."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value.encode('utf-8')
+
+
+class FragmentCacheTestCase(TestCase):
+    """Tests for the versioned fragment cache."""
+
+    def test_lru_eviction(self):
+        """Does the LRU backend drop the least recently used entry?"""
+
+        lru = LRUBackend(maxsize=2)
+        lru.set("a", "1")
+        lru.set("b", "2")
+        lru.get("a")
+        lru.set("c", "3")
+
+        self.assertEqual(lru.get("a"), "1")
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("c"), "3")
+
+    def test_versions_and_metrics(self):
+        """Do version bumps cause misses, and are hits/misses counted?"""
+
+        cache = FragmentCache(ClientBackend(DictClient()))
+        renders = []
+
+        def render():
+            renders.append(1)
+            return "<li>card</li>"
+
+        def key():
+            return f"message:1:{cache.version('message', 1)}"
+
+        self.assertEqual(cache.get_or_render(key(), render), "<li>card</li>")
+        self.assertEqual(cache.get_or_render(key(), render), "<li>card</li>")
+        cache.invalidate('message', 1)
+        cache.get_or_render(key(), render)
+
+        self.assertEqual(len(renders), 2)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2})
+
+
+class FragmentViewsTestCase(TestCase):
+    """Tests that cached profile headers stay in step with edits."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        fragment_cache.clear()
+
+        user = User.signup(username="cached", email="cached@test.com",
+                           password="password", image_url=None)
+        user.bio = "Original bio"
+        db.session.commit()
+        self.user_id = user.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_profile_header_cached(self):
+        """Is the profile header served from cache on the second view?"""
+
+        self.client.get(f"/users/{self.user_id}")
+        misses = fragment_cache.stats()['misses']
+        self.client.get(f"/users/{self.user_id}")
+
+        self.assertEqual(fragment_cache.stats()['misses'], misses)
+        self.assertGreater(fragment_cache.stats()['hits'], 0)
+
+    def test_profile_edit_invalidates(self):
+        """Does editing the profile replace the cached header?"""
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.user_id
+
+            self.assertIn("Original bio", str(c.get(f"/users/{self.user_id}").data))
+
+            c.post("/users/profile", data={"username": "cached",
+                                           "email": "cached@test.com",
+                                           "bio": "Edited bio",
+                                           "password": "password"})
+            resp = c.get(f"/users/{self.user_id}")
+            self.assertIn("Edited bio", str(resp.data))
+            self.assertNotIn("Original bio", str(resp.data))
+
+    def test_message_delete_invalidates(self):
+        """Does deleting a message drop it from the cached profile?"""
+
+        msg = Message(text="soon gone", user_id=self.user_id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.user_id
+
+            self.assertIn("soon gone", str(c.get(f"/users/{self.user_id}").data))
+            c.post(f"/messages/{msg_id}/delete")
+            self.assertNotIn("soon gone", str(c.get(f"/users/{self.user_id}").data))
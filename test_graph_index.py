@@ -0,0 +1,133 @@
+"""In-memory follow graph index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_graph_index.py
+
+
+import os
+from array import array
+from unittest import TestCase
+
+from flask import session
+
+from models import db, Follows, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app, CURR_USER_KEY
+from current_user import prime_follow_states
+import deletion
+import graph_index
+from graph_index import contains, intersect
+import social
+from testing import QueryCountMixin
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class SortedArrayTestCase(TestCase):
+    """Tests for lookups in sorted id arrays."""
+
+    def test_contains(self):
+        ids = array('i', [2, 3, 5, 8])
+        self.assertTrue(all(contains(ids, n) for n in [2, 3, 5, 8]))
+        self.assertFalse(any(contains(ids, n) for n in [0, 4, 9]))
+        self.assertFalse(contains(array('i'), 1))
+
+    def test_intersect(self):
+        evens = array('i', range(0, 1000, 2))
+        threes = array('i', range(0, 1000, 3))
+        expected = list(range(0, 1000, 6))
+        self.assertEqual(intersect(evens, threes), expected)
+
+        # Lopsided sizes take the binary-search path.
+        few = array('i', [6, 7, 600, 999])
+        self.assertEqual(intersect(evens, few), [6, 600])
+        self.assertEqual(intersect(few, evens), [6, 600])
+        self.assertEqual(intersect(few, array('i')), [])
+
+
+class GraphIndexTestCase(QueryCountMixin, TestCase):
+    """Tests for loading the index and keeping it current."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.users = [User(username=f"user{n}", email=f"user{n}@test.com",
+                           password="HASHED_PASSWORD") for n in range(5)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.ids = [user.id for user in self.users]
+
+        a, b, c, d, e = self.ids
+        for follower, followed in [(a, b), (a, c), (a, d), (b, a), (b, c),
+                                   (c, d), (e, a)]:
+            db.session.add(Follows(user_following_id=follower,
+                                   user_being_followed_id=followed))
+        db.session.commit()
+
+        graph_index.enable()
+        self.graph = graph_index.index
+
+    def tearDown(self):
+        graph_index.disable()
+        db.session.rollback()
+
+    def test_load(self):
+        """Does the index hold the follows table, both ways, sorted?"""
+
+        a, b, c, d, e = self.ids
+        self.assertEqual(list(self.graph.following_of(a)), [b, c, d])
+        self.assertEqual(list(self.graph.followers_of(a)), [b, e])
+        self.assertTrue(self.graph.follows(c, d))
+        self.assertFalse(self.graph.follows(d, c))
+        self.assertEqual(self.graph.common_following(a, b), [c])
+        self.assertEqual(self.graph.mutuals(a), [b])
+        self.assertEqual(self.graph.stats()['follows'], 7)
+
+    def test_updated_on_commit(self):
+        """Do follows and unfollows reach the index once committed?"""
+
+        a, b, c, d, e = self.ids
+        users = {user.id: user for user in User.query}
+
+        social.follow(users[d], users[e])
+        self.assertFalse(self.graph.follows(d, e))
+        db.session.commit()
+        self.assertTrue(self.graph.follows(d, e))
+        self.assertEqual(list(self.graph.followers_of(e)), [d])
+
+        social.unfollow(users[a], users[c])
+        db.session.rollback()
+        self.assertTrue(self.graph.follows(a, c))
+
+        social.unfollow(users[a], users[c])
+        db.session.commit()
+        self.assertEqual(list(self.graph.following_of(a)), [b, d])
+        self.assertEqual(list(self.graph.followers_of(c)), [b])
+
+    def test_deleted_account(self):
+        """Does deleting an account drop its follows from the index?"""
+
+        a, b, c, d, e = self.ids
+        deletion.request_deletion(User.query.get(a))
+        db.session.commit()
+
+        self.assertEqual(list(self.graph.followers_of(b)), [])
+        self.assertEqual(list(self.graph.following_of(b)), [c])
+        self.assertEqual(self.graph.stats()['follows'], 2)
+
+    def test_follow_states_without_queries(self):
+        """Do follow buttons come from the index rather than SQL?"""
+
+        a, b, c, d, e = self.ids
+        with app.test_request_context():
+            session[CURR_USER_KEY] = a
+            with self.assertMaxQueries(0):
+                states = prime_follow_states(self.ids)
+
+        self.assertEqual(states, {a: False, b: True, c: True, d: True,
+                                  e: False})
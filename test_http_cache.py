@@ -0,0 +1,99 @@
+"""HTTP caching policy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_cache.py
+
+
+import os
+import re
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app, CURR_USER_KEY
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HttpCacheTestCase(TestCase):
+    """Tests for per-route Cache-Control, fingerprints and 304s."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User(username="cachey", email="cachey@test.com",
+                    password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_fingerprinted_static_is_immutable(self):
+        """Are assets linked with a fingerprint and cached for good?"""
+
+        page = self.client.get("/signup").get_data(as_text=True)
+        url = re.search(r'href="(/static/stylesheets/style\.css\?v=\w+)"',
+                        page).group(1)
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.headers['Cache-Control'],
+                         "public, max-age=31536000, immutable")
+
+    def test_profile_conditional_get(self):
+        """Does a profile revalidate to a 304 until it changes?"""
+
+        resp = self.client.get(f"/users/{self.user_id}")
+        etag = resp.headers['ETag']
+        self.assertEqual(resp.headers['Cache-Control'], "public, max-age=60")
+
+        resp = self.client.get(f"/users/{self.user_id}",
+                               headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+
+        db.session.add(Message(text="news", user_id=self.user_id))
+        db.session.commit()
+
+        resp = self.client.get(f"/users/{self.user_id}",
+                               headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_logged_in_pages_are_private(self):
+        """Are pages showing per-user data kept out of shared caches?"""
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.user_id
+
+            resp = c.get(f"/users/{self.user_id}")
+            self.assertEqual(resp.headers['Cache-Control'], "private, no-cache")
+            self.assertIn('ETag', resp.headers)
+
+            resp = c.get("/")
+            self.assertEqual(resp.headers['Cache-Control'], "private, no-cache")
+
+            resp = c.post("/users/follow/999999")
+            self.assertEqual(resp.headers['Cache-Control'], "no-store")
+
+    def test_flashed_page_is_private(self):
+        """Is a page showing a visitor's flash message kept out of caches?"""
+
+        resp = self.client.get(f"/users/{self.user_id}/following")
+        self.assertEqual(resp.status_code, 302)
+
+        resp = self.client.get("/")
+        self.assertIn("Access unauthorized", resp.get_data(as_text=True))
+        self.assertEqual(resp.headers['Cache-Control'], "private, no-cache")
+
+        # The flash is gone now, and so is the reason to keep it private.
+        resp = self.client.get("/")
+        self.assertEqual(resp.headers['Cache-Control'], "public, max-age=60")
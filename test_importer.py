@@ -0,0 +1,108 @@
+"""Bulk importer tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_importer.py
+
+
+import csv
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app
+import importer
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+class ImporterTestCase(TestCase):
+    """Tests for streaming, idempotent and resumable CSV imports."""
+
+    def setUp(self):
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+        self.dir = tempfile.mkdtemp()
+        write_csv(os.path.join(self.dir, 'users.csv'),
+                  ['email', 'username', 'image_url', 'password', 'bio',
+                   'header_image_url', 'location'],
+                  [[f"user{i}@test.com", f"user{i}", "/img.png", "HASHED",
+                    "", "/header.png", ""] for i in range(5)])
+        write_csv(os.path.join(self.dir, 'messages.csv'),
+                  ['text', 'timestamp', 'user_id'],
+                  [[f"message {i}", f"2020-01-0{i + 1} 10:00:00.000000",
+                    i % 5 + 1] for i in range(7)])
+        write_csv(os.path.join(self.dir, 'follows.csv'),
+                  ['user_being_followed_id', 'user_following_id'],
+                  [[1, 2], [1, 3], [2, 1]])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+    def test_load_levels(self):
+        """Are tables grouped in foreign-key order?"""
+
+        self.assertEqual(importer.load_levels(['follows', 'messages', 'users']),
+                         [['users'], ['follows', 'messages']])
+
+    def test_import(self):
+        """Are rows loaded with row-number ids and derived data rebuilt?"""
+
+        loaded = importer.import_dir(self.dir, chunk_size=2, log=lambda _: None)
+
+        self.assertEqual(loaded, {'users': 5, 'messages': 7, 'follows': 3})
+        self.assertEqual(User.query.get(3).username, "user2")
+        self.assertEqual(User.query.get(3).bio, "")
+        self.assertEqual(Message.query.get(6).user.username, "user0")
+        self.assertEqual(User.query.get(1).followers_count, 2)
+        self.assertEqual(User.query.get(1).messages_count, 2)
+        # user2 follows user1: their own two messages plus user1's two
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=2).count(), 4)
+
+    def test_rerun_is_idempotent(self):
+        """Does importing twice leave the same data?"""
+
+        importer.import_dir(self.dir, log=lambda _: None)
+        loaded = importer.import_dir(self.dir, log=lambda _: None)
+
+        self.assertEqual(loaded, {'users': 0, 'messages': 0, 'follows': 0})
+        self.assertEqual(User.query.count(), 5)
+        self.assertEqual(Message.query.count(), 7)
+        self.assertEqual(Follows.query.count(), 3)
+
+    def test_resume(self):
+        """Does an import pick up after the last committed chunk?"""
+
+        importer.import_dir(self.dir, chunk_size=2, log=lambda _: None)
+
+        # Lose the messages after the first chunk, as if the import had
+        # been interrupted there.
+        db.session.execute(Message.__table__.delete()
+                           .where(Message.id > 2))
+        db.session.execute(importer.import_progress.update()
+                           .where(importer.import_progress.c.source
+                                  == 'messages')
+                           .values(rows_done=2))
+        db.session.commit()
+
+        loaded = importer.import_dir(self.dir, chunk_size=2, log=lambda _: None)
+
+        self.assertEqual(loaded['messages'], 5)
+        self.assertEqual(Message.query.count(), 7)
+        self.assertEqual(Message.query.get(7).text, "message 6")
@@ -0,0 +1,103 @@
+"""Instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_instrumentation.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app
+import instrumentation
+from instrumentation import fingerprint, metrics
+
+
+class InstrumentationTestCase(TestCase):
+    """Tests for per-request timings and /metrics."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        metrics.reset()
+
+        user = User(username="metered", email="metered@test.com",
+                    password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        instrumentation._slow_query_ms = app.config['SLOW_QUERY_MS']
+
+    def test_fingerprint(self):
+        """Do statements differing only in values share a fingerprint?"""
+
+        self.assertEqual(
+            fingerprint("SELECT * FROM users WHERE id IN (1, 2, 3)\n"
+                        "  AND username = 'bob'"),
+            "SELECT * FROM users WHERE id IN (?) AND username = ?")
+        self.assertEqual(
+            fingerprint("SELECT * FROM users WHERE id IN (%(id_1)s, %(id_2)s)"),
+            fingerprint("SELECT * FROM users WHERE id IN (?)"))
+
+    def test_server_timing(self):
+        """Does a response report its DB and render time?"""
+
+        resp = self.client.get(f"/users/{self.user_id}")
+        self.assertNotIn('Server-Timing', resp.headers)
+
+        app.config['SERVER_TIMING'] = True
+        try:
+            resp = self.client.get(f"/users/{self.user_id}")
+        finally:
+            app.config['SERVER_TIMING'] = False
+
+        self.assertRegex(resp.headers['Server-Timing'],
+                         r'db;dur=[\d.]+;desc="[1-9]\d* queries", '
+                         r'render;dur=[\d.]+, total;dur=[\d.]+')
+
+    def test_metrics(self):
+        """Are per-endpoint totals and slow queries exposed?"""
+
+        instrumentation._slow_query_ms = 0
+        self.client.get(f"/users/{self.user_id}")
+        self.client.get(f"/users/{self.user_id}")
+
+        app.config['METRICS_TOKEN'] = "s3cret"
+        try:
+            body = self.client.get("/metrics", headers={
+                'Authorization': "Bearer s3cret"}).get_data(as_text=True)
+        finally:
+            app.config['METRICS_TOKEN'] = None
+
+        self.assertIn('warbler_requests_total{endpoint="users_show",'
+                      'method="GET",status="200"} 2', body)
+        self.assertIn('warbler_request_duration_seconds_count'
+                      '{endpoint="users_show"} 2', body)
+        self.assertIn('warbler_db_queries_total{endpoint="users_show"}', body)
+        self.assertIn('warbler_slow_queries_total{fingerprint="SELECT', body)
+        self.assertIn('warbler_fragment_cache_hits_total', body)
+        self.assertIn('warbler_password_hash_queued', body)
+
+    def test_metrics_token(self):
+        """Is /metrics closed without the token, and off without one set?"""
+
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+        app.config['METRICS_TOKEN'] = "s3cret"
+        try:
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            resp = self.client.get("/metrics", headers={
+                'Authorization': "Bearer s3cret"})
+            self.assertEqual(resp.status_code, 200)
+        finally:
+            app.config['METRICS_TOKEN'] = None
@@ -0,0 +1,217 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app, CURR_USER_KEY
+import jobs
+from jobs import FAILED, MAX_ATTEMPTS, QUEUED, RUNNING
+import social
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class JobQueueTestCase(TestCase):
+    """Tests for queueing side effects and running them later."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        jobs._inline = False
+
+        self.author = User(username="author", email="author@test.com",
+                           password="HASHED_PASSWORD")
+        self.reader = User(username="reader", email="reader@test.com",
+                           password="HASHED_PASSWORD")
+        db.session.add_all([self.author, self.reader])
+        db.session.commit()
+        self.author_id = self.author.id
+        self.reader_id = self.reader.id
+
+        social.follow(self.reader, self.author)
+        db.session.commit()
+        jobs.run_pending()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        jobs._inline = True
+        jobs.HANDLERS.pop('test_flaky', None)
+        jobs.SCHEDULE.pop('test_flaky', None)
+        jobs._scheduled_periods.clear()
+
+    def job_rows(self):
+        return db.session.execute(jobs.jobs.select()
+                                  .order_by(jobs.jobs.c.id)).fetchall()
+
+    def timeline_of(self, user_id):
+        return TimelineEntry.query.filter_by(user_id=user_id).count()
+
+    def test_fan_out_is_deferred(self):
+        """Does posting leave the fan-out to a job?"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.author_id
+
+        self.client.post("/messages/new", data={"text": "later"})
+        self.assertEqual(Message.query.count(), 1)
+        self.assertEqual(self.timeline_of(self.reader_id), 0)
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(self.timeline_of(self.reader_id), 1)
+        self.assertEqual(self.timeline_of(self.author_id), 1)
+
+    def test_fan_out_after_backfill(self):
+        """Does a fan-out skip timelines a backfill already filled?"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.author_id
+        self.client.post("/messages/new", data={"text": "later"})
+
+        newcomer = User(username="newcomer", email="newcomer@test.com",
+                        password="HASHED_PASSWORD")
+        db.session.add(newcomer)
+        db.session.commit()
+        newcomer_id = newcomer.id
+        social.follow(newcomer, User.query.get(self.author_id))
+        db.session.commit()
+
+        # The follow's backfill, and a rebuild, get there first.
+        timeline.backfill(newcomer_id, self.author_id)
+        timeline.backfill(self.author_id, self.author_id)
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual([row.status for row in self.job_rows()][-2:],
+                         [jobs.DONE, jobs.DONE])
+        for user_id in (self.author_id, self.reader_id, newcomer_id):
+            self.assertEqual(self.timeline_of(user_id), 1)
+
+    def test_idempotency_key(self):
+        """Is a job enqueued twice with the same key only queued once?"""
+
+        self.assertTrue(jobs.enqueue('fan_out', key="same", message_id=1))
+        self.assertFalse(jobs.enqueue('fan_out', key="same", message_id=1))
+        db.session.commit()
+
+        keys = [row.idempotency_key for row in self.job_rows()]
+        self.assertEqual(keys.count("same"), 1)
+
+    def test_retry_then_fail(self):
+        """Is a failing job retried with backoff, then given up on?"""
+
+        calls = []
+
+        @jobs.handler('test_flaky')
+        def flaky():
+            calls.append(1)
+            raise RuntimeError("flaky")
+
+        jobs.enqueue('test_flaky')
+        db.session.commit()
+
+        jobs.run_pending()
+        job = self.job_rows()[-1]
+        self.assertEqual((job.status, job.attempts), (QUEUED, 1))
+        self.assertGreater(job.run_after, datetime.utcnow())
+
+        for _ in range(MAX_ATTEMPTS):
+            db.session.execute(jobs.jobs.update()
+                               .values(run_after=datetime.utcnow()))
+            db.session.commit()
+            jobs.run_pending()
+
+        job = self.job_rows()[-1]
+        self.assertEqual(len(calls), MAX_ATTEMPTS)
+        self.assertEqual(job.status, FAILED)
+        self.assertIn("RuntimeError: flaky", job.last_error)
+
+    def test_lost_job_is_reclaimed(self):
+        """Is a job whose worker died picked up again?"""
+
+        jobs.enqueue('test_flaky')
+        jobs.handler('test_flaky')(lambda: None)
+        db.session.execute(jobs.jobs.update().where(
+            jobs.jobs.c.kind == 'test_flaky').values(
+            status=RUNNING,
+            locked_at=datetime.utcnow() - jobs.LOCK_TIMEOUT
+            - timedelta(seconds=1)))
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 1)
+
+    def test_scheduled_once_per_period(self):
+        """Is a scheduled job enqueued once each period, by any process?"""
+
+        self.addCleanup(jobs.SCHEDULE.update, dict(jobs.SCHEDULE))
+        jobs.SCHEDULE.clear()
+        jobs.schedule('test_flaky', 60)
+
+        self.assertEqual(jobs.enqueue_scheduled(now=600), 1)
+        self.assertEqual(jobs.enqueue_scheduled(now=630), 0)
+
+        # Another process, which hasn't enqueued it itself.
+        jobs._scheduled_periods.clear()
+        self.assertEqual(jobs.enqueue_scheduled(now=630), 0)
+        self.assertEqual(jobs.enqueue_scheduled(now=660), 1)
+
+        kinds = [row.kind for row in self.job_rows()]
+        self.assertEqual(kinds.count('test_flaky'), 2)
+
+    def test_delete_account(self):
+        """Is an account purged by jobs, fixing others' counters?"""
+
+        msg = social.post_message(self.reader, "mine")
+        db.session.flush()
+        db.session.add(Likes(user_id=self.author_id, message_id=msg.id))
+        db.session.commit()
+        jobs.run_pending()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.reader_id
+        self.client.post("/users/delete")
+        self.assertIsNotNone(User.query.get(self.reader_id))
+
+        jobs.run_pending()
+        db.session.expire_all()
+        self.assertIsNone(User.query.get(self.reader_id))
+        self.assertEqual(Message.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(User.query.get(self.author_id).followers_count, 0)
+
+    def test_workers_queue_follow_ups(self):
+        """Once workers start here, do handlers' jobs get queued too?"""
+
+        calls = []
+
+        @jobs.handler('test_chain')
+        def chain(step):
+            calls.append(step)
+            if step < 2:
+                jobs.enqueue('test_chain', step=step + 1)
+
+        self.addCleanup(jobs.HANDLERS.pop, 'test_chain')
+
+        jobs._inline = True
+        jobs.start(app, 0)
+        jobs.enqueue('test_chain', step=0)
+        db.session.commit()
+        self.assertEqual(calls, [])
+
+        self.assertEqual(jobs.run_pending(limit=1), 1)
+        self.assertEqual(calls, [0])
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual(calls, [0, 1, 2])
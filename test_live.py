@@ -0,0 +1,142 @@
+"""Live stream tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_live.py
+
+
+import json
+import os
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app, CURR_USER_KEY
+import live
+from live import Bus, RESYNC, StreamsFull
+import social
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class BusTestCase(TestCase):
+    """Tests for the in-process pub/sub bus."""
+
+    def setUp(self):
+        self.bus = Bus(queue_size=2, max_subscribers=2)
+
+    def test_deliver(self):
+        """Do subscribers get events from their channels, and only those?"""
+
+        first = self.bus.subscribe([1, 2])
+        second = self.bus.subscribe([3])
+
+        self.bus.publish(2, {'id': 10})
+
+        self.assertEqual(first.get(0), {'id': 10})
+        self.assertIsNone(second.get(0))
+
+    def test_overflow(self):
+        """Is a subscriber that falls behind dropped and told to resync?"""
+
+        slow = self.bus.subscribe([1])
+        for msg_id in range(3):
+            self.bus.publish(1, {'id': msg_id})
+
+        self.assertIs(slow.get(0), RESYNC)
+        self.assertEqual(self.bus.stats()['subscribers'], 0)
+        self.assertEqual(self.bus.stats()['dropped'], 1)
+
+    def test_limit(self):
+        """Are subscribers past the limit refused, and room freed on close?"""
+
+        self.bus.subscribe([1])
+        second = self.bus.subscribe([1])
+        with self.assertRaises(StreamsFull):
+            self.bus.subscribe([1])
+
+        second.close()
+        self.bus.subscribe([1])
+        self.assertEqual(self.bus.stats()['rejected'], 1)
+
+
+class StreamTestCase(TestCase):
+    """Tests for publishing messages and the /stream endpoint."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.author = User(username="author", email="author@test.com",
+                           password="HASHED_PASSWORD")
+        self.reader = User(username="reader", email="reader@test.com",
+                           password="HASHED_PASSWORD")
+        db.session.add_all([self.author, self.reader])
+        db.session.commit()
+        self.author_id = self.author.id
+        self.reader_id = self.reader.id
+
+        self.client = app.test_client()
+        live._heartbeat_seconds = 0.01
+
+    def tearDown(self):
+        db.session.rollback()
+        live._heartbeat_seconds = app.config.get('LIVE_HEARTBEAT', 15)
+
+    def test_publish_on_commit(self):
+        """Is a message published once committed, and not if rolled back?"""
+
+        subscription = live.bus.subscribe([self.author_id])
+        try:
+            social.post_message(self.author, "rolled back")
+            db.session.rollback()
+            self.assertIsNone(subscription.get(0))
+
+            msg = social.post_message(self.author, "committed")
+            db.session.commit()
+
+            event = subscription.get(0)
+            self.assertEqual(event['id'], msg.id)
+            self.assertEqual(event['text'], "committed")
+            self.assertEqual(event['user']['username'], "author")
+        finally:
+            subscription.close()
+
+    def test_stream_anonymous(self):
+        """Is the stream for logged-in users only?"""
+
+        resp = self.client.get("/stream")
+        self.assertEqual(resp.status_code, 401)
+
+    def test_stream(self):
+        """Does a stream carry messages from followed users only?"""
+
+        social.follow(self.reader, self.author)
+        db.session.commit()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.reader_id
+
+        resp = self.client.get("/stream")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "text/event-stream")
+        self.assertEqual(resp.headers['Cache-Control'], "no-store")
+        self.assertEqual(live.bus.stats()['subscribers'], 1)
+
+        # A stranger's message isn't sent; the author's is.
+        live.bus.publish(999, {'id': 1, 'text': "stranger"})
+        live.bus.publish(self.author_id, {'id': 2, 'text': "hello"})
+
+        # Streams start with the retry delay, and idle ones send keepalive
+        # comments between events.
+        chunks = (chunk.decode() for chunk in resp.response)
+        chunk = next(chunk for chunk in chunks if chunk.startswith("id:"))
+        self.assertTrue(chunk.startswith("id: 2\nevent: message\n"))
+        data = chunk.split("data: ", 1)[1]
+        self.assertEqual(json.loads(data)['text'], "hello")
+
+        resp.close()
+        self.assertEqual(live.bus.stats()['subscribers'], 0)
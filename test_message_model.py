@@ -7,6 +7,7 @@ from datetime import datetime
 from models import db, User, Message, Likes 
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
 
 from app import app
 
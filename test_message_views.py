@@ -16,6 +16,7 @@ from models import db, connect_db, Message, User, Likes, Follows
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
 
 
 # Now we can import app
@@ -136,4 +137,40 @@ class MessageViewTestCase(TestCase):
         with self.client as c:
             resp = c.post("/messages/9999/delete",follow_redirects=True)
             self.assertEqual(resp.status_code,200)
-            self.assertIn("Access unauthorized.", str(resp.data))
\ No newline at end of file
+            self.assertIn("Access unauthorized.", str(resp.data))
+
+    def test_like_message_json(self):
+        """Does the like endpoint toggle the like and report its state?"""
+        author = User.signup(username="author", email="author@test.com",
+                             password="author", image_url=None)
+        db.session.flush()
+        m = Message(id=9999, text="likeable", user_id=author.id)
+        db.session.add(m)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post("/messages/9999/like")
+            self.assertEqual(resp.get_json(), {"message_id": 9999, "liked": True})
+
+            # Setting a state the like is already in changes nothing
+            resp = c.post("/messages/9999/like", json={"liked": True})
+            self.assertEqual(resp.get_json()["liked"], True)
+            self.assertEqual(Likes.query.count(), 1)
+            self.assertEqual(User.query.get(self.testuser.id).likes_count, 1)
+
+            resp = c.post("/messages/9999/like")
+            self.assertEqual(resp.get_json()["liked"], False)
+            self.assertEqual(Likes.query.count(), 0)
+            self.assertEqual(User.query.get(self.testuser.id).likes_count, 0)
+
+    def test_like_message_json_no_user(self):
+        """tests that a logged out user gets a 401 from the like endpoint"""
+        m = Message(id=9999, text="test", user_id=self.testuser.id)
+        db.session.add(m)
+        db.session.commit()
+
+        resp = self.client.post("/messages/9999/like")
+        self.assertEqual(resp.status_code, 401)
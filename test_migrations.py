@@ -0,0 +1,119 @@
+"""Schema migration and query plan tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import db, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app
+import migrations
+import query_plans
+
+db.create_all()
+
+
+def create_baseline_schema():
+    """Create the tables as the first release of Warbler had them."""
+
+    baseline = db.MetaData()
+    db.Table('users', baseline,
+             db.Column('id', db.Integer, primary_key=True),
+             db.Column('email', db.Text, nullable=False, unique=True),
+             db.Column('username', db.Text, nullable=False, unique=True),
+             db.Column('image_url', db.Text),
+             db.Column('header_image_url', db.Text),
+             db.Column('bio', db.Text),
+             db.Column('location', db.Text),
+             db.Column('password', db.Text, nullable=False))
+    db.Table('messages', baseline,
+             db.Column('id', db.Integer, primary_key=True),
+             db.Column('text', db.String(140), nullable=False),
+             db.Column('timestamp', db.DateTime, nullable=False),
+             db.Column('user_id', db.Integer,
+                       db.ForeignKey('users.id', ondelete='CASCADE'),
+                       nullable=False))
+    db.Table('follows', baseline,
+             db.Column('user_being_followed_id', db.Integer,
+                       db.ForeignKey('users.id', ondelete="cascade"),
+                       primary_key=True),
+             db.Column('user_following_id', db.Integer,
+                       db.ForeignKey('users.id', ondelete="cascade"),
+                       primary_key=True))
+    db.Table('likes', baseline,
+             db.Column('id', db.Integer, primary_key=True),
+             db.Column('user_id', db.Integer,
+                       db.ForeignKey('users.id', ondelete='cascade')),
+             db.Column('message_id', db.Integer,
+                       db.ForeignKey('messages.id', ondelete='cascade')))
+    baseline.create_all(db.engine)
+    return baseline
+
+
+class MigrationsTestCase(TestCase):
+    """Tests for versioned migrations and hot-query indexes."""
+
+    def setUp(self):
+        db.session.rollback()
+        migrations.schema_migrations.drop(db.engine, checkfirst=True)
+
+    def test_upgrade_is_versioned(self):
+        """Does upgrade apply every migration once, then nothing?"""
+
+        applied = migrations.upgrade()
+        self.assertEqual(applied, [v for v, _, _ in migrations.MIGRATIONS])
+        self.assertEqual(migrations.upgrade(), [])
+        self.assertEqual(migrations.applied_versions(), set(applied))
+
+    def test_hot_queries_use_indexes(self):
+        """Does every hot query's EXPLAIN plan use its index?"""
+
+        migrations.upgrade()
+
+        for result in query_plans.check():
+            self.assertTrue(result.uses_index,
+                            f"{result.name} doesn't use {result.index}:\n"
+                            f"{result.plan}")
+
+    def test_upgrade_baseline_database(self):
+        """Does upgrade bring a first-release database up to date?"""
+
+        db.session.remove()
+        db.drop_all()
+        self.addCleanup(db.create_all)
+        self.addCleanup(db.drop_all)
+        self.addCleanup(db.session.remove)
+
+        baseline = create_baseline_schema()
+        written = datetime(2020, 1, 2, 3, 4, 5)
+        with db.engine.begin() as connection:
+            connection.execute(baseline.tables['users'].insert(), [
+                {'id': 1, 'email': 'a@test.com', 'username': 'a',
+                 'password': 'x'},
+                {'id': 2, 'email': 'b@test.com', 'username': 'b',
+                 'password': 'x'}])
+            connection.execute(baseline.tables['messages'].insert(), [
+                {'id': 1, 'text': 'hello', 'timestamp': written,
+                 'user_id': 1}])
+            connection.execute(baseline.tables['follows'].insert(), [
+                {'user_being_followed_id': 1, 'user_following_id': 2}])
+            connection.execute(baseline.tables['likes'].insert(), [
+                {'id': 1, 'user_id': 2, 'message_id': 1}])
+
+        applied = migrations.upgrade()
+
+        self.assertEqual(applied, [v for v, _, _ in migrations.MIGRATIONS])
+        self.assertEqual(db.session.query(Likes.created_at).scalar(), written)
+        indexes = {ix['name'] for ix in inspect(db.engine).get_indexes('likes')}
+        self.assertLessEqual({'ix_likes_message_id', 'ix_likes_created_at',
+                              'uq_likes_user_id_message_id'}, indexes)
@@ -0,0 +1,83 @@
+"""Password hasher tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app
+from passwords import PasswordHasher, hash_cost, hasher
+
+
+class PasswordHasherTestCase(TestCase):
+    """Tests for hashing, re-hashing and pool metrics."""
+
+    def test_hash_and_verify_inline(self):
+        """Does an inline hasher hash at its cost and check passwords?"""
+
+        inline = PasswordHasher(log_rounds=4, workers=0)
+        pw_hash = inline.hash("secret")
+
+        self.assertEqual(hash_cost(pw_hash), 4)
+        self.assertEqual(inline.verify(pw_hash, "secret"), (True, None))
+        self.assertEqual(inline.verify(pw_hash, "wrong"), (False, None))
+
+    def test_rehash_on_cost_change(self):
+        """Is a matching password re-hashed when the cost has changed?"""
+
+        old_hash = PasswordHasher(log_rounds=4).hash("secret")
+        matches, new_hash = PasswordHasher(log_rounds=5).verify(old_hash,
+                                                                "secret")
+
+        self.assertTrue(matches)
+        self.assertEqual(hash_cost(new_hash), 5)
+
+    def test_pool_stats(self):
+        """Does the pooled hasher work and count what it did?"""
+
+        pooled = PasswordHasher(log_rounds=4, workers=1, max_queue=2)
+        try:
+            pw_hash = pooled.hash("secret")
+            self.assertEqual(pooled.verify(pw_hash, "secret"), (True, None))
+        finally:
+            pooled.shutdown()
+
+        stats = pooled.stats()
+        self.assertEqual(stats['completed'], 2)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['peak_in_flight'], 1)
+        self.assertEqual(stats['rejected'], 0)
+
+
+class AuthenticateRehashTestCase(TestCase):
+    """Tests that logging in upgrades hashes made at an old cost."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        self.log_rounds = hasher.log_rounds
+
+    def tearDown(self):
+        hasher.log_rounds = self.log_rounds
+        db.session.rollback()
+
+    def test_authenticate_rehashes(self):
+        hasher.log_rounds = 4
+        User.signup(username="rehash", email="rehash@test.com",
+                    password="password", image_url=None)
+        db.session.commit()
+
+        hasher.log_rounds = 5
+        user = User.authenticate("rehash", "password")
+        db.session.commit()
+
+        self.assertEqual(hash_cost(user.password), 5)
+        self.assertTrue(User.authenticate("rehash", "password"))
@@ -0,0 +1,96 @@
+"""Query-count tests: list pages must not issue a query per row."""
+
+# run these tests like:
+#
+#    python -m unittest test_query_counts.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app, CURR_USER_KEY
+from testing import QueryCountMixin
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class QueryCountTestCase(QueryCountMixin, TestCase):
+    """Upper bounds on queries per route, with many rows on each page."""
+
+    def setUp(self):
+        """Create a reader who follows, and likes messages by, ten authors."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.reader = User(id=1, email="reader@test.com", username="reader",
+                           password="HASHED_PASSWORD")
+        authors = [User(id=i, email=f"a{i}@test.com", username=f"author{i}",
+                        password="HASHED_PASSWORD")
+                   for i in range(2, 12)]
+        db.session.add(self.reader)
+        db.session.add_all(authors)
+        db.session.commit()
+
+        for author in authors:
+            db.session.add(Follows(user_being_followed_id=author.id,
+                                   user_following_id=1))
+            db.session.add(Follows(user_being_followed_id=1,
+                                   user_following_id=author.id))
+            for n in range(2):
+                msg = Message(text=f"by {author.username}", user_id=author.id)
+                db.session.add(msg)
+                db.session.flush()
+                db.session.add(Likes(user_id=1, message_id=msg.id))
+        db.session.commit()
+        timeline.rebuild()
+        db.session.commit()
+
+        self.message_id = msg.id
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = 1
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def get(self, url):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+    def test_homepage(self):
+        """Feed: user, liked ids and one page of messages with authors."""
+        with self.assertMaxQueries(4):
+            self.get("/")
+
+    def test_profile(self):
+        """Profile: user, one page of messages, viewer and follow state."""
+        with self.assertMaxQueries(5):
+            self.get("/users/2")
+
+    def test_likes(self):
+        """Likes: viewer and one page of liked messages with authors."""
+        with self.assertMaxQueries(3):
+            self.get("/users/likes")
+
+    def test_followers(self):
+        """Followers: viewer, user, one page of cards and follow states."""
+        with self.assertMaxQueries(4):
+            self.get("/users/1/followers")
+
+    def test_following(self):
+        """Following: viewer, user, one page of cards and follow states."""
+        with self.assertMaxQueries(4):
+            self.get("/users/1/following")
+
+    def test_message(self):
+        """Message: message with author, viewer and follow state."""
+        with self.assertMaxQueries(4):
+            self.get(f"/messages/{self.message_id}")
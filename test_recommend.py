@@ -0,0 +1,147 @@
+"""Recommendation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommend.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Follows, Likes, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app, CURR_USER_KEY
+import recommend
+import social
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class RecommendTestCase(TestCase):
+    """Tests for who to follow and trending messages."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        names = ['me', 'friend1', 'friend2', 'popular', 'niche', 'gone']
+        users = [User(username=name, email=f"{name}@test.com",
+                      password="HASHED_PASSWORD") for name in names]
+        db.session.add_all(users)
+        db.session.commit()
+        self.ids = {user.username: user.id for user in users}
+
+        for follower, followed in [('me', 'friend1'), ('me', 'friend2'),
+                                   ('friend1', 'popular'),
+                                   ('friend2', 'popular'),
+                                   ('friend2', 'niche'),
+                                   ('friend1', 'gone'), ('friend1', 'me')]:
+            db.session.add(Follows(user_following_id=self.ids[follower],
+                                   user_being_followed_id=self.ids[followed]))
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        recommend.SUGGESTION_BATCH = 500
+
+    def suggested(self, name):
+        return [user.username
+                for user in recommend.who_to_follow(self.ids[name], limit=10)]
+
+    def like(self, message, at, count=1):
+        for n in range(count):
+            user = User(username=f"liker{message.id}-{at}-{n}",
+                        email=f"liker{message.id}-{at}-{n}@test.com",
+                        password="HASHED_PASSWORD")
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Likes(user_id=user.id, message_id=message.id,
+                                 created_at=at))
+        db.session.commit()
+
+    def test_friends_of_friends(self):
+        """Are users suggested those most followed by those they follow?"""
+
+        recommend.refresh_suggestions([self.ids['me']])
+        db.session.commit()
+
+        self.assertEqual(self.suggested('me'), ['popular', 'niche', 'gone'])
+
+    def test_served_suggestions_stay_current(self):
+        """Are since-followed and deleted users left out without a refresh?"""
+
+        recommend.refresh_suggestions([self.ids['me']])
+        db.session.commit()
+
+        social.follow(User.query.get(self.ids['me']),
+                      User.query.get(self.ids['popular']))
+        User.query.get(self.ids['gone']).deleted_at = datetime.utcnow()
+        db.session.commit()
+
+        self.assertEqual(self.suggested('me'), ['niche'])
+
+    def test_refresh_in_batches(self):
+        """Does the refresh job work through every user, a batch at a time?"""
+
+        recommend.SUGGESTION_BATCH = 2
+        recommend.refresh_suggestions_after()
+        db.session.commit()
+
+        self.assertEqual(self.suggested('me'), ['popular', 'niche', 'gone'])
+        self.assertEqual(self.suggested('friend1'), ['friend2'])
+        self.assertIsNotNone(recommend.last_run('suggestions'))
+
+    def test_trending_decays(self):
+        """Do recent likes outrank more, older ones, and old ones drop off?"""
+
+        now = datetime.utcnow()
+        author = User.query.get(self.ids['popular'])
+        old = social.post_message(author, "old news")
+        new = social.post_message(author, "breaking")
+        db.session.commit()
+
+        # Two likes, two half-lives ago, are worth half of one like now.
+        self.like(old, now - 2 * recommend.TRENDING_HALF_LIFE, count=2)
+        self.like(new, now)
+        recommend.refresh_trending(now)
+        db.session.commit()
+        self.assertEqual([msg.text for msg in recommend.trending()],
+                         ["breaking", "old news"])
+
+        # Refreshes only add new likes; decay applies to what's there.
+        later = now + timedelta(hours=1)
+        self.like(old, later, count=2)
+        recommend.refresh_trending(later)
+        db.session.commit()
+        self.assertEqual([msg.text for msg in recommend.trending()],
+                         ["old news", "breaking"])
+
+        recommend.refresh_trending(later + recommend.TRENDING_WINDOW)
+        db.session.commit()
+        self.assertEqual(recommend.trending(), [])
+
+    def test_pages(self):
+        """Does the anonymous home page show trending, and home suggestions?"""
+
+        author = User.query.get(self.ids['popular'])
+        msg = social.post_message(author, "everyone's talking")
+        db.session.commit()
+        self.like(msg, datetime.utcnow())
+        recommend.refresh_trending()
+        recommend.refresh_suggestions([self.ids['me']])
+        db.session.commit()
+
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn("everyone&#39;s talking", html)
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ids['me']
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn("Who to follow", html)
+        self.assertIn("@popular", html)
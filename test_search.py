@@ -0,0 +1,98 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app
+import search
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class SearchTestCase(TestCase):
+    """Tests for ranked user and message search."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        db.session.add_all([
+            User(id=1, email="a@test.com", username="birdwatcher",
+                 password="HASHED_PASSWORD", bio="I love herons"),
+            User(id=2, email="b@test.com", username="birdsong",
+                 password="HASHED_PASSWORD"),
+            User(id=3, email="c@test.com", username="fisherman",
+                 password="HASHED_PASSWORD", bio="Boats and nets"),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Message(text="Saw a heron by the river today", user_id=3),
+            Message(text="Nothing much happening", user_id=2),
+        ])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_search_users_by_username(self):
+        """Does a partial username find the user?"""
+
+        usernames = [u.username for u in search.search_users("bird").items]
+        self.assertIn("birdwatcher", usernames)
+        self.assertNotIn("fisherman", usernames)
+
+    def test_search_users_by_bio(self):
+        """Does a word from the bio find the user?"""
+
+        usernames = [u.username for u in search.search_users("boats").items]
+        self.assertEqual(usernames, ["fisherman"])
+
+    def test_search_follows_edits(self):
+        """Are renamed users found by their new name only?"""
+
+        user = User.query.get(2)
+        user.username = "nightingale"
+        db.session.commit()
+
+        self.assertEqual([u.id for u in search.search_users("nightingale").items], [2])
+        self.assertNotIn(2, [u.id for u in search.search_users("birdsong").items])
+
+    def test_search_messages(self):
+        """Does message search find and paginate matching warbles?"""
+
+        found = search.search_messages("heron")
+        self.assertEqual([m.text for m in found.items],
+                         ["Saw a heron by the river today"])
+        self.assertFalse(found.has_more)
+        self.assertEqual(search.search_messages("").items, [])
+
+    def test_search_pages(self):
+        """Does search page through results without repeats?"""
+
+        first = search.search_users("bird", per_page=1)
+        self.assertTrue(first.has_more)
+        second = search.search_users("bird", page=2, per_page=1)
+        self.assertFalse(second.has_more)
+        self.assertEqual({u.id for u in first.items + second.items}, {1, 2})
+
+    def test_search_route(self):
+        """Does /search render user and message results?"""
+
+        resp = self.client.get("/search?q=heron&type=messages")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Saw a heron", str(resp.data))
+
+        resp = self.client.get("/search?q=fisher")
+        self.assertIn("@fisherman", str(resp.data))
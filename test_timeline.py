@@ -0,0 +1,107 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
+
+from app import app, CURR_USER_KEY
+import timeline
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Tests for the materialized home timeline."""
+
+    def setUp(self):
+        """Create two users, where u1 follows u2."""
+
+        TimelineEntry.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User(id=9001, email="t1@test.com", username="reader",
+                  password="HASHED_PASSWORD")
+        u2 = User(id=9002, email="t2@test.com", username="author",
+                  password="HASHED_PASSWORD")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_fan_out(self):
+        """Does a new message reach the author's and followers' timelines?"""
+
+        db.session.add(Follows(user_being_followed_id=9002,
+                               user_following_id=9001))
+        m = Message(text="fanned out", user_id=9002)
+        db.session.add(m)
+        db.session.flush()
+        timeline.fan_out(m)
+        db.session.commit()
+
+        self.assertEqual(timeline.home_timeline(9001).items, [m])
+        self.assertEqual(timeline.home_timeline(9002).items, [m])
+
+    def test_backfill_and_prune(self):
+        """Does following copy messages in, and unfollowing remove them?"""
+
+        m = Message(text="older", user_id=9002)
+        db.session.add(m)
+        db.session.commit()
+
+        timeline.backfill(9001, 9002)
+        db.session.commit()
+        self.assertEqual(timeline.home_timeline(9001).items, [m])
+
+        timeline.prune(9001, 9002)
+        db.session.commit()
+        self.assertEqual(timeline.home_timeline(9001).items, [])
+
+    def test_rebuild(self):
+        """Does rebuild reproduce timelines from follows and messages?"""
+
+        db.session.add(Follows(user_being_followed_id=9002,
+                               user_following_id=9001))
+        db.session.add(Message(text="from author", user_id=9002))
+        db.session.add(Message(text="from reader", user_id=9001))
+        db.session.commit()
+
+        self.assertEqual(timeline.rebuild(), 3)
+        db.session.commit()
+        self.assertEqual(len(timeline.home_timeline(9001).items), 2)
+        self.assertEqual(len(timeline.home_timeline(9002).items), 1)
+
+    def test_homepage_reads_timeline(self):
+        """Does a posted message show on a follower's homepage?"""
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = 9001
+            c.post("/users/follow/9002")
+
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = 9002
+            c.post("/messages/new", data={"text": "hello followers"})
+
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = 9001
+            resp = c.get("/")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("hello followers", str(resp.data))
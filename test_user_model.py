@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 
-from models import db, User, Message, Follows
+from models import db, User, Message, Follows, Likes
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -16,11 +16,13 @@ from models import db, User, Message, Follows
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
 
 
 # Now we can import app
 
 from app import app
+import counters
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -148,4 +150,80 @@ class UserModelTestCase(TestCase):
         # tests returns false when given invalid username
         self.assertFalse(User.authenticate("testUser","HASHED_PASSWORD"))
         #tests returns false when given invalid password
-        self.assertFalse(User.authenticate("testuser","HaSHED_PaSSWORD"))
\ No newline at end of file
+        self.assertFalse(User.authenticate("testuser","HaSHED_PaSSWORD"))
+
+    def test_reconcile_counters(self):
+        """Tests that reconcile repairs counters that have drifted"""
+        u1 = User(
+            email="test@test.com",
+            username="testuser",
+            password="HASHED_PASSWORD"
+        )
+        u2 = User(
+            email="test2@test.com",
+            username="testuser2",
+            password="HASHED_PASSWORD",
+            followers_count=5
+        )
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=u2.id, user_following_id=u1.id))
+        db.session.add(Message(text="test", user_id=u1.id))
+        db.session.commit()
+
+        self.assertEqual(counters.reconcile(), 2)
+        db.session.commit()
+        self.assertEqual(u1.following_count, 1)
+        self.assertEqual(u1.messages_count, 1)
+        self.assertEqual(u2.followers_count, 1)
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_followed_among(self):
+        """Tests the batch follow-state lookup"""
+        users = [
+            User(email=f"test{i}@test.com", username=f"testuser{i}",
+                 password="HASHED_PASSWORD")
+            for i in range(4)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        u0, u1, u2, u3 = users
+
+        db.session.add_all([
+            Follows(user_being_followed_id=u1.id, user_following_id=u0.id),
+            Follows(user_being_followed_id=u3.id, user_following_id=u0.id),
+            Follows(user_being_followed_id=u0.id, user_following_id=u2.id),
+        ])
+        db.session.commit()
+
+        self.assertEqual(User.followed_among(u0.id, [u1.id, u2.id, u3.id]),
+                         {u1.id, u3.id})
+        self.assertEqual(User.followed_among(u0.id, []), set())
+
+    def test_liked_among(self):
+        """Tests the batch liked-message lookup"""
+        u1 = User(email="test1@test.com", username="testuser1",
+                  password="HASHED_PASSWORD")
+        u2 = User(email="test2@test.com", username="testuser2",
+                  password="HASHED_PASSWORD")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        messages = [Message(text=f"message {i}", user_id=u2.id)
+                    for i in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+        m0, m1, m2 = messages
+
+        db.session.add_all([
+            Likes(user_id=u1.id, message_id=m0.id),
+            Likes(user_id=u1.id, message_id=m2.id),
+            Likes(user_id=u2.id, message_id=m1.id),
+        ])
+        db.session.commit()
+
+        self.assertEqual(User.liked_among(u1.id, [m0.id, m1.id, m2.id]),
+                         {m0.id, m2.id})
+        self.assertEqual(User.liked_among(u1.id, [m1.id]), set())
+        self.assertEqual(User.liked_among(u1.id, []), set())
@@ -1,18 +1,23 @@
 """User View tests."""
 
 import os
+import re
+from datetime import datetime, timedelta
 from unittest import TestCase
 
 from models import db, connect_db, Message, User, Follows
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['JOB_MODE'] = "inline"
 
 from app import app, CURR_USER_KEY
+from pagination import decode_cursor, encode_cursor
+from testing import QueryCountMixin
 
 app.config['WTF_CSRF_ENABLED'] = False
 
 
-class UserViewTestCase(TestCase):
+class UserViewTestCase(QueryCountMixin, TestCase):
     """Tests views for users"""
 
     def setUp(self):
@@ -167,8 +172,136 @@ class UserViewTestCase(TestCase):
 
         resp2 = c.get(f"/users/{self.u1_id}/following")
         self.assertNotIn("testuser2", str(resp2.data))
-    
-        
 
+    def test_remove_follow_no_user(self):
+        #tests that unfollowing a user who doesn't exist is a 404
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.u1_id
 
+        resp = c.post("/users/stop-following/12345")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_follow_counters(self):
+        #tests that following and unfollowing keep both users' counters in step
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.u1_id
+
+        c.post(f"/users/follow/{self.u3_id}")
+        self.assertEqual(User.query.get(self.u1_id).following_count, 1)
+        self.assertEqual(User.query.get(self.u3_id).followers_count, 1)
+
+        c.post(f"/users/stop-following/{self.u3_id}")
+        self.assertEqual(User.query.get(self.u1_id).following_count, 0)
+        self.assertEqual(User.query.get(self.u3_id).followers_count, 0)
+
+    def test_profile_pagination(self):
+        #tests that profile messages are split into pages joined by a "load more" cursor
+        start = datetime(2020, 1, 1)
+        db.session.add_all([
+            Message(text=f"warble {i}", user_id=self.u3_id,
+                    timestamp=start + timedelta(minutes=i))
+            for i in range(25)
+        ])
+        db.session.commit()
+
+        resp = self.client.get(f"/users/{self.u3_id}")
+        self.assertIn("warble 24", str(resp.data))
+        self.assertNotIn("warble 4<", str(resp.data))
+
+        next_page = re.search(r'href="([^"]*cursor=[^"]*)"', resp.data.decode()).group(1)
+        resp2 = self.client.get(next_page.replace("&amp;", "&"))
+        self.assertIn("warble 4<", str(resp2.data))
+        self.assertIn("warble 0<", str(resp2.data))
+        self.assertNotIn("warble 5<", str(resp2.data))
+        self.assertNotIn("Load more", str(resp2.data))
+
+    def test_tampered_cursor_restarts(self):
+        #tests that a cursor holding values of the wrong types shows the first page
+        msg = Message(text="warble", user_id=self.u3_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        for values in (["2020-01-01T00:00:00", "1"], [1, 1],
+                       ["2020-01-01T00:00:00", True]):
+            with self.subTest(values=values):
+                cursor = encode_cursor(values)
+                self.assertIsNone(decode_cursor(
+                    cursor, [Message.timestamp, Message.id]))
+                resp = self.client.get(f"/users/{self.u3_id}?cursor={cursor}")
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("warble", str(resp.data))
+
+        self.assertEqual(
+            decode_cursor(encode_cursor([datetime(2020, 1, 1), 7]),
+                          [Message.timestamp, Message.id]),
+            (datetime(2020, 1, 1), 7))
+
+    def test_static_request_skips_user_query(self):
+        #tests that requests which never use g.user don't load the user
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.u1_id
+
+            with self.assertMaxQueries(0):
+                resp = c.get("/static/stylesheets/style.css")
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test_profile_edit_refreshes_snapshot(self):
+        #tests that the cached nav-bar user is replaced after editing the profile
+        user = User.signup(username="snapshot", email="snap@test.com",
+                           password="password", image_url=None)
+        db.session.commit()
+        user_id = user.id
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = user_id
+
+            resp = c.get(f"/users/{self.u2_id}")
+            self.assertIn('src="/static/images/default-pic.png" alt="snapshot"',
+                          str(resp.data))
+
+            c.post("/users/profile", data={"username": "snapshot",
+                                           "email": "snap@test.com",
+                                           "image_url": "/new-pic.png",
+                                           "password": "password"})
+            resp = c.get(f"/users/{self.u2_id}")
+            self.assertIn('src="/new-pic.png" alt="snapshot"', str(resp.data))
+
+    def test_user_list_follow_buttons(self):
+        #tests that the users page shows unfollow only for users being followed
+        self.setUpFollowers()
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/users")
+            html = resp.data.decode()
+            self.assertIn(f'action="/users/stop-following/{self.u2_id}"', html)
+            self.assertIn(f'action="/users/follow/{self.u3_id}"', html)
+            self.assertNotIn(f'action="/users/stop-following/{self.u3_id}"', html)
+
+    def test_user_list_pagination(self):
+        #tests that the users page lists users alphabetically, a page at a time
+        db.session.add_all([
+            User(email=f"page{i}@test.com", username=f"page{i:02}",
+                 password="HASHED_PASSWORD")
+            for i in range(25)
+        ])
+        db.session.commit()
 
+        with self.assertMaxQueries(2):
+            resp = self.client.get("/users")
+        html = resp.data.decode()
+        self.assertIn("@page00", html)
+        self.assertIn("@page19", html)
+        self.assertNotIn("@page20", html)
+
+        next_page = re.search(r'href="([^"]*cursor=[^"]*)"', html).group(1)
+        html = self.client.get(next_page.replace("&amp;", "&")).data.decode()
+        self.assertIn("@page20", html)
+        self.assertIn("@user9997", html)
+        self.assertNotIn("@page19", html)
@@ -0,0 +1,39 @@
+"""Helpers shared by Warbler's tests."""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements run inside the block into a list."""
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+
+class QueryCountMixin:
+    """Adds assertMaxQueries() to a TestCase."""
+
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        """Fail if the block runs more than `limit` SQL statements."""
+
+        with count_queries() as statements:
+            yield statements
+
+        if len(statements) > limit:
+            listing = "\n\n".join(statements)
+            self.fail(f"{len(statements)} queries run, expected at most "
+                      f"{limit}:\n\n{listing}")
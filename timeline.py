@@ -0,0 +1,140 @@
+"""Materialized home timelines for Warbler.
+
+Every user has a set of rows in the `timelines` table: one per message that
+belongs on their homepage (their own messages plus those of everyone they
+follow). Posting a message fans it out to the author's followers, following
+someone backfills that user's messages, and unfollowing prunes them. Reading
+the homepage is then a single range scan over one user's rows.
+"""
+
+from sqlalchemy import and_, exists, literal, select, union_all
+
+from loaders import message_cards
+from models import db, Follows, Message, TimelineEntry
+from pagination import PAGE_SIZE, paginate
+
+TIMELINE_COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+timelines = TimelineEntry.__table__
+messages = Message.__table__
+follows = Follows.__table__
+
+
+def fan_out(message):
+    """Add `message` to its author's timeline and every follower's timeline.
+
+    The message must already be flushed so it has an id. Timelines it's
+    already in (backfilled by a follow, say, before this ran as a job) are
+    skipped.
+    """
+
+    def already_there(user_id):
+        return exists().where(and_(timelines.c.user_id == user_id,
+                                   timelines.c.message_id == message.id))
+
+    to_followers = (select([follows.c.user_following_id,
+                            literal(message.id),
+                            literal(message.user_id),
+                            literal(message.timestamp)])
+                    .where(follows.c.user_being_followed_id == message.user_id)
+                    .where(~already_there(follows.c.user_following_id)))
+
+    to_author = (select([literal(message.user_id),
+                         literal(message.id),
+                         literal(message.user_id),
+                         literal(message.timestamp)])
+                 .where(~already_there(message.user_id)))
+
+    db.session.execute(
+        timelines.insert().from_select(TIMELINE_COLUMNS,
+                                       union_all(to_followers, to_author)))
+
+
+def backfill(follower_id, followed_id):
+    """Copy `followed_id`'s messages into `follower_id`'s timeline."""
+
+    already_there = exists().where(and_(
+        timelines.c.user_id == follower_id,
+        timelines.c.message_id == messages.c.id))
+
+    rows = (select([literal(follower_id),
+                    messages.c.id,
+                    messages.c.user_id,
+                    messages.c.timestamp])
+            .where(messages.c.user_id == followed_id)
+            .where(~already_there))
+
+    db.session.execute(timelines.insert().from_select(TIMELINE_COLUMNS, rows))
+
+
+def prune(follower_id, followed_id):
+    """Remove `followed_id`'s messages from `follower_id`'s timeline."""
+
+    db.session.execute(
+        timelines.delete()
+        .where(timelines.c.user_id == follower_id)
+        .where(timelines.c.author_id == followed_id))
+
+
+def home_timeline(user_id, cursor=None, per_page=PAGE_SIZE, query=None):
+    """Return a Page of `user_id`'s home timeline, newest messages first.
+
+    `query` selects what to load per message (by default message cards
+    with their authors); rows need `timestamp` and `id`.
+    """
+
+    if query is None:
+        query = message_cards(Message.query)
+
+    # A deleted author's messages stay in timelines until they're purged.
+    query = (query
+             .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+             .filter(TimelineEntry.user_id == user_id)
+             .filter(Message.user.has(deleted_at=None)))
+
+    return paginate(query,
+                    [TimelineEntry.timestamp, TimelineEntry.message_id],
+                    cursor, per_page,
+                    key=lambda msg: (msg.timestamp, msg.id))
+
+
+def user_messages(user_id, cursor=None, per_page=PAGE_SIZE, query=None):
+    """Return a Page of the messages `user_id` wrote, newest first.
+
+    `query` is as for `home_timeline`; by default message cards without
+    authors (it's the same author throughout).
+    """
+
+    if query is None:
+        query = message_cards(Message.query, with_author=False)
+
+    return paginate(query.filter(Message.user_id == user_id),
+                    [Message.timestamp, Message.id],
+                    cursor, per_page)
+
+
+def rebuild():
+    """Rebuild every user's timeline from the messages and follows tables.
+
+    Returns the number of timeline rows written.
+    """
+
+    from_follows = (select([follows.c.user_following_id,
+                            messages.c.id,
+                            messages.c.user_id,
+                            messages.c.timestamp])
+                    .select_from(follows.join(
+                        messages,
+                        messages.c.user_id == follows.c.user_being_followed_id)))
+
+    from_own = select([messages.c.user_id,
+                       messages.c.id,
+                       messages.c.user_id.label('author_id'),
+                       messages.c.timestamp])
+
+    db.session.execute(timelines.delete())
+    db.session.execute(
+        timelines.insert().from_select(TIMELINE_COLUMNS,
+                                       union_all(from_follows, from_own)))
+
+    return db.session.query(TimelineEntry).count()